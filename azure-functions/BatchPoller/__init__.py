@@ -0,0 +1,184 @@
+import logging
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from datetime import datetime, timezone
+
+from azure.cosmos import exceptions
+
+from shared.audit import audit_log
+from shared.batch import COMPLETED, FAILED, PENDING, get_batch_backend
+from shared.cosmos import evaluations_write, metrics_write
+from Templates.engine import fetch_evaluator
+from EvaluatorRunner import evaluate_item, persist_evaluation
+from EvaluatorRunner.deferred import BATCH_JOBS_PK, deferred_results
+
+
+# Polls of a finished job that could not write every evaluation before
+# the rest are written as failed
+BATCH_POLL_MAX_ATTEMPTS = int(os.getenv("BATCH_POLL_MAX_ATTEMPTS", "5"))
+
+
+# --------------------------------------------------
+# Give up on a pending evaluation
+# --------------------------------------------------
+def failed_evaluation(pending_doc: dict, job: dict, reason: str) -> dict:
+    return {
+        **{k: v for k, v in pending_doc.items() if not k.startswith("_") and k != "deferred"},
+        "status": "failed",
+        "reason": reason,
+        "score": None,
+        "classification": None,
+        "execution_mode": "deferred",
+        "batch_job_id": job["id"],
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+# --------------------------------------------------
+# Finish one batch job's pending evaluations
+# --------------------------------------------------
+def complete_job(job: dict, state: str, give_up: bool = False) -> tuple:
+    """
+    Write the job's pending evaluations. Returns (written, skipped):
+    skipped ones stay pending for the next poll, or with `give_up` are
+    written as failed where their pending doc could be read.
+    """
+
+    responses = {}
+
+    if state == COMPLETED:
+        responses = get_batch_backend(job["backend"]).results(job["batch_id"])
+
+    evaluators = {}
+    written = 0
+    skipped = 0
+
+    for ref in job.get("evaluations", []):
+
+        try:
+            pending_doc = evaluations_write.read_item(ref["id"], partition_key=ref["trace_id"])
+        except exceptions.CosmosResourceNotFoundError:
+            logging.warning(f"[BatchPoller] Pending evaluation {ref['id']} not found")
+            continue
+        except Exception:
+            logging.exception(f"[BatchPoller] Failed to read pending evaluation {ref['id']}")
+            skipped += 1
+            continue
+
+        # Already finished (or re-run inline) since the job was submitted
+        if pending_doc.get("status") != "pending":
+            continue
+
+        evaluator_id = pending_doc["evaluator_id"]
+
+        try:
+            if evaluator_id not in evaluators:
+                evaluators[evaluator_id] = fetch_evaluator(evaluator_id)
+        except Exception:
+            logging.exception(f"[BatchPoller] Failed to load evaluator {evaluator_id} for {ref['id']}")
+            if give_up and persist_evaluation(failed_evaluation(pending_doc, job, f"evaluator_unavailable: {evaluator_id}")):
+                written += 1
+            else:
+                skipped += 1
+            continue
+
+        ev = evaluators[evaluator_id]
+        deferred = pending_doc["deferred"]
+
+        plan = {
+            "evaluator_id": evaluator_id,
+            "evaluator_name": pending_doc.get("evaluator"),
+            "template_id": pending_doc.get("template_id"),
+            "ev": ev,
+            "exec_cfg": ev.get("execution", {}) or {},
+        }
+
+        item = {
+            "trace_id": pending_doc["trace_id"],
+            "eval_id": pending_doc["id"],
+            "trace_timestamp": pending_doc.get("trace_timestamp"),
+            "src_key": deferred["src_key"],
+            "tgt_key": deferred["tgt_key"],
+            "method_scores": deferred["method_scores"],
+            "method_error": None,
+        }
+
+        if state == FAILED:
+            item["method_error"] = RuntimeError(f"Batch job {job['batch_id']} failed")
+
+        doc = evaluate_item(plan, item, results=deferred_results(pending_doc, responses))
+        doc["execution_mode"] = "deferred"
+        doc["batch_job_id"] = job["id"]
+
+        if persist_evaluation(doc):
+            written += 1
+        else:
+            skipped += 1
+
+    return written, skipped
+
+
+# --------------------------------------------------
+# Azure Function Entry
+# --------------------------------------------------
+def main(mytimer):
+
+    try:
+        jobs = list(
+            metrics_write.query_items(
+                query="SELECT * FROM c WHERE c.partitionKey=@pk AND c.status='submitted'",
+                parameters=[{"name": "@pk", "value": BATCH_JOBS_PK}],
+                partition_key=BATCH_JOBS_PK,
+            )
+        )
+    except Exception:
+        logging.exception("[BatchPoller] Failed to load batch jobs")
+        return
+
+    for job in jobs:
+
+        try:
+            state = get_batch_backend(job["backend"]).status(job["batch_id"])
+        except Exception:
+            logging.exception(f"[BatchPoller] Status check failed for {job['id']}")
+            continue
+
+        if state == PENDING:
+            continue
+
+        attempts = job.get("poll_attempts", 0) + 1
+
+        try:
+            written, skipped = complete_job(job, state, give_up=attempts >= BATCH_POLL_MAX_ATTEMPTS)
+        except Exception:
+            logging.exception(f"[BatchPoller] Failed to complete {job['id']}")
+            continue
+
+        job["evaluations_written"] = job.get("evaluations_written", 0) + written
+
+        if skipped and attempts < BATCH_POLL_MAX_ATTEMPTS:
+            # Stays submitted; the next poll retries what is still pending
+            job["poll_attempts"] = attempts
+            job["evaluations_skipped"] = skipped
+            metrics_write.upsert_item({k: v for k, v in job.items() if not k.startswith("_")})
+            logging.warning(f"[BatchPoller] {job['id']}: {skipped} evaluations not written, retrying next poll")
+            continue
+
+        if skipped:
+            logging.error(f"[BatchPoller] {job['id']}: giving up on {skipped} evaluations after {attempts} polls")
+
+        job["status"] = "completed" if state == COMPLETED else "failed"
+        job["completed_at"] = datetime.now(timezone.utc).isoformat()
+        job["evaluations_skipped"] = skipped
+
+        metrics_write.upsert_item({k: v for k, v in job.items() if not k.startswith("_")})
+
+        audit_log(
+            action="Batch Evaluation Completed",
+            type="evaluator",
+            user="system",
+            details=f"Batch job {job['id']} {job['status']}: wrote {job['evaluations_written']}/{len(job.get('evaluations', []))} evaluations",
+        )
+
+        logging.info(f"[BatchPoller] {job['id']} {job['status']} ({job['evaluations_written']} evaluations)")
@@ -0,0 +1,30 @@
+import logging
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from azure.functions import DocumentList
+
+from shared.metrics_feed import apply_change_feed
+from shared.rebuild import RebuildInProgress
+from shared.cosmos import metrics_write
+
+
+# --------------------------------------------------
+# Azure Function Entry: fold evaluations changes into the metrics aggregates
+# --------------------------------------------------
+def main(documents: DocumentList):
+
+    if not documents:
+        return
+
+    try:
+        apply_change_feed(metrics_write, "evaluations", [d.to_dict() for d in documents])
+    except RebuildInProgress:
+        # Redelivered by the retry policy once the rebuild released its lock
+        logging.warning("[EvaluationAggregator] Aggregate rebuild in progress, batch will be retried")
+        raise
+    except Exception:
+        # Anything else would be retried to no end and stall the lease;
+        # the next Aggregator rebuild corrects what this batch missed
+        logging.exception("[EvaluationAggregator] Failed to apply change feed batch, skipping it")
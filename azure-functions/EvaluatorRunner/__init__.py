@@ -4,14 +4,40 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import random
 import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
 from azure.functions import DocumentList
 from azure.cosmos import exceptions
 
 from shared.audit import audit_log
-from shared.cosmos import evaluators_read, evaluations_write
-from Templates.engine import run_evaluator, METHOD_REGISTRY
+from shared.cosmos import evaluators_read, evaluations_write, metrics_write, rca_results_write
+from shared.llm import routing_metrics
+from shared.readiness import mark_completed, register
+from shared.sketches import SCORE_RANGE
+from .deferred import deployments_for, is_deferred, submit_deferred
+from Templates.engine import (
+    EMBEDDING_SINGLE_FLIGHT,
+    run_evaluator,
+    METHOD_REGISTRY,
+    embedding_texts,
+    prefetch_embeddings,
+    score_batch,
+)
+
+
+# One routing-metrics doc per worker instance (breakers live in-process)
+ROUTING_METRICS_PK = "llm_routing"
+ROUTING_INSTANCE_ID = os.getenv("WEBSITE_INSTANCE_ID") or os.getenv("COMPUTERNAME") or "local"
+
+# Evaluations run concurrently per evaluator; the LLM calls share the
+# pooled connections of shared.llm's event loop
+EVALUATOR_CONCURRENCY = int(os.getenv("EVALUATOR_CONCURRENCY", "8"))
+
+# Per-trace plan outcomes besides an existing evaluation's status
+QUEUED = "queued"
+NOT_SAMPLED = "not_sampled"
 
 
 # --------------------------------------------------
@@ -26,427 +52,657 @@ def normalize_trace(trace: dict) -> dict:
     return {
         "input": trace.get("input_text", ""),
         "context": context_text,
+        "context_chunks": retrieved if isinstance(retrieved, list) else [],
+        "context_scores": trace.get("retrieved_scores"),
         "response": trace.get("output_text", ""),
         "_raw": trace,
     }
 
 
 # --------------------------------------------------
-# Azure Function Entry
+# Dynamic Field Selection (Comparison Map)
 # --------------------------------------------------
-def main(documents: DocumentList):
+def resolve_comparison(normalized: dict, exec_cfg: dict):
 
-    logging.info("🔥 EvaluatorRunner TRIGGERED 🔥")
+    cmap = exec_cfg.get("comparison_map", {"source": "context", "target": "response"})
+    src_key = cmap.get("source", "context")
+    tgt_key = cmap.get("target", "response")
 
-    if not documents:
-        logging.warning("[EvaluatorRunner] No documents received")
-        return
+    return src_key, tgt_key, normalized.get(src_key, ""), normalized.get(tgt_key, "")
 
-    trace_count = len(documents)
 
-    logging.info(f"[EvaluatorRunner] Processing {trace_count} traces")
+def trace_timestamp(trace: dict):
+    """
+    The trace's event time (as the metrics rollups bucket it), stamped on
+    its evaluations so a re-evaluation lands in the same bucket.
+    """
+    return (trace.get("request", {}) or {}).get("timestamp") or trace.get("_ts")
 
-    # --------------------------------------------------
-    # Load active evaluators
-    # --------------------------------------------------
 
-    try:
-        evaluators = list(
-            evaluators_read.query_items(
-                query="SELECT * FROM c WHERE c.status = 'active'",
-                enable_cross_partition_query=True,
-            )
-        )
-    except Exception:
-        logging.exception("[EvaluatorRunner] Failed to load evaluators")
-        return
+def lacks_required_context(trace: dict, exec_cfg: dict) -> bool:
 
-    if not evaluators:
-        logging.warning("[EvaluatorRunner] No active evaluators found")
-        return
+    if not exec_cfg.get("requires_context", False):
+        return False
+
+    retrieval = trace.get("retrieval", {}) or {}
+    retrieved_context = trace.get("retrieved_context", []) or []
+
+    return not retrieval.get("executed", False) or not retrieved_context
 
-    # --------------------------------------------------
-    # Process each evaluator
-    # --------------------------------------------------
 
-    for ev in evaluators:
+# --------------------------------------------------
+# Plan: context check, sampling and idempotency per trace
+# --------------------------------------------------
+def plan_evaluator(ev: dict, documents) -> dict:
+
+    evaluator_id = ev.get("id")
+    evaluator_name = ev.get("score_name")
+    template_id = ev.get("template", {}).get("id")
+    exec_cfg = ev.get("execution", {}) or {}
+
+    if not evaluator_id or not template_id:
+        logging.warning(f"[EvaluatorRunner] Invalid evaluator config: {ev}")
+        return None
+
+    plan = {
+        "evaluator_id": evaluator_id,
+        "evaluator_name": evaluator_name,
+        "template_id": template_id,
+        "ev": ev,
+        "exec_cfg": exec_cfg,
+        "items": [],
+        "executed_count": 0,
+        # Written by main() once RCA readiness is registered
+        "skip_docs": [],
+        # trace_id -> queued | not_sampled | status of an existing evaluation
+        "outcomes": {},
+    }
+
+    sampling_rate = exec_cfg.get("sampling_rate", 1.0)
 
-        evaluator_id = ev.get("id")
-        evaluator_name = ev.get("score_name")
-        template_id = ev.get("template", {}).get("id")
-        exec_cfg = ev.get("execution", {}) or {}
+    for trace in documents:
 
-        if not evaluator_id or not template_id:
-            logging.warning(f"[EvaluatorRunner] Invalid evaluator config: {ev}")
+        trace_id = trace.get("trace_id") or trace.get("id")
+
+        if not trace_id:
             continue
 
-        logging.info(f"[EvaluatorRunner] Running evaluator '{evaluator_id}'")
+        eval_id = f"{trace_id}:{evaluator_id}"
 
-        executed_count = 0
+        # --------------------------------------------------
+        # Dynamic context requirement check
+        # --------------------------------------------------
 
-        # Handle ensemble toggle
-        enable_ensemble = ev.get("enable_ensemble", False)
-        
-        all_deployments = exec_cfg.get(
-            "ensemble_deployments",
-            ["gpt-4o-mini"]
-        )
-        
-        # If ensemble is disabled, only use the first model to save quota
-        deployments = all_deployments if enable_ensemble else [all_deployments[0]]
+        if lacks_required_context(trace, exec_cfg):
 
-        variance_threshold = exec_cfg.get("variance_threshold", 0.10)
+            logging.info(
+                f"[EvaluatorRunner] Skipping '{evaluator_name}' for trace {trace_id} "
+                f"(requires_context=true but no retrieval context)"
+            )
 
-        requires_context = exec_cfg.get("requires_context", False)
+            skip_doc = {
+                "id": eval_id,
+                "trace_id": trace_id,
 
-        sampling_rate = exec_cfg.get("sampling_rate", 1.0)
+                "evaluator": evaluator_name,
+                "evaluator_id": evaluator_id,
+                "template_id": template_id,
+
+                "status": "skipped",
+                "reason": "no_retrieval_context",
+
+                "score": None,
+                "classification": None,
+
+                "evaluation_cost_usd": 0,
+
+                "trace_timestamp": trace_timestamp(trace),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+            }
+
+            plan["skip_docs"].append(skip_doc)
+            plan["outcomes"][trace_id] = "skipped"
 
-        delay_ms = exec_cfg.get("delay_ms", 0)
+            continue
 
         # --------------------------------------------------
-        # Iterate traces
+        # Sampling
         # --------------------------------------------------
 
-        for trace in documents:
+        if random.random() > sampling_rate:
+            plan["outcomes"][trace_id] = NOT_SAMPLED
+            continue
 
-            trace_id = trace.get("trace_id") or trace.get("id")
+        # --------------------------------------------------
+        # Idempotency Check
+        # --------------------------------------------------
 
-            if not trace_id:
-                continue
+        try:
+            existing = evaluations_write.read_item(eval_id, partition_key=trace_id)
+            plan["outcomes"][trace_id] = existing.get("status") or "completed"
+            continue
 
-            retrieval = trace.get("retrieval", {}) or {}
-            retrieved_context = trace.get("retrieved_context", []) or []
+        except exceptions.CosmosResourceNotFoundError:
+            pass
 
-            eval_id = f"{trace_id}:{evaluator_id}"
+        except Exception:
+            # Evaluate anyway: the upsert is idempotent, and skipping would
+            # leave RCA readiness without this evaluator
+            logging.exception("[EvaluatorRunner] Idempotency check failed, evaluating anyway")
 
-            # --------------------------------------------------
-            # Dynamic context requirement check
-            # --------------------------------------------------
+        normalized = normalize_trace(trace)
+        src_key, tgt_key, val1, val2 = resolve_comparison(normalized, exec_cfg)
 
-            if requires_context:
+        plan["outcomes"][trace_id] = QUEUED
 
-                retrieval_executed = retrieval.get("executed", False)
+        plan["items"].append({
+            "trace_id": trace_id,
+            "eval_id": eval_id,
+            "trace_timestamp": trace_timestamp(trace),
+            "normalized": normalized,
+            "src_key": src_key,
+            "tgt_key": tgt_key,
+            "pair": (val1, val2),
+            "method_scores": {},
+            "method_error": None,
+        })
 
-                if not retrieval_executed or not retrieved_context:
+    return plan
 
-                    logging.info(
-                        f"[EvaluatorRunner] Skipping '{evaluator_name}' for trace {trace_id} "
-                        f"(requires_context=true but no retrieval context)"
-                    )
 
-                    skip_doc = {
-                        "id": eval_id,
-                        "trace_id": trace_id,
+# --------------------------------------------------
+# Batch method scoring across the whole change-feed batch
+# --------------------------------------------------
+def score_methods(plans: list):
+    """
+    Collect every (val1, val2) pair per method type across all evaluators
+    and traces, embed what the embedding methods need in one bulk pass,
+    then call each method's batch scorer once.
+    """
 
-                        "evaluator": evaluator_name,
-                        "evaluator_id": evaluator_id,
-                        "template_id": template_id,
+    pending = {}
 
-                        "status": "skipped",
-                        "reason": "no_retrieval_context",
+    for plan in plans:
+        for m in plan["exec_cfg"].get("methods", []):
+            method_type = m.get("type")
 
-                        "score": None,
-                        "classification": None,
+            if method_type not in METHOD_REGISTRY:
+                logging.warning(f"[EvaluatorRunner] Unsupported method: {method_type}")
+                continue
 
-                        "evaluation_cost_usd": 0,
+            for item in plan["items"]:
+                pending.setdefault(method_type, []).append(item)
 
-                        "timestamp": datetime.now(timezone.utc).isoformat(),
-                    }
+    if not pending:
+        return
 
-                    try:
-                        evaluations_write.upsert_item(skip_doc)
-                        executed_count += 1
-                    except Exception:
-                        logging.exception("[EvaluatorRunner] Failed to persist skipped evaluation")
+    try:
+        prefetch_embeddings([
+            text
+            for method_type, items in pending.items()
+            for item in items
+            for text in embedding_texts(method_type, *item["pair"])
+        ])
+    except Exception:
+        logging.exception("[EvaluatorRunner] Embedding prefetch failed; methods will embed on demand")
 
-                    continue
+    for method_type, items in pending.items():
 
-            # --------------------------------------------------
-            # Sampling
-            # --------------------------------------------------
+        pairs = [item["pair"] for item in items]
 
-            if random.random() > sampling_rate:
-                continue
+        try:
+            results = score_batch(method_type, pairs)
+        except Exception:
+            logging.exception(
+                f"[EvaluatorRunner] Batch scoring failed for '{method_type}', retrying per pair"
+            )
+            results = []
+            for item, (val1, val2) in zip(items, pairs):
+                try:
+                    results.append(METHOD_REGISTRY[method_type](val1, val2))
+                except Exception as e:
+                    item["method_error"] = e
+                    results.append(None)
 
-            # --------------------------------------------------
-            # Optional delay
-            # --------------------------------------------------
+        for item, result in zip(items, results):
+            item["method_scores"][method_type] = result
 
-            if delay_ms > 0:
-                time.sleep(delay_ms / 1000)
 
-            # --------------------------------------------------
-            # Idempotency Check
-            # --------------------------------------------------
+# --------------------------------------------------
+# Execute one planned evaluation (LLM ensemble + hybrid score)
+# --------------------------------------------------
+def evaluate_item(plan: dict, item: dict, results: dict = None) -> dict:
+    """
+    `results` maps deployment -> run_evaluator-shaped result for
+    deferred runs whose LLM calls already completed in a batch job.
+    """
 
-            try:
-                evaluations_write.read_item(eval_id, partition_key=trace_id)
-                continue
+    evaluator_id = plan["evaluator_id"]
+    evaluator_name = plan["evaluator_name"]
+    template_id = plan["template_id"]
+    exec_cfg = plan["exec_cfg"]
+    ev = plan["ev"]
 
-            except exceptions.CosmosResourceNotFoundError:
-                pass
+    trace_id = item["trace_id"]
+    eval_id = item["eval_id"]
 
-            except Exception:
-                logging.exception("[EvaluatorRunner] Idempotency check failed")
-                continue
+    # Handle ensemble toggle
+    deployments = deployments_for(ev, exec_cfg)
 
-            # --------------------------------------------------
-            # Run ENSEMBLE
-            # --------------------------------------------------
+    variance_threshold = exec_cfg.get("variance_threshold", 0.10)
 
-            start_time = time.time()
+    # --------------------------------------------------
+    # Run ENSEMBLE
+    # --------------------------------------------------
 
-            scores = {}
-            classifications = {}
-            raw_outputs = {}
+    start_time = time.time()
 
-            total_eval_cost = 0.0
+    scores = {}
+    classifications = {}
+    raw_outputs = {}
 
-            llm_ensemble_score = None
-            metric_score = None
-            metric_calculation = "Not calculated"
-            variance = None
-            agreement = None
+    total_eval_cost = 0.0
+    total_prompt_tokens = 0
+    total_cached_tokens = 0
+    total_cache_savings = 0.0
+    context_tokens_trimmed = 0
 
-            try:
+    llm_ensemble_score = None
+    metric_score = None
+    metric_calculation = "Not calculated"
+    variance = None
+    agreement = None
 
-                normalized = normalize_trace(trace)
-                # ---------------------------------------------
-                # Run trace-level evaluation methods (once)
-                # ---------------------------------------------
-                # Dynamic Field Selection (Comparison Map)
-                # ---------------------------------------------
-                cmap = exec_cfg.get("comparison_map", {"source": "context", "target": "response"})
-                src_key = cmap.get("source", "context")
-                tgt_key = cmap.get("target", "response")
-
-                val1 = normalized.get(src_key, "")
-                val2 = normalized.get(tgt_key, "")
-
-                # ---------------------------------------------
-                # Run trace-level evaluation methods (once)
-                # ---------------------------------------------
-                method_scores = {}
-
-                methods = exec_cfg.get("methods", [])
-
-                for m in methods:
-                    method_type = m.get("type")
-                    fn = METHOD_REGISTRY.get(method_type)
-                    if not fn:
-                        logging.warning(f"[EvaluatorRunner] Unsupported method: {method_type}")
-                        continue
-                    method_scores[method_type] = fn(val1, val2)
-
-                # -------------------------------
-                # Aggregate Metric Score (Weighted)
-                # -------------------------------
-                weighted_metric_sum = 0.0
-                total_method_weight = 0.0
-                logic_parts = []
-
-                for m in methods:
-                    m_type = m.get("type")
-                    m_weight = m.get("weight", 0)
-                    m_score = method_scores.get(m_type)
-
-                    if m_score is not None:
-                        # If no weight provided in JSON, default to 1.0 for simple averaging
-                        actual_w = m_weight if m_weight > 0 else 1.0
-                        
-                        weighted_metric_sum += m_score * actual_w
-                        total_method_weight += actual_w
-                        
-                        logic_parts.append(f"({actual_w} * {m_score})")
-
-                metric_calculation = "No metrics"
-                if total_method_weight > 0:
-                    metric_score = round(weighted_metric_sum / total_method_weight, 2)
-                    metric_calculation = f"Weighted Sum ({src_key} vs {tgt_key}): ({' + '.join(logic_parts)}) / {total_method_weight} = {metric_score}"
-                else:
-                    metric_score = None
-
-                for deployment in deployments:
-
-                    result = run_evaluator(
-                        evaluator_id,
-                        normalized,
-                        deployment=deployment,
-                        trace_methods=method_scores
-                    )
-
-                    score = result.get("score")
-                    classification = result.get("classification")
-                    raw_output = result.get("raw_output")
-                    cost = result.get("cost_usd", 0)
-
-                    if isinstance(score, (int, float)):
-                        scores[deployment] = round(float(score), 2)
-
-                    if classification:
-                        classifications[deployment] = classification
-
-                    raw_outputs[deployment] = raw_output
-
-                    total_eval_cost += cost
-
-                # -------------------------------
-                # Aggregate LLM score
-                # -------------------------------
-
-                score_values = list(scores.values())
-
-                llm_ensemble_score = None
-                variance = None
-
-                if score_values:
-
-                    llm_ensemble_score = round(
-                        sum(score_values) / len(score_values),
-                        2
-                    )
-
-                    if len(score_values) > 1:
-
-                        mean = llm_ensemble_score
-
-                        variance = round(
-                            sum((s - mean) ** 2 for s in score_values)
-                            / len(score_values),
-                            4,
-                        )
-
-                # -------------------------------
-                # Hybrid Aggregation (Dynamic Weights)
-                # -------------------------------
-                
-                # Read metric_weight from config, fallback to 0.5
-                metric_weight = exec_cfg.get("metric_weight", 0.5)
+    try:
+
+        if item.get("method_error"):
+            raise item["method_error"]
+
+        normalized = item.get("normalized")
+        src_key, tgt_key = item["src_key"], item["tgt_key"]
+
+        # ---------------------------------------------
+        # Trace-level method scores (batch-scored upfront)
+        # ---------------------------------------------
+        method_scores = item["method_scores"]
+
+        methods = exec_cfg.get("methods", [])
+
+        # -------------------------------
+        # Aggregate Metric Score (Weighted)
+        # -------------------------------
+        weighted_metric_sum = 0.0
+        total_method_weight = 0.0
+        logic_parts = []
+
+        for m in methods:
+            m_type = m.get("type")
+            m_weight = m.get("weight", 0)
+            m_score = method_scores.get(m_type)
+
+            if m_score is not None:
+                # If no weight provided in JSON, default to 1.0 for simple averaging
+                actual_w = m_weight if m_weight > 0 else 1.0
                 
-                # Defensive check: ensure within [0, 1]
-                if not isinstance(metric_weight, (int, float)) or not (0 <= metric_weight <= 1):
-                    metric_weight = 0.5
+                weighted_metric_sum += m_score * actual_w
+                total_method_weight += actual_w
                 
-                # Derive llm_weight
-                llm_weight = round(1.0 - metric_weight, 2)
+                logic_parts.append(f"({actual_w} * {m_score})")
 
-                # Default to 1.0 if no LLM score available to avoid penalizing grounding
-                safe_llm_score = llm_ensemble_score if llm_ensemble_score is not None else 1.0
-                
-                if metric_score is None:
-                    final_score = safe_llm_score
-                else:
-                    final_score = round(
-                        (metric_weight * metric_score) +
-                        (llm_weight * safe_llm_score),
-                        2
-                    )
+        metric_calculation = "No metrics"
+        if total_method_weight > 0:
+            metric_score = round(weighted_metric_sum / total_method_weight, 2)
+            metric_calculation = f"Weighted Sum ({src_key} vs {tgt_key}): ({' + '.join(logic_parts)}) / {total_method_weight} = {metric_score}"
+        else:
+            metric_score = None
+
+        for deployment in deployments:
+
+            if results is not None:
+                result = results.get(deployment) or {}
+            else:
+                result = run_evaluator(
+                    evaluator_id,
+                    normalized,
+                    deployment=deployment,
+                    trace_methods=method_scores
+                )
+
+            score = result.get("score")
+            classification = result.get("classification")
+            raw_output = result.get("raw_output")
+            cost = result.get("cost_usd", 0)
+
+            if isinstance(score, (int, float)):
+                scores[deployment] = round(float(score), 2)
 
-                # -------------------------------
-                # Aggregate classification
-                # -------------------------------
+            if classification:
+                classifications[deployment] = classification
 
-                class_values = list(classifications.values())
+            raw_outputs[deployment] = raw_output
 
-                if not class_values:
+            total_eval_cost += cost
+            total_prompt_tokens += result.get("prompt_tokens", 0) or 0
+            total_cached_tokens += result.get("cached_tokens", 0) or 0
+            total_cache_savings += result.get("cache_savings_usd", 0) or 0
+            context_tokens_trimmed = max(context_tokens_trimmed, result.get("context_tokens_trimmed", 0) or 0)
 
-                    final_classification = None
-                    agreement = None
+        # -------------------------------
+        # Aggregate LLM score
+        # -------------------------------
 
-                elif len(set(class_values)) == 1:
+        score_values = list(scores.values())
 
-                    final_classification = class_values[0]
-                    agreement = 1.0
+        llm_ensemble_score = None
+        variance = None
 
-                else:
+        if score_values:
 
-                    final_classification = "disagreement"
+            llm_ensemble_score = round(
+                sum(score_values) / len(score_values),
+                2
+            )
 
-                    agreement = round(
-                        max(
-                            class_values.count(c)
-                            for c in set(class_values)
-                        )
-                        / len(class_values),
-                        2,
-                    )
+            if len(score_values) > 1:
 
-                # -------------------------------
-                # Stability check
-                # -------------------------------
+                mean = llm_ensemble_score
 
-                unstable = (
-                    variance is not None
-                    and variance > variance_threshold
+                variance = round(
+                    sum((s - mean) ** 2 for s in score_values)
+                    / len(score_values),
+                    4,
                 )
 
-                status = "unstable" if unstable else "completed"
-                reason = None
+        # -------------------------------
+        # Hybrid Aggregation (Dynamic Weights)
+        # -------------------------------
+        
+        # Read metric_weight from config, fallback to 0.5
+        metric_weight = exec_cfg.get("metric_weight", 0.5)
+        
+        # Defensive check: ensure within [0, 1]
+        if not isinstance(metric_weight, (int, float)) or not (0 <= metric_weight <= 1):
+            metric_weight = 0.5
+        
+        # Derive llm_weight
+        llm_weight = round(1.0 - metric_weight, 2)
+
+        # Default to 1.0 if no LLM score available to avoid penalizing grounding
+        safe_llm_score = llm_ensemble_score if llm_ensemble_score is not None else 1.0
+        
+        if metric_score is None:
+            final_score = safe_llm_score
+        else:
+            final_score = round(
+                (metric_weight * metric_score) +
+                (llm_weight * safe_llm_score),
+                2
+            )
+
+        # -------------------------------
+        # Aggregate classification
+        # -------------------------------
+
+        class_values = list(classifications.values())
+
+        if not class_values:
+
+            final_classification = None
+            agreement = None
+
+        elif len(set(class_values)) == 1:
+
+            final_classification = class_values[0]
+            agreement = 1.0
 
-            except Exception as e:
+        else:
 
-                logging.exception(
-                    f"[EvaluatorRunner] Evaluator '{evaluator_id}' failed for trace {trace_id}"
+            final_classification = "disagreement"
+
+            agreement = round(
+                max(
+                    class_values.count(c)
+                    for c in set(class_values)
                 )
+                / len(class_values),
+                2,
+            )
 
-                final_score = None
-                variance = None
-                agreement = None
-                final_classification = "failed"
+        # -------------------------------
+        # Stability check
+        # -------------------------------
 
-                raw_outputs = {"error": str(e)}
+        unstable = (
+            variance is not None
+            and variance > variance_threshold
+        )
 
-                unstable = False
+        status = "unstable" if unstable else "completed"
+        reason = None
 
-                status = "failed"
-                reason = str(e)
+    except Exception as e:
 
-            duration_ms = int((time.time() - start_time) * 1000)
+        logging.exception(
+            f"[EvaluatorRunner] Evaluator '{evaluator_id}' failed for trace {trace_id}"
+        )
 
-            # --------------------------------------------------
-            # Save evaluation record
-            # --------------------------------------------------
+        final_score = None
+        variance = None
+        agreement = None
+        final_classification = "failed"
 
-            doc = {
+        raw_outputs = {"error": str(e)}
 
-                "id": eval_id,
-                "trace_id": trace_id,
+        unstable = False
 
-                "evaluator": evaluator_name,
-                "evaluator_id": evaluator_id,
-                "template_id": template_id,
+        status = "failed"
+        reason = str(e)
 
-                "deployments_used": deployments,
-                "individual_scores": scores,
-                "individual_classifications": classifications,
+    duration_ms = int((time.time() - start_time) * 1000)
 
-                "llm_ensemble_score": llm_ensemble_score,
-                "metric_score": metric_score,
-                "metric_calculation": metric_calculation,
-                
-                "variance": variance,
-                "agreement": agreement,
-                "unstable": unstable,
+    # --------------------------------------------------
+    # Save evaluation record
+    # --------------------------------------------------
 
-                "score": final_score,
-                "classification": final_classification,
-                "raw_output": raw_outputs,
+    doc = {
 
-                "status": status,
-                "reason": reason,
+        "id": eval_id,
+        "trace_id": trace_id,
 
-                "evaluation_cost_usd": round(total_eval_cost, 6),
+        "evaluator": evaluator_name,
+        "evaluator_id": evaluator_id,
+        "template_id": template_id,
 
-                "duration_ms": duration_ms,
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-            }
+        "deployments_used": deployments,
+        "individual_scores": scores,
+        "individual_classifications": classifications,
 
-            try:
-                evaluations_write.upsert_item(doc)
-                executed_count += 1
+        "llm_ensemble_score": llm_ensemble_score,
+        "metric_score": metric_score,
+        "metric_calculation": metric_calculation,
+        
+        "variance": variance,
+        "agreement": agreement,
+        "unstable": unstable,
+
+        "score": final_score,
+        "score_range": exec_cfg.get("score_range") or list(SCORE_RANGE),
+        "classification": final_classification,
+        "raw_output": raw_outputs,
+
+        "status": status,
+        "reason": reason,
+
+        "evaluation_cost_usd": round(total_eval_cost, 6),
+        "prompt_tokens": total_prompt_tokens,
+        "cached_prompt_tokens": total_cached_tokens,
+        "cache_savings_usd": round(total_cache_savings, 6),
+        "context_tokens_trimmed": context_tokens_trimmed,
+
+        "duration_ms": duration_ms,
+        "trace_timestamp": item.get("trace_timestamp"),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+
+    return doc
+
+
+def evaluate_plan(plan: dict):
+
+    delay_ms = plan["exec_cfg"].get("delay_ms", 0)
+
+    # --------------------------------------------------
+    # Optional delay: keep these evaluators sequential
+    # --------------------------------------------------
+
+    if delay_ms > 0:
+        for item in plan["items"]:
+            time.sleep(delay_ms / 1000)
+            yield evaluate_item(plan, item)
+        return
+
+    with ThreadPoolExecutor(max_workers=max(1, EVALUATOR_CONCURRENCY)) as pool:
+        yield from pool.map(lambda item: evaluate_item(plan, item), plan["items"])
+
+
+# --------------------------------------------------
+# RCA readiness: which evaluators each trace waits for
+# --------------------------------------------------
+def register_readiness(plans: list):
+
+    by_trace = defaultdict(lambda: {"expected": [], "completed": {}, "not_sampled": []})
+
+    for plan in plans:
+
+        name = plan["evaluator_name"]
+
+        if not name:
+            continue
+
+        for trace_id, outcome in plan["outcomes"].items():
+
+            record = by_trace[trace_id]
+
+            if outcome == NOT_SAMPLED:
+                record["not_sampled"].append(name)
+                continue
+
+            record["expected"].append(name)
+
+            # Skipped now, or evaluated by an earlier delivery
+            if outcome not in (QUEUED, "pending"):
+                record["completed"][name] = outcome
+
+    for trace_id, record in by_trace.items():
+        try:
+            register(rca_results_write, trace_id, **record)
+        except Exception:
+            logging.exception(f"[EvaluatorRunner] Failed to register RCA readiness for {trace_id}")
+
+
+def persist_evaluation(doc: dict) -> bool:
+    """
+    Readiness first, then the evaluation doc: RCAEngine is triggered by
+    the doc and must find the evaluator already marked.
+    """
+    try:
+        mark_completed(rca_results_write, doc["trace_id"], doc.get("evaluator"), doc.get("status"))
+    except Exception:
+        logging.exception("[EvaluatorRunner] Failed to update RCA readiness")
+
+    try:
+        evaluations_write.upsert_item(doc)
+        return True
+    except Exception:
+        logging.exception("[EvaluatorRunner] Failed to persist evaluation")
+        return False
+
+
+# --------------------------------------------------
+# Azure Function Entry
+# --------------------------------------------------
+def main(documents: DocumentList):
+
+    logging.info("🔥 EvaluatorRunner TRIGGERED 🔥")
+
+    if not documents:
+        logging.warning("[EvaluatorRunner] No documents received")
+        return
+
+    trace_count = len(documents)
 
+    logging.info(f"[EvaluatorRunner] Processing {trace_count} traces")
+
+    # --------------------------------------------------
+    # Load active evaluators
+    # --------------------------------------------------
+
+    try:
+        evaluators = list(
+            evaluators_read.query_items(
+                query="SELECT * FROM c WHERE c.status = 'active'",
+                enable_cross_partition_query=True,
+            )
+        )
+    except Exception:
+        logging.exception("[EvaluatorRunner] Failed to load evaluators")
+        return
+
+    if not evaluators:
+        logging.warning("[EvaluatorRunner] No active evaluators found")
+        return
+
+    # --------------------------------------------------
+    # Plan every evaluator, then score methods batch-wide
+    # --------------------------------------------------
+
+    plans = [p for p in (plan_evaluator(ev, documents) for ev in evaluators) if p]
+
+    score_methods(plans)
+
+    # --------------------------------------------------
+    # RCA readiness before any evaluation doc is written
+    # --------------------------------------------------
+
+    register_readiness(plans)
+
+    for plan in plans:
+        for skip_doc in plan["skip_docs"]:
+            try:
+                evaluations_write.upsert_item(skip_doc)
+                plan["executed_count"] += 1
             except Exception:
-                logging.exception("[EvaluatorRunner] Failed to persist evaluation")
+                logging.exception("[EvaluatorRunner] Failed to persist skipped evaluation")
+
+    # --------------------------------------------------
+    # Deferred evaluators: hand off to the batch API
+    # --------------------------------------------------
+
+    deferred = [p for p in plans if is_deferred(p) and p["items"]]
+
+    if deferred:
+        try:
+            queued = submit_deferred(deferred)
+            logging.info(f"[EvaluatorRunner] Queued {queued} deferred evaluations")
+
+        except Exception:
+            logging.exception("[EvaluatorRunner] Batch submission failed; running deferred evaluators inline")
+
+    # --------------------------------------------------
+    # Process each evaluator
+    # --------------------------------------------------
+
+    for plan in plans:
+
+        evaluator_id = plan["evaluator_id"]
+
+        logging.info(f"[EvaluatorRunner] Running evaluator '{evaluator_id}'")
+
+        executed_count = plan["executed_count"]
+
+        for doc in evaluate_plan(plan):
+            if persist_evaluation(doc):
+                executed_count += 1
 
         # --------------------------------------------------
         # Audit Log
@@ -462,4 +718,29 @@ def main(documents: DocumentList):
         logging.info(
             f"[EvaluatorRunner] Completed evaluator '{evaluator_id}' "
             f"({executed_count}/{trace_count})"
-        )
\ No newline at end of file
+        )
+
+    # --------------------------------------------------
+    # Publish breaker, routing + coalescing state
+    # --------------------------------------------------
+
+    llm_metrics = routing_metrics()
+    embedding_single_flight = EMBEDDING_SINGLE_FLIGHT.stats()
+
+    logging.info(
+        f"[EvaluatorRunner] Coalesced requests so far: "
+        f"llm={llm_metrics['llm_single_flight']['coalesced']} "
+        f"embedding={embedding_single_flight['coalesced']}"
+    )
+
+    try:
+        metrics_write.upsert_item({
+            "id": f"llm_routing:{ROUTING_INSTANCE_ID}",
+            "partitionKey": ROUTING_METRICS_PK,
+            "instance_id": ROUTING_INSTANCE_ID,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            **llm_metrics,
+            "embedding_single_flight": embedding_single_flight,
+        })
+    except Exception:
+        logging.exception("[EvaluatorRunner] Failed to persist routing metrics")
@@ -0,0 +1,204 @@
+import logging
+import uuid
+from datetime import datetime, timezone
+
+from shared.batch import BATCH_PRICE_FACTOR, chat_request, get_batch_backend
+from shared.cosmos import evaluations_write, metrics_write
+from Templates.engine import finish_evaluation, prepare_evaluation
+
+
+# Evaluators with execution.execution_mode == "deferred" go through the
+# provider batch API; BatchPoller finishes them when the job completes.
+DEFERRED_MODE = "deferred"
+BATCH_JOBS_PK = "batch_jobs"
+
+
+def is_deferred(plan: dict) -> bool:
+    return plan["exec_cfg"].get("execution_mode") == DEFERRED_MODE
+
+
+def deployments_for(ev: dict, exec_cfg: dict) -> list:
+
+    all_deployments = exec_cfg.get(
+        "ensemble_deployments",
+        ["gpt-4o-mini"]
+    )
+
+    # If ensemble is disabled, only use the first model to save quota
+    return all_deployments if ev.get("enable_ensemble", False) else [all_deployments[0]]
+
+
+def _upsert_quietly(job: dict):
+    try:
+        metrics_write.upsert_item(job)
+    except Exception:
+        logging.exception(f"[EvaluatorRunner] Failed to record batch job {job['id']} as {job['status']}")
+
+
+# --------------------------------------------------
+# Submit: prompts -> batch JSONL -> pending evaluation docs
+# --------------------------------------------------
+def submit_deferred(plans: list) -> int:
+    """
+    Render every deferred item's prompts, submit them as one batch job
+    and write "pending" evaluation docs carrying what BatchPoller needs
+    to finish them. Queued items are removed from their plan; whatever
+    is left runs inline. Returns the number of evaluations queued.
+    """
+
+    requests = []
+    pending_docs = []
+
+    for plan in plans:
+
+        deployments = deployments_for(plan["ev"], plan["exec_cfg"])
+
+        for item in plan["items"]:
+
+            prepared_by_deployment = {}
+
+            try:
+                if item.get("method_error"):
+                    raise item["method_error"]
+
+                for deployment in deployments:
+
+                    prepared = prepare_evaluation(
+                        plan["evaluator_id"],
+                        item["normalized"],
+                        deployment=deployment
+                    )
+
+                    custom_id = f"r{len(requests)}"
+
+                    requests.append(chat_request(
+                        custom_id,
+                        prepared["model"],
+                        prepared.pop("prompt"),
+                        **prepared["llm_kwargs"]
+                    ))
+
+                    prepared_by_deployment[deployment] = {"custom_id": custom_id, **prepared}
+
+            except Exception as e:
+                logging.exception(
+                    f"[EvaluatorRunner] Could not prepare deferred evaluation {item['eval_id']}"
+                )
+                # Left in plan["items"] so the runner records the failure inline
+                item["method_error"] = e
+                continue
+
+            pending_docs.append({
+                "id": item["eval_id"],
+                "trace_id": item["trace_id"],
+
+                "evaluator": plan["evaluator_name"],
+                "evaluator_id": plan["evaluator_id"],
+                "template_id": plan["template_id"],
+
+                "status": "pending",
+                "reason": "deferred_batch",
+
+                "score": None,
+                "classification": None,
+
+                "evaluation_cost_usd": 0,
+
+                "trace_timestamp": item.get("trace_timestamp"),
+
+                "deferred": {
+                    "src_key": item["src_key"],
+                    "tgt_key": item["tgt_key"],
+                    "method_scores": item["method_scores"],
+                    "requests": prepared_by_deployment,
+                },
+
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+            })
+
+    if not requests:
+        return 0
+
+    backend = get_batch_backend()
+
+    job_id = f"batch:{uuid.uuid4().hex}"
+
+    job = {
+        "id": job_id,
+        "partitionKey": BATCH_JOBS_PK,
+        "backend": backend.name,
+        "batch_id": None,
+        "status": "submitting",
+        "request_count": len(requests),
+        "evaluations": [{"id": d["id"], "trace_id": d["trace_id"]} for d in pending_docs],
+        "submitted_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+    # Written before the provider batch exists: if this fails nothing has
+    # been paid for and the caller runs the items inline
+    metrics_write.upsert_item(job)
+
+    try:
+        batch_id = backend.submit(requests)
+    except Exception:
+        job["status"] = "failed"
+        _upsert_quietly(job)
+        raise
+
+    job["batch_id"] = batch_id
+    job["status"] = "submitted"
+
+    try:
+        metrics_write.upsert_item(job)
+    except Exception:
+        # BatchPoller only sees submitted jobs, so this batch would be paid
+        # for and never collected; cancel it and let the caller run inline
+        try:
+            backend.cancel(batch_id)
+        except Exception:
+            logging.exception(f"[EvaluatorRunner] Could not cancel untracked batch {batch_id}")
+        job["status"] = "cancelled"
+        _upsert_quietly(job)
+        raise
+
+    queued = set()
+
+    for doc in pending_docs:
+        doc["batch_job_id"] = job_id
+        try:
+            evaluations_write.upsert_item(doc)
+            queued.add(doc["id"])
+        except Exception:
+            logging.exception("[EvaluatorRunner] Failed to persist pending evaluation")
+
+    for plan in plans:
+        remaining = [i for i in plan["items"] if i["eval_id"] not in queued]
+        plan["executed_count"] += len(plan["items"]) - len(remaining)
+        plan["items"] = remaining
+
+    logging.info(
+        f"[EvaluatorRunner] Submitted {len(requests)} requests as {backend.name} batch {batch_id} ({job_id})"
+    )
+
+    return len(queued)
+
+
+# --------------------------------------------------
+# Complete: batch responses -> run_evaluator-shaped results
+# --------------------------------------------------
+def deferred_results(pending_doc: dict, responses: dict) -> dict:
+    """
+    deployment -> finish_evaluation() result for one pending evaluation.
+    """
+
+    deferred = pending_doc["deferred"]
+
+    return {
+        deployment: finish_evaluation(
+            prepared,
+            responses.get(prepared["custom_id"]),
+            trace_methods=deferred["method_scores"],
+            price_factor=BATCH_PRICE_FACTOR
+        )
+        for deployment, prepared in deferred["requests"].items()
+    }
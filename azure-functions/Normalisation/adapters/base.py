@@ -24,4 +24,39 @@ class BaseProviderAdapter:
                 )
             )
 
-        return spans
\ No newline at end of file
+        return spans
+
+    def extract_retrieved_scores(self, raw: Dict[str, Any]) -> List[float]:
+        """
+        Retrieval scores aligned with extract_retrieved_context: a
+        document's own "score" if present, else metadata.scores[i].
+        """
+
+        scores: List[float] = []
+
+        for span in raw.get("spans") or []:
+
+            if span.get("type") != "retrieval":
+                continue
+
+            meta = span.get("metadata", {}) or {}
+
+            docs = meta.get("documents", []) or []
+            span_scores = meta.get("scores", []) or []
+
+            for i, doc in enumerate(docs):
+
+                if isinstance(doc, dict):
+                    content = doc.get("content") or doc.get("content_preview")
+                    score = doc.get("score")
+                else:
+                    content = str(doc)
+                    score = None
+
+                if score is None and i < len(span_scores):
+                    score = span_scores[i]
+
+                if content:
+                    scores.append(float(score) if score is not None else 0.0)
+
+        return scores
\ No newline at end of file
@@ -73,6 +73,7 @@ def normalize_trace(raw: Dict[str, Any]) -> CanonicalTrace:
     # --------------------------------------------------------
     retrieval = adapter.extract_retrieval(raw)
     retrieved_context = adapter.extract_retrieved_context(raw)
+    retrieved_scores = adapter.extract_retrieved_scores(raw)
 
     # --------------------------------------------------------
     # Span extraction
@@ -93,6 +94,7 @@ def normalize_trace(raw: Dict[str, Any]) -> CanonicalTrace:
         input_text=extract_input(raw),
         output_text=extract_output(raw),
         retrieved_context=retrieved_context,
+        retrieved_scores=retrieved_scores or None,
 
         session=SessionInfo(
             session_id=str(raw.get("session_id", "unknown")),
@@ -147,6 +147,7 @@ class CanonicalTrace(BaseSchema):
     input_text: Optional[str] = None
     output_text: Optional[str] = None
     retrieved_context: Optional[List[str]] = None
+    retrieved_scores: Optional[List[float]] = None
 
     session: SessionInfo
     request: RequestInfo
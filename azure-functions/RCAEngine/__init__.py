@@ -1,9 +1,28 @@
 import logging
+import sys
 import azure.functions as func
-from azure.cosmos import CosmosClient
+from azure.core import MatchConditions
+from azure.cosmos import CosmosClient, exceptions
 import os
-from typing import Set
-from .rca_rules import analyze_trace
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Set
+from shared.readiness import (
+    DONE,
+    RAW_TRACE_MISSING,
+    WAITING,
+    claim,
+    claim_new,
+    fail_attempt,
+    finish,
+    is_ready,
+    missing,
+    new_readiness,
+    read_readiness,
+)
+from .rca_rules import eval_inputs, run_rules, summarize, trace_inputs
 
 logger = logging.getLogger("rca_engine")
 
@@ -17,17 +36,39 @@ RCA = DB.get_container_client("rca_results")
 EVALUATORS = DB.get_container_client("evaluators")  # registry
 
 
+# Active-evaluator registry is re-read at most this often
+REQUIRED_EVALUATORS_TTL_SECONDS = float(os.getenv("RCA_EVALUATORS_TTL_SECONDS", "60"))
+
+# trace_ids per IN (...) query
+QUERY_CHUNK_SIZE = int(os.getenv("RCA_QUERY_CHUNK_SIZE", "50"))
+
+# Evaluation fields the RCA rules read
+EVAL_FIELDS = "c.trace_id, c.evaluator, c.status, c.score"
+
+# Attempts at an etag-guarded RCA refresh before giving up on the batch
+REFRESH_CONFLICT_RETRIES = 3
+
+
 # ============================================================
 # DYNAMIC REQUIRED EVALUATORS (BASED ON YOUR SCHEMA)
 # ============================================================
 
+_required_cache = {"value": None, "expires_at": 0.0}
+
+
 def get_required_evaluators() -> Set[str]:
     """
     Load required evaluators dynamically.
     All evaluators with status='active'
     are required before RCA runs.
+    Cached per worker for REQUIRED_EVALUATORS_TTL_SECONDS.
     """
 
+    now = time.monotonic()
+
+    if _required_cache["value"] is not None and now < _required_cache["expires_at"]:
+        return _required_cache["value"]
+
     query = """
         SELECT c.score_name
         FROM c
@@ -41,95 +82,126 @@ def get_required_evaluators() -> Set[str]:
 
     required = {item["score_name"] for item in items}
 
+    _required_cache.update(value=required, expires_at=now + REQUIRED_EVALUATORS_TTL_SECONDS)
+
     logger.info(f"[RCA CONFIG] Active evaluators required: {required}")
     return required
 
 
 # ============================================================
-# MAIN FUNCTION
+# BATCH LOADING
 # ============================================================
 
-def main(docs: func.DocumentList):
+def query_by_trace_ids(container, trace_ids: List[str], select: str = "*") -> Dict[str, list]:
+    """
+    Docs for many traces with chunked IN queries, grouped by trace_id.
+    """
 
-    if not docs:
-        return
+    grouped = defaultdict(list)
 
-    required = get_required_evaluators()
+    for i in range(0, len(trace_ids), QUERY_CHUNK_SIZE):
 
-    for doc in docs:
+        chunk = trace_ids[i:i + QUERY_CHUNK_SIZE]
+        names = [f"@t{j}" for j in range(len(chunk))]
 
-        eval_doc = doc.to_dict()
-        trace_id = eval_doc.get("trace_id")
+        items = container.query_items(
+            query=f"SELECT {select} FROM c WHERE c.trace_id IN ({', '.join(names)})",
+            parameters=[{"name": n, "value": tid} for n, tid in zip(names, chunk)],
+            enable_cross_partition_query=True
+        )
 
-        if not trace_id:
-            logger.warning("[RCA SKIP] Missing trace_id")
-            continue
+        for item in items:
+            grouped[item.get("trace_id")].append(item)
 
-        logger.info(f"[RCA CHECK] Processing trace {trace_id}")
+    return grouped
 
-        # --------------------------------------------------------
-        # Load evaluator results for this trace
-        # --------------------------------------------------------
 
-        query = """
-            SELECT * FROM c
-            WHERE c.trace_id = @trace_id
-        """
+# ============================================================
+# RCA RUN (claimed traces only)
+# ============================================================
 
-        eval_items = list(EVALS.query_items(
-            query=query,
-            parameters=[{"name": "@trace_id", "value": trace_id}],
-            enable_cross_partition_query=True
-        ))
+def completed_evals(evals: list) -> list:
+    # Deferred (batch) evaluations are not done until BatchPoller finishes them
+    return [e for e in evals if e.get("status") != "pending"]
 
-        present = {e.get("evaluator") for e in eval_items}
 
-        # --------------------------------------------------------
-        # Wait if not all active evaluators completed
-        # --------------------------------------------------------
+def claim_untracked(trace_ids: List[str], evals_by_trace: Dict[str, list], refresh: List[str]) -> Dict[str, dict]:
+    """
+    Traces evaluated before readiness records existed: the old
+    evaluations-vs-registry check, claimed by creating their record.
+    Traces that already have an RCA are appended to `refresh`.
+    """
+
+    required = get_required_evaluators()
+
+    existing = query_by_trace_ids(RCA, trace_ids, "c.trace_id")
+
+    claimed = {}
+
+    for trace_id in trace_ids:
+
+        if trace_id in existing:
+            refresh.append(trace_id)
+            continue
+
+        present = {
+            e.get("evaluator"): e.get("status")
+            for e in completed_evals(evals_by_trace.get(trace_id, []))
+        }
 
         if not required.issubset(present):
             logger.info(
                 f"[RCA WAIT] {trace_id} "
-                f"Required={required}, Present={present}"
+                f"Required={required}, Present={set(present)}"
             )
             continue
 
-        # --------------------------------------------------------
-        # Prevent duplicate RCA generation
-        # --------------------------------------------------------
+        if claim_new(RCA, trace_id, required, present):
+            claimed[trace_id] = new_readiness(trace_id, required, present, [])
 
-        existing = list(RCA.query_items(
-            query="SELECT * FROM c WHERE c.trace_id = @trace_id",
-            parameters=[{"name": "@trace_id", "value": trace_id}],
-            enable_cross_partition_query=True
-        ))
+    return claimed
 
-        if existing:
-            logger.info(f"[RCA SKIP] RCA already exists for {trace_id}")
-            continue
 
-        # --------------------------------------------------------
-        # Load raw trace
-        # --------------------------------------------------------
+def run_rca(claimed: Dict[str, dict], trigger: str, evals_by_trace: Dict[str, list] = None):
+    """
+    Analyze and write RCA for traces whose readiness record this worker
+    claimed, then mark the records done.
+    """
 
-        raw_items = list(RAW.query_items(
-            query="SELECT * FROM c WHERE c.trace_id = @trace_id",
-            parameters=[{"name": "@trace_id", "value": trace_id}],
-            enable_cross_partition_query=True
-        ))
+    if not claimed:
+        return
+
+    trace_ids = list(claimed)
+
+    if evals_by_trace is None:
+        evals_by_trace = query_by_trace_ids(EVALS, trace_ids, EVAL_FIELDS)
+
+    # --------------------------------------------------------
+    # Load raw traces
+    # --------------------------------------------------------
+
+    raw_by_trace = query_by_trace_ids(RAW, trace_ids)
+
+    for trace_id, record in claimed.items():
+
+        raw_items = raw_by_trace.get(trace_id)
 
         if not raw_items:
-            logger.error(f"[RCA ERROR] Raw trace missing: {trace_id}")
+            # Stays claimed and RCATimeout retries once the claim is stale,
+            # up to RCA_MAX_ATTEMPTS
+            gave_up = fail_attempt(RCA, {**record, "trace_id": trace_id}, trigger, RAW_TRACE_MISSING)
+            logger.error(f"[RCA ERROR] Raw trace missing: {trace_id}{' (giving up)' if gave_up else ''}")
             continue
 
-        raw_trace = raw_items[0]
+        telemetry = trace_inputs(raw_items[0])
+        eval_items = completed_evals(evals_by_trace.get(trace_id, []))
 
         # --------------------------------------------------------
         # Run RCA logic
         # --------------------------------------------------------
 
-        findings, evidence, suggestions = analyze_trace(raw_trace, eval_items)
+        rules, _ = run_rules({**telemetry, **eval_inputs(eval_items)})
+        findings, evidence, suggestions = summarize(rules)
 
         # --------------------------------------------------------
         # Write RCA result
@@ -142,9 +214,169 @@ def main(docs: func.DocumentList):
             "evidence": evidence,
             "suggestions": suggestions,
             "status": "completed",
-            "evaluators_used": list(required)
+            "trigger": trigger,
+            "evaluators_used": sorted({e.get("evaluator") for e in eval_items if e.get("evaluator")}),
+            "missing_evaluators": missing(record),
+            "not_sampled_evaluators": sorted(record.get("not_sampled") or {}),
+            # Kept for incremental re-evaluation (refresh_rca)
+            "trace_inputs": telemetry,
+            "rules": rules,
         }
 
         RCA.upsert_item(rca_doc)
+        finish(RCA, trace_id, trigger)
+
+        logger.info(f"[RCA DONE] RCA generated for {trace_id} ({trigger})")
+
+
+# ============================================================
+# RCA REFRESH (late or re-run evaluations)
+# ============================================================
+
+def refresh_rca(records: Dict[str, dict], evals_by_trace: Dict[str, list]):
+    """
+    Re-run only the rules whose inputs changed and merge their results
+    into the existing RCA doc. `records` maps trace_id to its readiness
+    record (None for untracked traces).
+    """
+
+    rca_docs = {}
+
+    for trace_id in records:
+        try:
+            rca_docs[trace_id] = RCA.read_item(f"{trace_id}:rca", partition_key=trace_id)
+        except exceptions.CosmosResourceNotFoundError:
+            logger.warning(f"[RCA REFRESH] No RCA doc for {trace_id}")
+
+    # RCA docs written before rule tracking have no stored telemetry
+    raw_by_trace = query_by_trace_ids(RAW, [t for t, d in rca_docs.items() if "trace_inputs" not in d])
+
+    for trace_id, rca_doc in rca_docs.items():
+
+        if "trace_inputs" not in rca_doc:
+
+            raw_items = raw_by_trace.get(trace_id)
+
+            if not raw_items:
+                logger.error(f"[RCA ERROR] Raw trace missing: {trace_id}")
+                continue
+
+            rca_doc["trace_inputs"] = trace_inputs(raw_items[0])
+
+        eval_items = completed_evals(evals_by_trace.get(trace_id, []))
+        inputs = {**rca_doc["trace_inputs"], **eval_inputs(eval_items)}
+
+        for _ in range(REFRESH_CONFLICT_RETRIES):
+
+            # A bulk re-run stores the thresholds it was computed with
+            rules, rerun = run_rules(inputs, rca_doc.get("rules"), rca_doc.get("thresholds"))
+
+            if not rerun:
+                logger.info(f"[RCA SKIP] {trace_id} inputs unchanged")
+                break
+
+            findings, evidence, suggestions = summarize(rules)
+
+            rca_doc.update({
+                "findings": findings,
+                "evidence": evidence,
+                "suggestions": suggestions,
+                "evaluators_used": sorted({e.get("evaluator") for e in eval_items if e.get("evaluator")}),
+                "rules": rules,
+                "refreshed_rules": rerun,
+                "refreshed_at": datetime.now(timezone.utc).isoformat(),
+            })
+
+            if records[trace_id] is not None:
+                rca_doc["missing_evaluators"] = missing(records[trace_id])
+
+            try:
+                RCA.replace_item(
+                    rca_doc["id"],
+                    rca_doc,
+                    etag=rca_doc["_etag"],
+                    match_condition=MatchConditions.IfNotModified
+                )
+                logger.info(f"[RCA REFRESH] {trace_id} re-ran {rerun}")
+                break
+
+            except exceptions.CosmosAccessConditionFailedError:
+                rca_doc = {
+                    "trace_inputs": rca_doc["trace_inputs"],
+                    **RCA.read_item(f"{trace_id}:rca", partition_key=trace_id),
+                }
+
+
+# ============================================================
+# MAIN FUNCTION
+# ============================================================
+
+def main(docs: func.DocumentList):
+
+    if not docs:
+        return
+
+    # --------------------------------------------------------
+    # Collapse the batch to distinct traces
+    # --------------------------------------------------------
+
+    trace_ids = []
+
+    for doc in docs:
+
+        trace_id = doc.to_dict().get("trace_id")
+
+        if not trace_id:
+            logger.warning("[RCA SKIP] Missing trace_id")
+            continue
+
+        if trace_id not in trace_ids:
+            trace_ids.append(trace_id)
+
+    if not trace_ids:
+        return
+
+    logger.info(f"[RCA CHECK] {len(docs)} evaluation changes -> {len(trace_ids)} traces")
+
+    # --------------------------------------------------------
+    # Readiness: one point read per trace, claim exactly once
+    # --------------------------------------------------------
+
+    claimed = {}
+    done = {}
+    untracked = []
+
+    for trace_id in trace_ids:
+
+        record = read_readiness(RCA, trace_id)
+
+        if record is None:
+            untracked.append(trace_id)
+            continue
+
+        if record.get("rca_status") == DONE:
+            done[trace_id] = record
+            continue
+
+        if record.get("rca_status") != WAITING:
+            logger.info(f"[RCA SKIP] {trace_id} RCA already {record.get('rca_status')}")
+            continue
+
+        if not is_ready(record):
+            logger.info(f"[RCA WAIT] {trace_id} Missing={missing(record)}")
+            continue
+
+        if claim(RCA, trace_id):
+            claimed[trace_id] = record
+
+    evals_by_trace = query_by_trace_ids(EVALS, list(claimed) + list(done) + untracked, EVAL_FIELDS)
+
+    if untracked:
+        refresh = []
+        claimed.update(claim_untracked(untracked, evals_by_trace, refresh))
+        done.update(dict.fromkeys(refresh))
+
+    run_rca(claimed, "complete", evals_by_trace)
 
-        logger.info(f"[RCA DONE] RCA generated for {trace_id}")
\ No newline at end of file
+    if done:
+        refresh_rca(done, evals_by_trace)
@@ -0,0 +1,345 @@
+"""
+Columnar RCA for threshold what-ifs and bulk re-runs.
+
+✔ Loads the rule inputs for a time window once into numpy arrays
+  (same extraction as rca_rules: trace_inputs / eval_inputs)
+✔ Every finding is a vectorized boolean mask over all traces, so a
+  candidate THRESHOLDS set is a handful of array ops
+✔ what_if(): finding counts, affected trace ids and the shift against
+  the current THRESHOLDS per candidate set
+✔ write_rca_docs(): re-runs the rules under the new thresholds for
+  traces whose RCA doc was computed with other thresholds (as stored on
+  the doc), on a thread pool, and stores them so later incremental
+  refreshes keep using them
+
+Usage (e.g. from a notebook with the Functions app on sys.path):
+
+    cols = load_columns(RAW, EVALS, start, end, rca_container=RCA)
+    what_if(cols, {"strict": {"hallucination": 0.7}})
+    write_rca_docs(RCA, cols, {"hallucination": 0.7})
+"""
+
+import logging
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import numpy as np
+from azure.cosmos import exceptions
+
+from shared.rebuild import REBUILD_PAGE_SIZE, REBUILD_WORKERS, scan_ranges
+from .rca_rules import THRESHOLDS, eval_inputs, run_rules, summarize, trace_inputs
+
+
+# ============================================================
+# CONFIGURATION
+# ============================================================
+
+BULK_WRITE_WORKERS = int(os.getenv("RCA_BULK_WRITE_WORKERS", "16"))
+
+# Score columns kept even when no loaded evaluation reports them
+SCORED_EVALUATORS = ("context_relevance", "hallucination", "conciseness")
+
+# output_text is only tested for presence, so it is projected as a bool
+TRACE_PROJECTION = (
+    "c.trace_id, c.retrieval, c.retrieval_executed, c.documents_found, "
+    "c.retrieval_confidence, c.usage, c.request, "
+    "(IS_STRING(c.output_text) AND LENGTH(c.output_text) > 0) AS output_text, "
+    "ARRAY(SELECT s.type, s.temperature, s.context_tokens, s.metadata FROM s IN c.spans) AS spans"
+)
+
+EVAL_PROJECTION = "c.trace_id, c.evaluator, c.status, c.score"
+
+RCA_PROJECTION = "c.trace_id, c.thresholds"
+
+
+# ============================================================
+# LOADING
+# ============================================================
+
+class Columns:
+    """
+    Rule inputs for N traces, one array per field.
+    """
+
+    def __init__(self, trace_ids, traces: list, evals: list, thresholds: Optional[list] = None):
+
+        n = len(trace_ids)
+
+        self.trace_ids = np.asarray(trace_ids, dtype=object)
+
+        # Rule inputs per trace, for writing full RCA docs (write_rca_docs)
+        self.traces = traces
+        self.evals = evals
+
+        # Thresholds each trace's RCA doc was computed with (None: not loaded)
+        self.thresholds = None if thresholds is None else [{**THRESHOLDS, **(t or {})} for t in thresholds]
+
+        def column(values, dtype=float):
+            return np.fromiter(values, dtype=dtype, count=n)
+
+        def nan_if_none(v):
+            return np.nan if v is None else v
+
+        self.executed = column((t["retrieval"]["executed"] for t in traces), bool)
+        self.documents_found = column(t["retrieval"]["documents_found"] for t in traces)
+        self.confidence = column(t["retrieval"]["confidence"] for t in traces)
+        self.temperature = column(nan_if_none(t["llm_span"]["temperature"]) for t in traces)
+        self.context_tokens = column((t["llm_span"]["context_tokens"] or 0) for t in traces)
+        self.completion_tokens = column(t["completion_tokens"] for t in traces)
+        self.has_output = column((t["has_output"] for t in traces), bool)
+        self.intent_mismatch = column(
+            (bool(t["intent"]["span"] and t["intent"]["trace"] and t["intent"]["span"] != t["intent"]["trace"]) for t in traces),
+            bool
+        )
+
+        statuses = [e["evaluator_status"] for e in evals]
+        self.completed = column(sum(s == "completed" for s in st.values()) for st in statuses)
+        self.skipped = column(sum(s == "skipped" for s in st.values()) for st in statuses)
+
+        names = set(SCORED_EVALUATORS).union(*(e["scores"] for e in evals))
+        self.scores = {
+            name: column(e["scores"].get(name, np.nan) for e in evals)
+            for name in names
+        }
+
+    def __len__(self):
+        return len(self.trace_ids)
+
+
+def _scan(container, projection: str, where: str, parameters: list, workers: int) -> list:
+
+    def scan(scope):
+        clauses = [c for c in (where, scope.get("where")) if c]
+        kwargs = {"feed_range": scope["feed_range"]} if "feed_range" in scope else {"enable_cross_partition_query": True}
+        pages = container.query_items(
+            query=f"SELECT {projection} FROM c WHERE {' AND '.join(clauses)}",
+            parameters=parameters + (scope.get("parameters") or []),
+            max_item_count=REBUILD_PAGE_SIZE,
+            **kwargs
+        ).by_page()
+        return [doc for page in pages for doc in page]
+
+    scopes = scan_ranges(container, workers)
+
+    if not scopes:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(scopes))) as pool:
+        return [doc for docs in pool.map(scan, scopes) for doc in docs]
+
+
+def load_columns(raw_container, evals_container, start: int, end: int, workers: int = REBUILD_WORKERS,
+                 rca_container=None) -> Columns:
+    """
+    Traces written in [start, end) (epoch seconds, by _ts) and their
+    finished evaluations, which may have been written after `end`. With
+    `rca_container`, also the thresholds stored on each trace's RCA doc
+    (needed by write_rca_docs).
+    """
+
+    traces = _scan(
+        raw_container, TRACE_PROJECTION,
+        "c._ts >= @start AND c._ts < @end",
+        [{"name": "@start", "value": start}, {"name": "@end", "value": end}],
+        workers
+    )
+
+    by_trace = {t["trace_id"]: t for t in traces if t.get("trace_id")}
+
+    evals = defaultdict(list)
+
+    for e in _scan(
+        evals_container, EVAL_PROJECTION,
+        "c._ts >= @start AND c.status != 'pending'",
+        [{"name": "@start", "value": start}],
+        workers
+    ):
+        if e.get("trace_id") in by_trace:
+            evals[e["trace_id"]].append(e)
+
+    trace_ids = list(by_trace)
+
+    stored = None
+
+    if rca_container is not None:
+        stored = {
+            d["trace_id"]: d.get("thresholds")
+            for d in _scan(rca_container, RCA_PROJECTION, "ENDSWITH(c.id, ':rca')", [], workers)
+            if d.get("trace_id") in by_trace
+        }
+
+    cols = Columns(
+        trace_ids,
+        [trace_inputs(by_trace[t]) for t in trace_ids],
+        [eval_inputs(evals.get(t, [])) for t in trace_ids],
+        None if stored is None else [stored.get(t) for t in trace_ids],
+    )
+
+    logging.info(f"[rca_bulk] Loaded {len(cols)} traces, {sum(map(len, evals.values()))} evaluations")
+
+    return cols
+
+
+# ============================================================
+# VECTORIZED RULES (mirror rca_rules, findings in rule order)
+# ============================================================
+
+def finding_masks(cols: Columns, thresholds: Optional[dict] = None) -> Dict[str, np.ndarray]:
+
+    th = {**THRESHOLDS, **(thresholds or {})}
+
+    docs = cols.documents_found
+    conf = cols.confidence
+    ctx_tokens = cols.context_tokens
+    ctx = cols.scores["context_relevance"]
+    halluc = cols.scores["hallucination"]
+
+    # NaN (score missing) compares False, matching the `is not None` guards
+    with np.errstate(invalid="ignore"):
+
+        masks = {
+            "retrieval_failed": cols.executed & (docs == 0),
+            "weak_retrieval_quality": (docs > 0) & (conf < th["weak_retrieval"]),
+            "moderate_retrieval_confidence": (th["moderate_retrieval_low"] <= conf) & (conf < th["moderate_retrieval_high"]),
+            "generation_ignored_context": (ctx < th["context_ignore"]) & (docs > 0) & (conf >= th["moderate_retrieval_high"]),
+        }
+
+        hallucinated = halluc < th["hallucination"]
+        no_docs = docs == 0
+        weak = conf < th["weak_retrieval_hallucination"]
+        ungrounded = ctx < th["ungrounded_context"]
+
+        masks.update({
+            "hallucination_due_to_no_context": hallucinated & no_docs,
+            "hallucination_due_to_weak_retrieval": hallucinated & ~no_docs & weak,
+            "ungrounded_answer": hallucinated & ~no_docs & ~weak & ungrounded,
+            "generation_overreach": hallucinated & ~no_docs & ~weak & ~ungrounded,
+            "low_context_utilization": (ctx < th["low_context_utilization"]) & (ctx_tokens > th["context_tokens_utilization"]),
+            "low_context_provided": cols.executed & (docs > 0) & (ctx_tokens < th["context_tokens_min"]),
+            "context_overload": ctx_tokens > th["context_tokens_max"],
+            "high_temperature_generation": cols.temperature > th["temperature"],
+            "over_verbose_answer": cols.scores["conciseness"] < th["conciseness"],
+            "excessive_generation_length": cols.completion_tokens > th["completion_tokens"],
+            # `not context_score`: missing or exactly 0
+            "retrieval_executed_but_unused": cols.executed & (docs > 0) & (np.isnan(ctx) | (ctx == 0)),
+            "generation_without_retrieval": ~cols.executed & cols.has_output,
+            "intent_mismatch": cols.intent_mismatch,
+            "rca_partial_analysis": (cols.skipped > 0) & (cols.completed > 0),
+            "rca_not_applicable": (cols.skipped > 0) & (cols.completed == 0),
+        })
+
+    masks["no_anomaly_detected"] = ~np.logical_or.reduce(list(masks.values()))
+
+    return masks
+
+
+# ============================================================
+# WHAT-IF
+# ============================================================
+
+def what_if(cols: Columns, candidates: Dict[str, dict], max_trace_ids: int = 100) -> dict:
+    """
+    Per candidate (name -> THRESHOLDS overrides): finding counts, up to
+    `max_trace_ids` affected traces per finding, and how many traces
+    gain / lose each finding relative to the current THRESHOLDS.
+    """
+
+    baseline = finding_masks(cols)
+
+    report = {
+        "traces": len(cols),
+        "baseline": {f: int(m.sum()) for f, m in baseline.items()},
+        "candidates": {},
+    }
+
+    for name, overrides in candidates.items():
+
+        masks = finding_masks(cols, overrides)
+
+        report["candidates"][name] = {
+            "thresholds": overrides,
+            "counts": {f: int(m.sum()) for f, m in masks.items()},
+            "gained": {f: int((m & ~baseline[f]).sum()) for f, m in masks.items()},
+            "lost": {f: int((baseline[f] & ~m).sum()) for f, m in masks.items()},
+            "trace_ids": {
+                f: cols.trace_ids[np.flatnonzero(m)[:max_trace_ids]].tolist()
+                for f, m in masks.items() if m.any()
+            },
+        }
+
+    return report
+
+
+# ============================================================
+# BULK WRITE
+# ============================================================
+
+def write_rca_docs(container, cols: Columns, thresholds: dict, rewrite_all: bool = False,
+                   workers: int = BULK_WRITE_WORKERS) -> int:
+    """
+    Re-run the rules under `thresholds` (overrides of THRESHOLDS; {}
+    reverts to them) and write findings, evidence and rule results to
+    {trace_id}:rca, together with the thresholds, which refresh_rca
+    keeps using. Only traces whose doc was computed with other
+    thresholds are written, unless `rewrite_all`.
+    """
+
+    thresholds = {**THRESHOLDS, **thresholds}
+
+    if rewrite_all:
+        rows = np.arange(len(cols))
+    elif cols.thresholds is None:
+        raise ValueError("Load the columns with rca_container to compare against the stored thresholds")
+    else:
+        rows = np.asarray([i for i, stored in enumerate(cols.thresholds) if stored != thresholds], dtype=int)
+
+    now = datetime.now(timezone.utc).isoformat()
+
+    def write(i):
+
+        trace_id = cols.trace_ids[i]
+
+        # The scalar rules produce the doc, evidence included, exactly as
+        # RCAEngine would
+        rules, _ = run_rules({**cols.traces[i], **cols.evals[i]}, thresholds=thresholds)
+        findings, evidence, suggestions = summarize(rules)
+
+        try:
+            container.patch_item(
+                f"{trace_id}:rca",
+                partition_key=trace_id,
+                patch_operations=[
+                    {"op": "set", "path": "/findings", "value": findings},
+                    {"op": "set", "path": "/evidence", "value": evidence},
+                    {"op": "set", "path": "/suggestions", "value": suggestions},
+                    {"op": "set", "path": "/thresholds", "value": thresholds},
+                    {"op": "set", "path": "/trace_inputs", "value": cols.traces[i]},
+                    {"op": "set", "path": "/rules", "value": rules},
+                    {"op": "set", "path": "/bulk_rerun_at", "value": now},
+                ]
+            )
+
+        except exceptions.CosmosResourceNotFoundError:
+            container.upsert_item({
+                "id": f"{trace_id}:rca",
+                "trace_id": trace_id,
+                "findings": findings,
+                "evidence": evidence,
+                "suggestions": suggestions,
+                "status": "completed",
+                "trigger": "bulk",
+                "thresholds": thresholds,
+                "trace_inputs": cols.traces[i],
+                "rules": rules,
+                "bulk_rerun_at": now,
+            })
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(write, rows))
+
+    logging.info(f"[rca_bulk] Wrote {len(rows)} of {len(cols)} RCA docs")
+
+    return len(rows)
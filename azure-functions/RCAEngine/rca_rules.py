@@ -1,3 +1,8 @@
+import hashlib
+import json
+from collections import namedtuple
+
+
 THRESHOLDS = {
     "weak_retrieval": 0.6,
     "moderate_retrieval_low": 0.6,
@@ -15,17 +20,85 @@ THRESHOLDS = {
     "completion_tokens": 450
 }
 
+# Remediation per finding (rca_partial_analysis / rca_not_applicable have none)
+SUGGESTIONS = {
+    "retrieval_failed": "Improve embeddings, chunking strategy, or increase top_k.",
+    "weak_retrieval_quality": "Improve embedding quality, chunk size, or increase retrieval_k.",
+    "moderate_retrieval_confidence": "Consider reranking retrieved documents or improving semantic chunking.",
+    "generation_ignored_context": "Strengthen grounding instructions or enforce citation-based answering.",
+    "hallucination_due_to_no_context": "Force refusal when no documents are retrieved.",
+    "hallucination_due_to_weak_retrieval": "Improve retrieval relevance or apply reranking.",
+    "ungrounded_answer": "Model relied on prior knowledge instead of retrieved context.",
+    "generation_overreach": "Reduce model temperature or enforce stricter grounding.",
+    "low_context_utilization": "Model received context but did not properly use it.",
+    "low_context_provided": "Increase chunk size or top_k to provide richer context.",
+    "context_overload": "Reduce chunk size or apply reranking to limit context tokens.",
+    "high_temperature_generation": "Lower temperature for factual QA tasks.",
+    "over_verbose_answer": "Add stricter brevity constraints or reduce max_tokens.",
+    "excessive_generation_length": "Limit max_tokens or enforce concise response style.",
+    "retrieval_executed_but_unused": "Consider routing logic improvements to avoid unnecessary retrieval.",
+    "generation_without_retrieval": "Ensure retrieval is triggered for knowledge queries.",
+    "intent_mismatch": "Investigate intent classifier consistency.",
+    "no_anomaly_detected": "No action required",
+}
 
-def analyze_trace(trace, evals):
-    
+# Bump when rule logic changes so stored rule results are re-run
+# (the thresholds in effect are part of every fingerprint already)
+RULESET_VERSION = 1
 
-    findings = []
-    evidence = []
-    suggestions = []
 
-    # ------------------------------------------------------------
-    # Extract telemetry (normalized schema)
-    # ------------------------------------------------------------
+# ============================================================
+# RULE REGISTRY
+# ============================================================
+
+Rule = namedtuple("Rule", ["name", "inputs", "fn"])
+
+# Evaluation order = order of findings / evidence in the RCA doc
+RULES = []
+
+
+def rule(*inputs):
+    """
+    Register a rule reading only the named inputs (see trace_inputs /
+    eval_inputs). A rule re-runs only when one of them (or the
+    thresholds) changes. Called as fn(inputs, outcome, thresholds).
+    """
+
+    def register(fn):
+        RULES.append(Rule(fn.__name__, inputs, fn))
+        return fn
+
+    return register
+
+
+class Outcome:
+
+    def __init__(self):
+        self.findings = []
+        self.evidence = []
+        self.suggestions = []
+
+    def finding(self, name):
+        self.findings.append(name)
+        self.suggestions.append(SUGGESTIONS[name])
+
+    def to_dict(self):
+        return {
+            "findings": self.findings,
+            "evidence": self.evidence,
+            "suggestions": self.suggestions,
+        }
+
+
+# ============================================================
+# INPUTS
+# ============================================================
+
+def trace_inputs(trace):
+    """
+    Telemetry the rules read from the raw trace (normalized schema).
+    Stored on the RCA doc so re-evaluation does not re-read the trace.
+    """
 
     retrieval = trace.get("retrieval", {}) or {}
 
@@ -44,325 +117,429 @@ def analyze_trace(trace, evals):
         trace.get("retrieval_confidence", 0.0)
     )
 
-    documents_found = int(documents_found or 0)
-    retrieval_confidence = float(retrieval_confidence or 0.0)
+    spans = trace.get("spans", []) or []
 
-    spans = trace.get("spans", [])
+    usage = trace.get("usage", {}) or {}
 
-    usage = trace.get("usage", {})
-    completion_tokens = int(usage.get("completion_tokens", 0))
+    llm_span = next((s for s in spans if s.get("type") == "llm"), {})
 
-    output = trace.get("output_text")
+    span_int = next(
+        (s for s in spans if s.get("type") == "intent-classification"),
+        None
+    )
 
-    # ------------------------------------------------------------
-    # Extract LLM span telemetry
-    # ------------------------------------------------------------
+    return {
+        "retrieval": {
+            "executed": bool(retrieval_executed),
+            "documents_found": int(documents_found or 0),
+            "confidence": float(retrieval_confidence or 0.0),
+        },
+        "llm_span": {
+            "temperature": llm_span.get("temperature"),
+            "context_tokens": llm_span.get("context_tokens", 0),
+        },
+        "completion_tokens": int(usage.get("completion_tokens", 0)),
+        "has_output": bool(trace.get("output_text")),
+        "intent": {
+            "span": (span_int.get("metadata", {}) or {}).get("intent") if span_int else None,
+            "trace": (trace.get("request", {}) or {}).get("intent"),
+        },
+    }
+
+
+def eval_inputs(evals):
+    """
+    Evaluator states and scores. Each score is also its own input
+    ("score:<evaluator>") so score rules ignore unrelated evaluators.
+    """
+
+    statuses = {}
+    scores = {}
 
-    llm_span = next((s for s in spans if s.get("type") == "llm"), {})
+    for e in evals:
 
-    temperature = llm_span.get("temperature")
-    context_tokens = llm_span.get("context_tokens", 0)
+        name = e.get("evaluator")
 
-    evidence.append(f"documents_found={documents_found}")
-    evidence.append(f"retrieval_confidence={retrieval_confidence}")
+        if not name:
+            continue
 
-    if temperature is not None:
-        evidence.append(f"temperature={temperature}")
+        statuses[name] = e.get("status")
 
-    if context_tokens:
-        evidence.append(f"context_tokens={context_tokens}")
+        if e.get("status") == "completed":
+            try:
+                scores[name] = float(e.get("score"))
+            except (TypeError, ValueError):
+                pass
 
-    # ------------------------------------------------------------
-    # Track evaluator states + extract scores dynamically
-    # ------------------------------------------------------------
+    inputs = {"evaluator_status": statuses, "scores": scores}
+    inputs.update({f"score:{name}": score for name, score in scores.items()})
 
-    completed_evaluators = []
-    skipped_evaluators = []
-    failed_evaluators = []
+    return inputs
 
-    scores = {}
 
-    for e in evals:
+def fingerprint(values, thresholds=None):
+    payload = json.dumps(
+        {"version": RULESET_VERSION, "thresholds": thresholds or THRESHOLDS, "inputs": values},
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=8).hexdigest()
 
-        name = e.get("evaluator")
-        status = e.get("status")
-        score = e.get("score")
 
-        if not name:
-            continue
+# ============================================================
+# RULES
+# ============================================================
 
-        if status == "completed":
+# ------------------------------------------------------------
+# Telemetry evidence
+# ------------------------------------------------------------
 
-            completed_evaluators.append(name)
+@rule("retrieval", "llm_span")
+def telemetry(x, out, th):
 
-            try:
-                scores[name] = float(score)
-                evidence.append(f"{name}_score={scores[name]}")
-            except:
-                pass
+    out.evidence.append(f"documents_found={x['retrieval']['documents_found']}")
+    out.evidence.append(f"retrieval_confidence={x['retrieval']['confidence']}")
+
+    if x["llm_span"]["temperature"] is not None:
+        out.evidence.append(f"temperature={x['llm_span']['temperature']}")
+
+    if x["llm_span"]["context_tokens"]:
+        out.evidence.append(f"context_tokens={x['llm_span']['context_tokens']}")
 
-        elif status == "skipped":
 
-            skipped_evaluators.append(name)
+# ------------------------------------------------------------
+# Evaluator states
+# ------------------------------------------------------------
 
-            evidence.append(f"{name}_evaluator_skipped")
+@rule("evaluator_status", "scores", "retrieval", "has_output")
+def evaluator_states(x, out, th):
+
+    retrieval = x["retrieval"]
+
+    for name, status in x["evaluator_status"].items():
+
+        if status == "completed":
+
+            if name in x["scores"]:
+                out.evidence.append(f"{name}_score={x['scores'][name]}")
+
+        elif status == "skipped":
+
+            out.evidence.append(f"{name}_evaluator_skipped")
 
             reason = "dependency_condition_not_met"
 
-            if documents_found == 0:
+            if retrieval["documents_found"] == 0:
                 reason = "no_retrieved_documents"
 
-            elif not retrieval_executed:
+            elif not retrieval["executed"]:
                 reason = "retrieval_not_executed"
 
-            elif not output:
+            elif not x["has_output"]:
                 reason = "no_model_output"
 
-            evidence.append(f"{name}_skip_reason={reason}")
+            out.evidence.append(f"{name}_skip_reason={reason}")
 
         elif status == "failed":
 
-            failed_evaluators.append(name)
-            evidence.append(f"{name}_evaluator_failed")
+            out.evidence.append(f"{name}_evaluator_failed")
 
-    context_score = scores.get("context_relevance")
-    halluc_score = scores.get("hallucination")
-    concise_score = scores.get("conciseness")
 
-    # ------------------------------------------------------------
-    # 1 Retrieval Failure
-    # ------------------------------------------------------------
+# ------------------------------------------------------------
+# 1 Retrieval Failure
+# ------------------------------------------------------------
 
-    if retrieval_executed and documents_found == 0:
+@rule("retrieval")
+def retrieval_failure(x, out, th):
 
-        findings.append("retrieval_failed")
+    if x["retrieval"]["executed"] and x["retrieval"]["documents_found"] == 0:
 
-        evidence.append("documents_found=0")
+        out.evidence.append("documents_found=0")
 
-        suggestions.append(
-            "Improve embeddings, chunking strategy, or increase top_k."
-        )
+        out.finding("retrieval_failed")
 
-    # ------------------------------------------------------------
-    # 2 Weak Retrieval
-    # ------------------------------------------------------------
 
-    if documents_found > 0 and retrieval_confidence < THRESHOLDS["weak_retrieval"]:
+# ------------------------------------------------------------
+# 2 Weak Retrieval
+# ------------------------------------------------------------
 
-        findings.append("weak_retrieval_quality")
+@rule("retrieval")
+def weak_retrieval(x, out, th):
 
-        suggestions.append(
-            "Improve embedding quality, chunk size, or increase retrieval_k."
-        )
+    if x["retrieval"]["documents_found"] > 0 and x["retrieval"]["confidence"] < th["weak_retrieval"]:
 
-    # ------------------------------------------------------------
-    # 3 Moderate Retrieval
-    # ------------------------------------------------------------
+        out.finding("weak_retrieval_quality")
+
+
+# ------------------------------------------------------------
+# 3 Moderate Retrieval
+# ------------------------------------------------------------
+
+@rule("retrieval")
+def moderate_retrieval(x, out, th):
 
     if (
-        THRESHOLDS["moderate_retrieval_low"]
-        <= retrieval_confidence
-        < THRESHOLDS["moderate_retrieval_high"]
+        th["moderate_retrieval_low"]
+        <= x["retrieval"]["confidence"]
+        < th["moderate_retrieval_high"]
     ):
 
-        findings.append("moderate_retrieval_confidence")
+        out.finding("moderate_retrieval_confidence")
 
-        suggestions.append(
-            "Consider reranking retrieved documents or improving semantic chunking."
-        )
 
-    # ------------------------------------------------------------
-    # 4 Context Ignored
-    # ------------------------------------------------------------
+# ------------------------------------------------------------
+# 4 Context Ignored
+# ------------------------------------------------------------
+
+@rule("score:context_relevance", "retrieval")
+def context_ignored(x, out, th):
+
+    context_score = x["score:context_relevance"]
 
     if (
         context_score is not None
-        and context_score < THRESHOLDS["context_ignore"]
-        and documents_found > 0
-        and retrieval_confidence >= THRESHOLDS["moderate_retrieval_high"]
+        and context_score < th["context_ignore"]
+        and x["retrieval"]["documents_found"] > 0
+        and x["retrieval"]["confidence"] >= th["moderate_retrieval_high"]
     ):
 
-        findings.append("generation_ignored_context")
+        out.finding("generation_ignored_context")
 
-        suggestions.append(
-            "Strengthen grounding instructions or enforce citation-based answering."
-        )
 
-    # ------------------------------------------------------------
-    # 5 Hallucination
-    # ------------------------------------------------------------
+# ------------------------------------------------------------
+# 5 Hallucination
+# ------------------------------------------------------------
 
-    if halluc_score is not None and halluc_score < THRESHOLDS["hallucination"]:
+@rule("score:hallucination", "score:context_relevance", "retrieval")
+def hallucination(x, out, th):
 
-        if documents_found == 0:
+    halluc_score = x["score:hallucination"]
+    context_score = x["score:context_relevance"]
 
-            findings.append("hallucination_due_to_no_context")
+    if halluc_score is None or halluc_score >= th["hallucination"]:
+        return
 
-            suggestions.append(
-                "Force refusal when no documents are retrieved."
-            )
+    if x["retrieval"]["documents_found"] == 0:
 
-        elif retrieval_confidence < THRESHOLDS["weak_retrieval_hallucination"]:
+        out.finding("hallucination_due_to_no_context")
 
-            findings.append("hallucination_due_to_weak_retrieval")
+    elif x["retrieval"]["confidence"] < th["weak_retrieval_hallucination"]:
 
-            suggestions.append(
-                "Improve retrieval relevance or apply reranking."
-            )
+        out.finding("hallucination_due_to_weak_retrieval")
 
-        elif context_score is not None and context_score < THRESHOLDS["ungrounded_context"]:
+    elif context_score is not None and context_score < th["ungrounded_context"]:
 
-            findings.append("ungrounded_answer")
+        out.finding("ungrounded_answer")
 
-            suggestions.append(
-                "Model relied on prior knowledge instead of retrieved context."
-            )
+    else:
 
-        else:
+        out.finding("generation_overreach")
 
-            findings.append("generation_overreach")
 
-            suggestions.append(
-                "Reduce model temperature or enforce stricter grounding."
-            )
+# ------------------------------------------------------------
+# 6 Low Context Utilization
+# ------------------------------------------------------------
 
-    # ------------------------------------------------------------
-    # 6 Low Context Utilization
-    # ------------------------------------------------------------
+@rule("score:context_relevance", "llm_span")
+def low_context_utilization(x, out, th):
+
+    context_score = x["score:context_relevance"]
 
     if (
         context_score is not None
-        and context_score < THRESHOLDS["low_context_utilization"]
-        and context_tokens > THRESHOLDS["context_tokens_utilization"]
+        and context_score < th["low_context_utilization"]
+        and x["llm_span"]["context_tokens"] > th["context_tokens_utilization"]
     ):
 
-        findings.append("low_context_utilization")
+        out.finding("low_context_utilization")
 
-        suggestions.append(
-            "Model received context but did not properly use it."
-        )
 
-    # ------------------------------------------------------------
-    # 7 Context Too Small
-    # ------------------------------------------------------------
+# ------------------------------------------------------------
+# 7 Context Too Small
+# ------------------------------------------------------------
 
-    if retrieval_executed and documents_found > 0 and context_tokens < THRESHOLDS["context_tokens_min"]:
+@rule("retrieval", "llm_span")
+def context_too_small(x, out, th):
 
-        findings.append("low_context_provided")
+    if (
+        x["retrieval"]["executed"]
+        and x["retrieval"]["documents_found"] > 0
+        and x["llm_span"]["context_tokens"] < th["context_tokens_min"]
+    ):
 
-        suggestions.append(
-            "Increase chunk size or top_k to provide richer context."
-        )
+        out.finding("low_context_provided")
 
-    # ------------------------------------------------------------
-    # 8 Context Overload
-    # ------------------------------------------------------------
 
-    if context_tokens > THRESHOLDS["context_tokens_max"]:
+# ------------------------------------------------------------
+# 8 Context Overload
+# ------------------------------------------------------------
 
-        findings.append("context_overload")
+@rule("llm_span")
+def context_overload(x, out, th):
 
-        suggestions.append(
-            "Reduce chunk size or apply reranking to limit context tokens."
-        )
+    if x["llm_span"]["context_tokens"] > th["context_tokens_max"]:
 
-    # ------------------------------------------------------------
-    # 9 High Temperature Generation
-    # ------------------------------------------------------------
+        out.finding("context_overload")
 
-    if temperature is not None and temperature > THRESHOLDS["temperature"]:
 
-        findings.append("high_temperature_generation")
+# ------------------------------------------------------------
+# 9 High Temperature Generation
+# ------------------------------------------------------------
 
-        suggestions.append(
-            "Lower temperature for factual QA tasks."
-        )
+@rule("llm_span")
+def high_temperature(x, out, th):
 
-    # ------------------------------------------------------------
-    # 10 Over Verbose
-    # ------------------------------------------------------------
+    temperature = x["llm_span"]["temperature"]
 
-    if concise_score is not None and concise_score < THRESHOLDS["conciseness"]:
+    if temperature is not None and temperature > th["temperature"]:
 
-        findings.append("over_verbose_answer")
+        out.finding("high_temperature_generation")
 
-        suggestions.append(
-            "Add stricter brevity constraints or reduce max_tokens."
-        )
 
-    # ------------------------------------------------------------
-    # 11 Excessive Generation
-    # ------------------------------------------------------------
+# ------------------------------------------------------------
+# 10 Over Verbose
+# ------------------------------------------------------------
 
-    if completion_tokens > THRESHOLDS["completion_tokens"]:
+@rule("score:conciseness")
+def over_verbose(x, out, th):
 
-        findings.append("excessive_generation_length")
+    concise_score = x["score:conciseness"]
 
-        suggestions.append(
-            "Limit max_tokens or enforce concise response style."
-        )
+    if concise_score is not None and concise_score < th["conciseness"]:
 
-    # ------------------------------------------------------------
-    # 12 Retrieval Executed But Not Needed
-    # ------------------------------------------------------------
+        out.finding("over_verbose_answer")
 
-    if retrieval_executed and documents_found > 0 and not context_score:
 
-        findings.append("retrieval_executed_but_unused")
+# ------------------------------------------------------------
+# 11 Excessive Generation
+# ------------------------------------------------------------
 
-        suggestions.append(
-            "Consider routing logic improvements to avoid unnecessary retrieval."
-        )
+@rule("completion_tokens")
+def excessive_generation(x, out, th):
 
-    # ------------------------------------------------------------
-    # 13 Generation Without Retrieval
-    # ------------------------------------------------------------
+    if x["completion_tokens"] > th["completion_tokens"]:
 
-    if not retrieval_executed and output:
+        out.finding("excessive_generation_length")
 
-        findings.append("generation_without_retrieval")
 
-        suggestions.append(
-            "Ensure retrieval is triggered for knowledge queries."
-        )
+# ------------------------------------------------------------
+# 12 Retrieval Executed But Not Needed
+# ------------------------------------------------------------
 
-    # ------------------------------------------------------------
-    # 14 Intent mismatch
-    # ------------------------------------------------------------
+@rule("retrieval", "score:context_relevance")
+def retrieval_unused(x, out, th):
 
-    span_int = next(
-        (s for s in spans if s.get("type") == "intent-classification"),
-        None
-    )
+    if x["retrieval"]["executed"] and x["retrieval"]["documents_found"] > 0 and not x["score:context_relevance"]:
 
-    if span_int:
+        out.finding("retrieval_executed_but_unused")
 
-        span_intent = span_int.get("metadata", {}).get("intent")
-        trace_intent = trace.get("request", {}).get("intent")
 
-        if span_intent and trace_intent and trace_intent != span_intent:
+# ------------------------------------------------------------
+# 13 Generation Without Retrieval
+# ------------------------------------------------------------
 
-            findings.append("intent_mismatch")
+@rule("retrieval", "has_output")
+def generation_without_retrieval(x, out, th):
 
-            suggestions.append(
-                "Investigate intent classifier consistency."
-            )
+    if not x["retrieval"]["executed"] and x["has_output"]:
 
-    # ------------------------------------------------------------
-    # RCA completeness
-    # ------------------------------------------------------------
+        out.finding("generation_without_retrieval")
+
+
+# ------------------------------------------------------------
+# 14 Intent mismatch
+# ------------------------------------------------------------
+
+@rule("intent")
+def intent_mismatch(x, out, th):
+
+    span_intent = x["intent"]["span"]
+    trace_intent = x["intent"]["trace"]
+
+    if span_intent and trace_intent and trace_intent != span_intent:
+
+        out.finding("intent_mismatch")
+
+
+# ------------------------------------------------------------
+# RCA completeness
+# ------------------------------------------------------------
+
+@rule("evaluator_status")
+def completeness(x, out, th):
+
+    statuses = x["evaluator_status"]
+
+    completed_evaluators = [n for n, s in statuses.items() if s == "completed"]
+    skipped_evaluators = [n for n, s in statuses.items() if s == "skipped"]
 
     if skipped_evaluators and completed_evaluators:
 
-        findings.append("rca_partial_analysis")
+        out.findings.append("rca_partial_analysis")
 
-        evidence.append(f"skipped_evaluators={','.join(skipped_evaluators)}")
+        out.evidence.append(f"skipped_evaluators={','.join(skipped_evaluators)}")
 
     elif skipped_evaluators and not completed_evaluators:
 
-        findings.append("rca_not_applicable")
+        out.findings.append("rca_not_applicable")
+
+        out.evidence.append(f"all_evaluators_skipped={','.join(skipped_evaluators)}")
+
+
+# ============================================================
+# RUN
+# ============================================================
+
+def run_rules(inputs, previous=None, thresholds=None):
+    """
+    Run the rules whose input fingerprint differs from `previous`
+    (the RCA doc's stored "rules"); the others keep their stored result.
+    `thresholds` override THRESHOLDS (e.g. the ones a bulk re-run stored
+    on the doc) and are part of the fingerprint.
+    Returns (results by rule name, names of the rules that ran).
+    """
+
+    previous = previous or {}
+    th = {**THRESHOLDS, **(thresholds or {})}
+
+    results = {}
+    rerun = []
+
+    for r in RULES:
+
+        values = {name: inputs.get(name) for name in r.inputs}
+        fp = fingerprint(values, th)
 
-        evidence.append(f"all_evaluators_skipped={','.join(skipped_evaluators)}")
+        prior = previous.get(r.name)
+
+        if prior is not None and prior.get("fingerprint") == fp:
+            results[r.name] = prior
+            continue
+
+        out = Outcome()
+        r.fn(values, out, th)
+
+        results[r.name] = {"fingerprint": fp, **out.to_dict()}
+        rerun.append(r.name)
+
+    return results, rerun
+
+
+def summarize(results):
+    """
+    Merge per-rule results (in rule order) into findings / evidence /
+    suggestions.
+    """
+
+    findings = []
+    evidence = []
+    suggestions = []
+
+    for r in RULES:
+        result = results.get(r.name) or {}
+        findings.extend(result.get("findings", []))
+        evidence.extend(result.get("evidence", []))
+        suggestions.extend(result.get("suggestions", []))
 
     # ------------------------------------------------------------
     # Remove duplicates
@@ -382,6 +559,13 @@ def analyze_trace(trace, evals):
 
         evidence.append("All evaluator thresholds satisfied")
 
-        suggestions.append("No action required")
+        suggestions.append(SUGGESTIONS["no_anomaly_detected"])
+
+    return findings, evidence, suggestions
+
+
+def analyze_trace(trace, evals):
+
+    results, _ = run_rules({**trace_inputs(trace), **eval_inputs(evals)})
 
-    return findings, evidence, suggestions
\ No newline at end of file
+    return summarize(results)
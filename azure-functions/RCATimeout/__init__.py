@@ -0,0 +1,55 @@
+import logging
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import time
+
+from shared.readiness import CLAIMED, READINESS_TIMEOUT_SECONDS, READINESS_TYPE, WAITING, claim
+from RCAEngine import RCA, run_rca
+
+
+# --------------------------------------------------
+# Readiness records past the timeout: evaluators that never
+# reported, or claims whose worker died before finishing
+# --------------------------------------------------
+def expired_readiness(cutoff: int) -> list:
+
+    return list(RCA.query_items(
+        query="""
+            SELECT * FROM c
+            WHERE c.type = @type
+              AND c.created_epoch < @cutoff
+              AND (c.rca_status = @waiting
+                   OR (c.rca_status = @claimed AND c.claimed_epoch < @cutoff))
+        """,
+        parameters=[
+            {"name": "@type", "value": READINESS_TYPE},
+            {"name": "@cutoff", "value": cutoff},
+            {"name": "@waiting", "value": WAITING},
+            {"name": "@claimed", "value": CLAIMED},
+        ],
+        enable_cross_partition_query=True,
+    ))
+
+
+# --------------------------------------------------
+# Azure Function Entry: RCA with whatever evaluations arrived
+# --------------------------------------------------
+def main(mytimer):
+
+    try:
+        records = expired_readiness(int(time.time()) - READINESS_TIMEOUT_SECONDS)
+
+        claimed = {
+            r["trace_id"]: r
+            for r in records
+            if claim(RCA, r["trace_id"], stale_claims=True)
+        }
+
+        if claimed:
+            logging.info(f"[RCATimeout] Running RCA for {len(claimed)} timed-out traces")
+
+        run_rca(claimed, "timeout")
+
+    except Exception:
+        logging.exception("[RCATimeout] Timeout sweep failed")
@@ -0,0 +1,18 @@
+import logging
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from shared.cosmos import metrics_write
+from shared.rollups import compact_and_expire
+
+
+# --------------------------------------------------
+# Azure Function Entry: minute -> hour -> day compaction + retention
+# --------------------------------------------------
+def main(mytimer):
+
+    try:
+        compact_and_expire(metrics_write)
+    except Exception:
+        logging.exception("[RollupCompactor] Compaction failed")
@@ -1,10 +1,26 @@
 import logging
+import math
+import os
 import re
 from typing import Optional
+import numpy as np
 from jinja2 import Template
 
 from shared.cosmos import DB_READ
 from shared.llm import call_llm, client, LLM_PROVIDER
+from shared.singleflight import SingleFlight
+from shared.mock_llm import MOCK_PROVIDER, mock_embedding
+from Templates.lexical import (
+    CONTEXT_SEPARATOR,
+    split_chunks,
+    split_sentences,
+    compute_token_f1,
+    compute_rouge_l,
+    compute_bm25,
+    compute_ngram_novelty,
+    compute_number_overlap,
+    compute_entity_overlap,
+)
 import google.generativeai as genai
 
 
@@ -18,14 +34,16 @@ TEMPLATES_CONTAINER = DB_READ.get_container_client("templates")
 # ----------------------------------------------------
 # Pricing Table (USD per token)
 # ----------------------------------------------------
+# "cached_input" is the discounted rate for prompt tokens served from the
+# provider's prefix cache; models without one bill cached tokens at "input".
 MODEL_PRICING = {
-    "gpt-4o": {"input": 0.000005, "output": 0.000015},
-    "gpt-4o-mini": {"input": 0.00000015, "output": 0.0000006},
+    "gpt-4o": {"input": 0.000005, "output": 0.000015, "cached_input": 0.0000025},
+    "gpt-4o-mini": {"input": 0.00000015, "output": 0.0000006, "cached_input": 0.000000075},
     "gemini-1.5-flash": {"input": 0.000000075, "output": 0.0000003}, # Approx
     "gemini-1.5-pro": {"input": 0.0000035, "output": 0.0000105},
-    "models/gemini-2.5-flash": {"input": 0.000000075, "output": 0.0000003},
-    "models/gemini-2.5-pro": {"input": 0.0000035, "output": 0.0000105},
-    "models/gemini-2.0-flash": {"input": 0.000000075, "output": 0.0000003},
+    "models/gemini-2.5-flash": {"input": 0.000000075, "output": 0.0000003, "cached_input": 0.00000001875},
+    "models/gemini-2.5-pro": {"input": 0.0000035, "output": 0.0000105, "cached_input": 0.000000875},
+    "models/gemini-2.0-flash": {"input": 0.000000075, "output": 0.0000003, "cached_input": 0.00000001875},
 }
 
 
@@ -64,6 +82,106 @@ def render_prompt(template_str: str, variables: dict) -> str:
     except Exception as e:
         logging.error(f"[engine] Failed to render template: {e}")
         raise
+# ----------------------------------------------------
+# Static Prompt Prefix
+# ----------------------------------------------------
+# Templates may split the prompt into a static "prefix" (rubric and
+# instructions, no variables) and the "template" body holding the trace
+# variables. The prefix always goes first so consecutive evaluations share
+# a byte-identical prompt head that providers can serve from their cache.
+
+PREFIX_SEPARATOR = "\n\n"
+
+
+def build_prompt(template_doc: dict, variables: dict) -> str:
+    body = render_prompt(template_doc["template"], variables)
+    prefix = template_doc.get("prefix")
+
+    if not prefix:
+        return body
+
+    return f"{prefix.rstrip()}{PREFIX_SEPARATOR}{body}"
+
+
+# ----------------------------------------------------
+# Context Budget
+# ----------------------------------------------------
+# Templates may declare {"context_budget": {"max_tokens": N, "strategy": S}}
+# to cap the retrieved context rendered into the prompt. Strategies:
+#   retrieval_score   - keep the highest-scoring chunks (retrieval order if unscored)
+#   answer_similarity - keep the chunks closest to the response embedding
+#   head_tail         - keep chunks alternately from the start and the end
+
+CHARS_PER_TOKEN = 4
+CONTEXT_STRATEGIES = ("retrieval_score", "answer_similarity", "head_tail")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Offline token estimate (~4 characters per token for English text).
+    """
+    return -(-len(text) // CHARS_PER_TOKEN) if text else 0
+
+
+def _rank_chunks(chunks: list, strategy: str, scores: Optional[list], answer: str) -> list:
+
+    if strategy == "answer_similarity" and answer:
+        sims = chunk_similarity(chunks, answer)
+        if sims.size == len(chunks):
+            return sorted(range(len(chunks)), key=lambda i: -float(sims[0, i]))
+
+    if strategy == "head_tail":
+        order = []
+        lo, hi = 0, len(chunks) - 1
+        while lo <= hi:
+            order.append(lo)
+            if hi != lo:
+                order.append(hi)
+            lo, hi = lo + 1, hi - 1
+        return order
+
+    if scores and len(scores) == len(chunks):
+        return sorted(range(len(chunks)), key=lambda i: -scores[i])
+
+    return list(range(len(chunks)))
+
+
+def trim_context(chunks: list, budget: dict, scores: Optional[list] = None, answer: str = ""):
+    """
+    Select chunks that fit the token budget, keeping their original order.
+    Returns (context_text, tokens_removed).
+    """
+    max_tokens = int(budget.get("max_tokens") or 0)
+    strategy = budget.get("strategy", "retrieval_score")
+
+    if strategy not in CONTEXT_STRATEGIES:
+        logging.warning(f"[engine] Unknown context strategy '{strategy}', using retrieval_score")
+        strategy = "retrieval_score"
+
+    chunks = split_chunks(chunks)
+    total_tokens = sum(estimate_tokens(c) for c in chunks)
+
+    if max_tokens <= 0 or total_tokens <= max_tokens:
+        return CONTEXT_SEPARATOR.join(chunks), 0
+
+    kept = []
+    used = 0
+
+    for i in _rank_chunks(chunks, strategy, scores, answer):
+        cost = estimate_tokens(chunks[i])
+        if used + cost <= max_tokens:
+            kept.append(i)
+            used += cost
+
+    if not kept and chunks:
+        # Nothing fits whole: keep the head of the best-ranked chunk
+        best = _rank_chunks(chunks, strategy, scores, answer)[0]
+        truncated = chunks[best][:max_tokens * CHARS_PER_TOKEN]
+        return truncated, total_tokens - estimate_tokens(truncated)
+
+    return CONTEXT_SEPARATOR.join(chunks[i] for i in sorted(kept)), total_tokens - used
+
+
 # ----------------------------------------------------
 # Extract Numeric Score
 # ----------------------------------------------------
@@ -86,19 +204,105 @@ def parse_numeric_score(raw: Optional[str]) -> Optional[float]:
         return None
 
 
+# ----------------------------------------------------
+# Label Scoring (Logprobs)
+# ----------------------------------------------------
+# Templates may declare {"scoring": {"mode": "logprobs", "labels": ...}}.
+# The model then answers with a single label in 1-2 tokens and the score
+# is the expected label value under the first-token probabilities.
+
+LABEL_MAX_TOKENS = 2
+LABEL_TOP_LOGPROBS = 10
+LABEL_SYSTEM_PROMPT = "You are a deterministic scoring engine. Reply with exactly one label and nothing else."
+
+
+def parse_label_set(scoring: dict) -> Optional[dict]:
+    """
+    Normalize a template label set to {label: value}.
+    Accepts a mapping, a list of numeric labels, or a list of ordered
+    words (spread evenly over [0, 1]).
+    """
+    labels = scoring.get("labels")
+
+    if isinstance(labels, dict) and labels:
+        return {str(k).strip().lower(): float(v) for k, v in labels.items()}
+
+    if isinstance(labels, list) and labels:
+        try:
+            return {str(label).strip().lower(): float(label) for label in labels}
+        except (TypeError, ValueError):
+            step = 1 / (len(labels) - 1) if len(labels) > 1 else 1.0
+            return {str(label).strip().lower(): round(i * step, 4) for i, label in enumerate(labels)}
+
+    return None
+
+
+def score_from_logprobs(top_logprobs: Optional[list], labels: dict):
+    """
+    Expected label value over the label probabilities found among the
+    first token's top logprobs, renormalized to the label set.
+    Returns (score, {label: probability}) or (None, None).
+    """
+    probs = {}
+
+    for entry in top_logprobs or []:
+        token = str(entry.get("token", "")).strip().lower()
+        if token in labels:
+            probs[token] = probs.get(token, 0.0) + math.exp(entry.get("logprob", float("-inf")))
+
+    total = sum(probs.values())
+
+    if total <= 0:
+        return None, None
+
+    probs = {label: p / total for label, p in probs.items()}
+    score = sum(labels[label] * p for label, p in probs.items())
+
+    return round(score, 4), {label: round(p, 4) for label, p in probs.items()}
+
+
+def score_label_response(response: dict, labels: dict):
+    """
+    Score a label-mode response: logprobs when the provider returned
+    them, otherwise the label text, otherwise the first number.
+    Returns (score, label_probs, scoring_mode).
+    """
+    score, label_probs = score_from_logprobs(response.get("top_logprobs"), labels)
+    if score is not None:
+        return score, label_probs, "logprobs"
+
+    text = (response.get("text") or "").strip().lower()
+    if text in labels:
+        return labels[text], None, "label_text"
+
+    return parse_numeric_score(text), None, "text"
+
+
 # ----------------------------------------------------
 # Cost Calculation
 # ----------------------------------------------------
-def calculate_cost(model, prompt_tokens, completion_tokens):
+def calculate_cost(model, prompt_tokens, completion_tokens, cached_tokens=0):
     pricing = MODEL_PRICING.get(model)
 
     if not pricing:
         return 0
 
-    input_cost = prompt_tokens * pricing["input"]
+    cached_tokens = min(cached_tokens or 0, prompt_tokens)
+
+    input_cost = (prompt_tokens - cached_tokens) * pricing["input"]
+    cached_cost = cached_tokens * pricing.get("cached_input", pricing["input"])
     output_cost = completion_tokens * pricing["output"]
 
-    return input_cost + output_cost
+    return input_cost + cached_cost + output_cost
+
+
+def calculate_cache_savings(model, cached_tokens):
+    pricing = MODEL_PRICING.get(model)
+
+    if not pricing or not cached_tokens:
+        return 0
+
+    return cached_tokens * (pricing["input"] - pricing.get("cached_input", pricing["input"]))
 
 
 # ----------------------------------------------------
@@ -106,53 +310,191 @@ def calculate_cost(model, prompt_tokens, completion_tokens):
 # ----------------------------------------------------
 
 EMBEDDING_CACHE = {}
+EMBEDDING_SINGLE_FLIGHT = SingleFlight("embedding")
 SIMILARITY_CACHE = {}
 
+# Max texts per embedding request (Gemini batchEmbedContents caps at 100,
+# Azure OpenAI accepts up to 2048 inputs per call)
+EMBEDDING_BATCH_LIMITS = {"gemini": 100, "azure": 2048}
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))
+
+
+def _embedding_cache_key(text: str, model: str) -> str:
+    # Use model name and hash of text as cache key
+    return f"{model}:{hash(text)}"
+
+
+def _embed_batch(texts: list, model: str) -> list:
+    """
+    One multi-input embedding request. Returns vectors in input order.
+    """
+    if LLM_PROVIDER == MOCK_PROVIDER:
+        return [mock_embedding(t) for t in texts]
+
+    if LLM_PROVIDER == "gemini":
+        result = genai.embed_content(
+            model="models/gemini-embedding-001",
+            content=texts,
+            task_type="retrieval_document"
+        )
+        return result['embedding']
+
+    response = client.embeddings.create(input=texts, model=model)
+    return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
+
+def prefetch_embeddings(texts, model: str = "text-embedding-3-small") -> int:
+    """
+    Embed every distinct uncached text with chunked multi-input requests
+    and fill EMBEDDING_CACHE. Returns the number of newly cached vectors.
+    """
+    pending = list(dict.fromkeys(
+        t for t in texts
+        if t and _embedding_cache_key(t, model) not in EMBEDDING_CACHE
+    ))
+
+    if not pending:
+        return 0
+
+    batch_size = max(1, min(
+        EMBEDDING_BATCH_SIZE,
+        EMBEDDING_BATCH_LIMITS.get(LLM_PROVIDER, EMBEDDING_BATCH_SIZE)
+    ))
+
+    cached = 0
+
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        try:
+            vectors = _embed_batch(chunk, model)
+        except Exception as e:
+            logging.error(f"[engine] Batch embedding failed ({LLM_PROVIDER}, {len(chunk)} texts): {e}")
+            continue
+
+        for text, vector in zip(chunk, vectors):
+            if vector:
+                EMBEDDING_CACHE[_embedding_cache_key(text, model)] = vector
+                cached += 1
+
+    logging.info(
+        f"[engine] Prefetched {cached}/{len(pending)} embeddings "
+        f"in {-(-len(pending) // batch_size)} request(s)"
+    )
+    return cached
+
+
 def get_embedding(text: str, model: str = "text-embedding-3-small") -> list:
     """
     Get text embedding from Azure OpenAI with in-memory caching.
     """
     if not text:
         return []
-    
-    # Use model name and hash of text as cache key
-    cache_key = f"{model}:{hash(text)}"
+
+    cache_key = _embedding_cache_key(text, model)
     if cache_key in EMBEDDING_CACHE:
         return EMBEDDING_CACHE[cache_key]
-        
+
     try:
-        if LLM_PROVIDER == "gemini":
-            try:
-                result = genai.embed_content(
-                    model="models/gemini-embedding-001",
-                    content=text,
-                    task_type="retrieval_document"
-                )
-                embedding = result['embedding']
-            except Exception as e:
-                logging.error(f"[engine] Gemini embedding failed: {e}")
-                return []
-        else:
-            response = client.embeddings.create(input=[text], model=model)
-            embedding = response.data[0].embedding
-        
-        # Store in cache
-        EMBEDDING_CACHE[cache_key] = embedding
-        return embedding
+        # Concurrent requests for the same text share one API call
+        embedding, _ = EMBEDDING_SINGLE_FLIGHT.do(cache_key, lambda: _embed_batch([text], model)[0])
     except Exception as e:
         logging.error(f"[engine] Embedding failed ({LLM_PROVIDER}): {e}")
         return []
 
+    # Store in cache
+    EMBEDDING_CACHE[cache_key] = embedding
+    return embedding
+
+
+def get_embeddings(texts: list, model: str = "text-embedding-3-small") -> list:
+    """
+    Embeddings for many texts at once, in input order ([] where unavailable).
+    """
+    prefetch_embeddings(texts, model)
+    return [get_embedding(t, model) for t in texts]
+
+
+# ----------------------------------------------------
+# Vectorized Similarity Kernel
+# ----------------------------------------------------
+
+CHUNK_TOP_K = 3
+
+
+def _unit_rows(vectors: list) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def similarity_matrix(queries: list, keys: list) -> np.ndarray:
+    """
+    Cosine similarity of every query vector against every key vector
+    as a single matrix product. Shape: (len(queries), len(keys)).
+    """
+    if not queries or not keys:
+        return np.zeros((len(queries), len(keys)), dtype=np.float32)
+    return _unit_rows(queries) @ _unit_rows(keys).T
+
 
 def cosine_similarity(v1: list, v2: list) -> float:
     if not v1 or not v2:
         return 0.0
-    dot_product = sum(a * b for a, b in zip(v1, v2))
-    norm_a = sum(a * a for a in v1) ** 0.5
-    norm_b = sum(b * b for b in v2) ** 0.5
-    if norm_a == 0 or norm_b == 0:
+    return float(similarity_matrix([v1], [v2])[0, 0])
+
+
+def chunk_similarity(context, answer: str, by_sentence: bool = False) -> np.ndarray:
+    """
+    Answer (or each of its sentences) against every retrieved chunk.
+    Rows whose embedding failed are dropped.
+    """
+    chunks = split_chunks(context)
+    queries = split_sentences(answer) if by_sentence else [answer]
+
+    if not chunks or not any(queries):
+        return np.zeros((0, 0), dtype=np.float32)
+
+    vectors = get_embeddings(queries + chunks)
+    q_vecs = [v for v in vectors[:len(queries)] if v]
+    c_vecs = [v for v in vectors[len(queries):] if v]
+
+    return similarity_matrix(q_vecs, c_vecs)
+
+
+def compute_chunk_similarity_max(context, answer: str) -> float:
+    """
+    Best-matching retrieved chunk for the answer.
+    """
+    sims = chunk_similarity(context, answer)
+    return round(float(sims.max()), 2) if sims.size else 0.0
+
+
+def compute_chunk_similarity_mean(context, answer: str) -> float:
+    """
+    Average answer similarity across all retrieved chunks.
+    """
+    sims = chunk_similarity(context, answer)
+    return round(float(sims.mean()), 2) if sims.size else 0.0
+
+
+def compute_chunk_similarity_topk(context, answer: str) -> float:
+    """
+    Average answer similarity over the CHUNK_TOP_K closest chunks.
+    """
+    sims = chunk_similarity(context, answer)
+    if not sims.size:
         return 0.0
-    return dot_product / (norm_a * norm_b)
+    k = min(CHUNK_TOP_K, sims.shape[1])
+    return round(float(np.sort(sims[0])[-k:].mean()), 2)
+
+
+def compute_sentence_grounding(context, answer: str) -> float:
+    """
+    Mean over answer sentences of each sentence's best-matching chunk.
+    """
+    sims = chunk_similarity(context, answer, by_sentence=True)
+    return round(float(sims.max(axis=1).mean()), 2) if sims.size else 0.0
 
 
 def compute_embedding_similarity(context: str, answer: str) -> float:
@@ -198,21 +540,130 @@ def compute_keyword_coverage(context: str, answer: str) -> float:
 # ----------------------------------------------------
 METHOD_REGISTRY = {
     "embedding_similarity": compute_embedding_similarity,
-    "keyword_coverage": compute_keyword_coverage
+    "keyword_coverage": compute_keyword_coverage,
+    "chunk_similarity_max": compute_chunk_similarity_max,
+    "chunk_similarity_mean": compute_chunk_similarity_mean,
+    "chunk_similarity_topk": compute_chunk_similarity_topk,
+    "sentence_grounding": compute_sentence_grounding,
+    "token_f1": compute_token_f1,
+    "rouge_l": compute_rouge_l,
+    "bm25": compute_bm25,
+    "ngram_novelty": compute_ngram_novelty,
+    "number_overlap": compute_number_overlap,
+    "entity_overlap": compute_entity_overlap,
 }
 
+# Texts each embedding-backed method will embed for a (val1, val2) pair,
+# so callers can prefetch them in bulk before scoring
+def _chunk_inputs(context, answer):
+    return split_chunks(context) + [answer] if answer else []
+
+
+def _sentence_inputs(context, answer):
+    return split_chunks(context) + split_sentences(answer) if answer else []
+
+
+EMBEDDING_INPUTS = {
+    "embedding_similarity": lambda context, answer: [context, answer] if context and answer else [],
+    "chunk_similarity_max": _chunk_inputs,
+    "chunk_similarity_mean": _chunk_inputs,
+    "chunk_similarity_topk": _chunk_inputs,
+    "sentence_grounding": _sentence_inputs,
+}
+
+
+def embedding_texts(method_type: str, val1, val2) -> list:
+    inputs_fn = EMBEDDING_INPUTS.get(method_type)
+    return inputs_fn(val1, val2) if inputs_fn else []
+
+
+# ----------------------------------------------------
+# Batch Scoring Interface
+# ----------------------------------------------------
+# A registry method may expose score_batch(pairs) -> list[float] to
+# amortize setup (embedding, vectorizing, tokenizing) over many
+# (val1, val2) pairs. Methods without one are scored pair by pair.
+
+def score_embedding_similarity_batch(pairs: list) -> list:
+    """
+    Batch embedding_similarity: one bulk embed, then row-wise cosine
+    over the stacked context/answer matrices.
+    """
+    prefetch_embeddings([t for context, answer in pairs if context and answer for t in (context, answer)])
+
+    results = [0.0] * len(pairs)
+    rows = []
+
+    for idx, (context, answer) in enumerate(pairs):
+        if not context or not answer:
+            continue
+
+        cache_key = f"{hash(context)}:{hash(answer)}"
+        if cache_key in SIMILARITY_CACHE:
+            results[idx] = SIMILARITY_CACHE[cache_key]
+            continue
+
+        v_context = get_embedding(context)
+        v_answer = get_embedding(answer)
+
+        if v_context and v_answer:
+            rows.append((idx, cache_key, v_context, v_answer))
+
+    if rows:
+        sims = np.sum(
+            _unit_rows([r[2] for r in rows]) * _unit_rows([r[3] for r in rows]),
+            axis=1
+        )
+        for (idx, cache_key, _, _), sim in zip(rows, sims):
+            results[idx] = SIMILARITY_CACHE[cache_key] = round(float(sim), 2)
+
+    return results
+
+
+def _prefetching_batch(method_type: str):
+    fn = METHOD_REGISTRY[method_type]
+
+    def score_batch(pairs: list) -> list:
+        prefetch_embeddings([t for val1, val2 in pairs for t in embedding_texts(method_type, val1, val2)])
+        return [fn(val1, val2) for val1, val2 in pairs]
+
+    return score_batch
+
+
+compute_embedding_similarity.score_batch = score_embedding_similarity_batch
+
+for _method_type in ("chunk_similarity_max", "chunk_similarity_mean",
+                     "chunk_similarity_topk", "sentence_grounding"):
+    METHOD_REGISTRY[_method_type].score_batch = _prefetching_batch(_method_type)
+
+
+def score_batch(method_type: str, pairs: list) -> list:
+    """
+    Score many (val1, val2) pairs with one registry method, using its
+    batch implementation when it has one.
+    """
+    fn = METHOD_REGISTRY[method_type]
+    batch_fn = getattr(fn, "score_batch", None)
+
+    if batch_fn:
+        return batch_fn(pairs)
+
+    return [fn(val1, val2) for val1, val2 in pairs]
+
 
 # ----------------------------------------------------
 # Main Evaluator Execution
 # ----------------------------------------------------
-def run_evaluator(
+def prepare_evaluation(
     evaluator_id: str,
     variables: dict,
-    deployment: Optional[str] = None,
-    trace_methods: Optional[dict] = None
+    deployment: Optional[str] = None
 ) -> dict:
-
-    logging.info(f"[engine] Starting run_evaluator for {evaluator_id}")
+    """
+    Everything run_evaluator does before the LLM call: model selection,
+    context trimming and prompt rendering. The result (minus "prompt") is
+    JSON-safe so deferred batch runs can store it and finish later.
+    """
 
     evaluator_doc = fetch_evaluator(evaluator_id)
     template_id = evaluator_doc["template"]["id"]
@@ -222,7 +673,6 @@ def run_evaluator(
     template_doc = fetch_template(template_id)
 
     template_model = template_doc.get("model")
-    prompt_template = template_doc["template"]
     required_inputs = template_doc.get("inputs", [])
 
     # ----------------------------------------------------
@@ -252,6 +702,24 @@ def run_evaluator(
 
     model = selected_model
 
+    # ----------------------------------------------------
+    # Token-budgeted context trimming
+    # ----------------------------------------------------
+    context_budget = template_doc.get("context_budget")
+    context_tokens_trimmed = 0
+
+    if context_budget and "context" in required_inputs and variables.get("context_chunks"):
+        trimmed, context_tokens_trimmed = trim_context(
+            variables["context_chunks"],
+            context_budget,
+            scores=variables.get("context_scores"),
+            answer=variables.get("response", "")
+        )
+        variables = {**variables, "context": trimmed}
+
+        if context_tokens_trimmed:
+            logging.info(f"[engine] Trimmed ~{context_tokens_trimmed} context tokens for {evaluator_id}")
+
     template_variables = {}
 
     for key in required_inputs:
@@ -262,15 +730,46 @@ def run_evaluator(
         else:
             raise ValueError(f"Missing required template inputs: [{key}]")
 
-    final_prompt = render_prompt(prompt_template, template_variables)
+    scoring_cfg = template_doc.get("scoring") or {}
+    labels = parse_label_set(scoring_cfg) if scoring_cfg.get("mode") == "logprobs" else None
 
-    # ----------------------------------------------------
-    # Call LLM (DEFAULT evaluation)
-    # ----------------------------------------------------
-    response = call_llm(
-        model=model,
-        prompt=final_prompt
-    )
+    # Short label completion or DEFAULT evaluation
+    if labels:
+        llm_kwargs = {
+            "max_tokens": LABEL_MAX_TOKENS,
+            "logprobs": True,
+            "top_logprobs": LABEL_TOP_LOGPROBS,
+            "system_prompt": LABEL_SYSTEM_PROMPT
+        }
+    else:
+        llm_kwargs = {}
+
+    return {
+        "evaluator_id": evaluator_id,
+        "template_id": template_id,
+        "model": model,
+        "prompt": build_prompt(template_doc, template_variables),
+        "llm_kwargs": llm_kwargs,
+        "labels": labels,
+        "context_tokens_trimmed": context_tokens_trimmed
+    }
+
+
+def finish_evaluation(
+    prepared: dict,
+    response: Optional[dict],
+    trace_methods: Optional[dict] = None,
+    price_factor: float = 1.0
+) -> dict:
+    """
+    Score and cost an LLM response for a prepare_evaluation() result.
+    price_factor discounts cost for batch-priced calls.
+    """
+
+    evaluator_id = prepared["evaluator_id"]
+    template_id = prepared["template_id"]
+    model = prepared["model"]
+    labels = prepared.get("labels")
 
     if not response:
         return {
@@ -288,20 +787,30 @@ def run_evaluator(
 
     prompt_tokens = usage.get("prompt_tokens", 0)
     completion_tokens = usage.get("completion_tokens", 0)
+    cached_tokens = usage.get("cached_tokens", 0) or 0
 
-    cost = calculate_cost(model, prompt_tokens, completion_tokens)
+    cost = calculate_cost(model, prompt_tokens, completion_tokens, cached_tokens) * price_factor
+    cache_savings = calculate_cache_savings(model, cached_tokens) * price_factor
 
-    llm_score = parse_numeric_score(raw_output)
+    label_probs = None
+    scoring_mode = "text"
 
-    classification = "completed" if llm_score is not None else "failed"
+    if labels:
+        llm_score, label_probs, scoring_mode = score_label_response(response, labels)
+    else:
+        llm_score = parse_numeric_score(raw_output)
 
-    final_score = llm_score
+    classification = "completed" if llm_score is not None else "failed"
 
     raw_output = {
         "llm_output": raw_output,
-        "trace_methods": trace_methods
+        "trace_methods": trace_methods,
+        "scoring_mode": scoring_mode
     }
 
+    if label_probs:
+        raw_output["label_probs"] = label_probs
+
     return {
         "evaluator_id": evaluator_id,
         "template_id": template_id,
@@ -309,5 +818,29 @@ def run_evaluator(
         "score": llm_score,
         "classification": classification,
         "raw_output": raw_output,
-        "cost_usd": round(cost, 6)
-    }
\ No newline at end of file
+        "cost_usd": round(cost, 6),
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": cached_tokens,
+        "cache_savings_usd": round(cache_savings, 8),
+        "context_tokens_trimmed": prepared.get("context_tokens_trimmed", 0)
+    }
+
+
+def run_evaluator(
+    evaluator_id: str,
+    variables: dict,
+    deployment: Optional[str] = None,
+    trace_methods: Optional[dict] = None
+) -> dict:
+
+    logging.info(f"[engine] Starting run_evaluator for {evaluator_id}")
+
+    prepared = prepare_evaluation(evaluator_id, variables, deployment)
+
+    response = call_llm(
+        model=prepared["model"],
+        prompt=prepared["prompt"],
+        **prepared["llm_kwargs"]
+    )
+
+    return finish_evaluation(prepared, response, trace_methods)
@@ -0,0 +1,259 @@
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+
+
+# ----------------------------------------------------
+# Text Splitting
+# ----------------------------------------------------
+
+# Separator normalize_trace uses to join retrieved chunks into "context"
+CONTEXT_SEPARATOR = "\n\n"
+
+TOKEN_PATTERN = re.compile(r"\w+")
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*")
+ENTITY_PATTERN = re.compile(r"\b[A-Z][\w-]*(?:\s+[A-Z][\w-]*)*")
+
+
+def split_chunks(context) -> list:
+    if isinstance(context, list):
+        return [c for c in context if c]
+    return [c for c in (context or "").split(CONTEXT_SEPARATOR) if c.strip()]
+
+
+def split_sentences(text: str) -> list:
+    return [s for s in re.split(r"(?<=[.!?])\s+", (text or "").strip()) if s]
+
+
+# ----------------------------------------------------
+# Cached Tokenization (shared by every metric)
+# ----------------------------------------------------
+
+@lru_cache(maxsize=8192)
+def tokenize(text: str) -> tuple:
+    return tuple(TOKEN_PATTERN.findall(text.lower())) if text else ()
+
+
+@lru_cache(maxsize=8192)
+def extract_numbers(text: str) -> frozenset:
+    return frozenset(n.replace(",", "") for n in NUMBER_PATTERN.findall(text or ""))
+
+
+@lru_cache(maxsize=8192)
+def extract_entities(text: str) -> frozenset:
+    """
+    Capitalised word runs, skipping sentence-initial single words.
+    """
+    entities = set()
+    for match in ENTITY_PATTERN.finditer(text or ""):
+        start = match.start()
+        prefix = text[:start].rstrip()
+        sentence_start = not prefix or prefix[-1] in ".!?\n"
+        if sentence_start and " " not in match.group(0):
+            continue
+        entities.add(match.group(0).lower())
+    return frozenset(entities)
+
+
+def _context_text(context) -> str:
+    return CONTEXT_SEPARATOR.join(context) if isinstance(context, list) else (context or "")
+
+
+# ----------------------------------------------------
+# Token F1
+# ----------------------------------------------------
+
+def compute_token_f1(context, answer: str) -> float:
+    """
+    SQuAD-style bag-of-tokens F1 of the answer against its best-matching
+    retrieved chunk.
+    """
+    answer_tokens = Counter(tokenize(answer))
+
+    if not answer_tokens:
+        return 0.0
+
+    best = 0.0
+
+    for chunk in split_chunks(context):
+        chunk_tokens = Counter(tokenize(chunk))
+        common = sum((answer_tokens & chunk_tokens).values())
+
+        if not common:
+            continue
+
+        precision = common / sum(answer_tokens.values())
+        recall = common / sum(chunk_tokens.values())
+        best = max(best, 2 * precision * recall / (precision + recall))
+
+    return round(best, 2)
+
+
+# ----------------------------------------------------
+# ROUGE-L (bit-parallel LCS)
+# ----------------------------------------------------
+
+def lcs_length(a: tuple, b: tuple) -> int:
+    """
+    Longest common subsequence via the bit-parallel algorithm
+    (Allison-Dix / Hyyro): one big-int update per token of b, so
+    O(len(a) * len(b) / word_size).
+    """
+    if not a or not b:
+        return 0
+
+    masks = {}
+    for i, token in enumerate(a):
+        masks[token] = masks.get(token, 0) | (1 << i)
+
+    full = (1 << len(a)) - 1
+    v = full
+
+    for token in b:
+        u = v & masks.get(token, 0)
+        v = ((v + u) | (v - u)) & full
+
+    return len(a) - bin(v).count("1")
+
+
+def compute_rouge_l(context, answer: str) -> float:
+    """
+    ROUGE-L F1 of the answer against its best-matching retrieved chunk.
+    """
+    answer_tokens = tokenize(answer)
+
+    if not answer_tokens:
+        return 0.0
+
+    best = 0.0
+
+    for chunk in split_chunks(context):
+        chunk_tokens = tokenize(chunk)
+        lcs = lcs_length(chunk_tokens, answer_tokens)
+
+        if not lcs:
+            continue
+
+        precision = lcs / len(answer_tokens)
+        recall = lcs / len(chunk_tokens)
+        best = max(best, 2 * precision * recall / (precision + recall))
+
+    return round(best, 2)
+
+
+# ----------------------------------------------------
+# BM25
+# ----------------------------------------------------
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def compute_bm25(context, answer: str) -> float:
+    """
+    BM25 of the answer (as query) against each retrieved chunk, taking the
+    best chunk and normalising by the answer's score against itself (as a
+    document of the same collection), so a chunk repeating the answer
+    scores 1.0.
+    """
+    query = set(tokenize(answer))
+    chunks = [tokenize(c) for c in split_chunks(context)]
+    chunks = [c for c in chunks if c]
+
+    if not query or not chunks:
+        return 0.0
+
+    n_docs = len(chunks)
+    avg_len = sum(len(c) for c in chunks) / n_docs
+
+    doc_freq = Counter()
+    for chunk in chunks:
+        doc_freq.update(set(chunk) & query)
+
+    idf = {
+        term: math.log(1 + (n_docs - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+        for term in query
+    }
+
+    def score(doc: tuple) -> float:
+        tf = Counter(doc)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * len(doc) / avg_len)
+        return sum(
+            idf[term] * tf[term] * (BM25_K1 + 1) / (tf[term] + norm)
+            for term in query if tf[term]
+        )
+
+    self_score = score(tokenize(answer))
+    best = max(score(chunk) for chunk in chunks)
+
+    return round(min(best / self_score, 1.0), 2) if self_score else 0.0
+
+
+# ----------------------------------------------------
+# N-gram Novelty
+# ----------------------------------------------------
+
+NGRAM_SIZE = 3
+
+
+def _ngrams(tokens: tuple, n: int) -> set:
+    return {tokens[i:i + n] for i in range(len(tokens) - n + 1)}
+
+
+def compute_ngram_novelty(context, answer: str) -> float:
+    """
+    Share of answer n-grams that also occur in the context, i.e.
+    1 - novelty, so that higher means better grounded like every
+    other method.
+    """
+    answer_tokens = tokenize(answer)
+    n = min(NGRAM_SIZE, len(answer_tokens))
+
+    if not n:
+        return 0.0
+
+    answer_ngrams = _ngrams(answer_tokens, n)
+
+    context_ngrams = set()
+    for chunk in split_chunks(context):
+        context_ngrams |= _ngrams(tokenize(chunk), n)
+
+    novel = len(answer_ngrams - context_ngrams)
+
+    return round(1 - novel / len(answer_ngrams), 2)
+
+
+# ----------------------------------------------------
+# Number / Entity Overlap
+# ----------------------------------------------------
+
+def compute_number_overlap(context, answer: str) -> float:
+    """
+    Fraction of numbers in the answer that appear in the context.
+    Answers without numbers have nothing unsupported and score 1.0.
+    """
+    answer_numbers = extract_numbers(answer)
+
+    if not answer_numbers:
+        return 1.0
+
+    supported = answer_numbers & extract_numbers(_context_text(context))
+
+    return round(len(supported) / len(answer_numbers), 2)
+
+
+def compute_entity_overlap(context, answer: str) -> float:
+    """
+    Fraction of named entities (capitalised spans) in the answer that the
+    context mentions. Answers without entities score 1.0.
+    """
+    answer_entities = extract_entities(answer)
+
+    if not answer_entities:
+        return 1.0
+
+    context_lower = _context_text(context).lower()
+    supported = [e for e in answer_entities if e in context_lower]
+
+    return round(len(supported) / len(answer_entities), 2)
@@ -0,0 +1,568 @@
+"""
+Mergeable running aggregates behind the metrics snapshot.
+
+✔ MetricsAggregate: counts, sums, model / trace-name breakdowns,
+  evaluator averages and score histograms, latency sketches and
+  HyperLogLog distinct counts; add_trace / add_evaluation / merge
+✔ Serialises to plain JSON for Cosmos (to_dict / from_dict)
+✔ Change-feed state docs with a checkpoint, updated under etag
+  optimistic concurrency
+✔ apply_docs(): a re-written doc replaces its earlier contribution
+  instead of being counted again
+"""
+
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+from shared.sketches import SCORE_RANGE, DDSketch, HyperLogLog, ScoreHistogram
+
+
+# =====================================================
+# Configuration
+# =====================================================
+
+METRICS_ID = "metrics_snapshot"
+METRICS_PK = "metrics_snapshot"
+
+STATE_PK = "aggregate_state"
+FEEDS = ("traces", "evaluations")
+
+# Docs whose last applied contribution is kept per aggregate doc, to
+# drop redeliveries and retract the old values of a re-written doc
+APPLIED_WINDOW = int(os.getenv("AGGREGATE_APPLIED_WINDOW", "1000"))
+
+MAX_CONFLICT_RETRIES = 5
+
+# Evaluations still waiting on a batch job are not scored yet
+UNSCORED_STATUSES = {"pending"}
+
+# Only the fields add_trace / add_evaluation (and the change-feed
+# dedupe) read; traces otherwise carry span payloads, input / output
+# text and retrieved context
+FEED_PROJECTIONS = {
+    "traces": (
+        "c.id, c._ts, c.trace_id, c.trace_name, c.application_name, c.session, c.request, "
+        "c.usage, c.cost, c.performance, c.model_info, "
+        "ARRAY(SELECT s.type, s.latency_ms FROM s IN c.spans) AS spans"
+    ),
+    "evaluations": (
+        "c.id, c._ts, c.timestamp, c.trace_timestamp, c.trace_id, c.evaluator_id, c.evaluator, c.score, c.status, "
+        "c.variance, c.deployments_used, c.score_range"
+    ),
+}
+
+
+# =====================================================
+# Aggregate
+# =====================================================
+
+def _sum_into(target: dict, source: dict):
+    for k, v in source.items():
+        target[k] += v
+
+
+def _distinct_from(value) -> HyperLogLog:
+    # State docs written before the sketches hold plain id lists
+    if isinstance(value, list):
+        hll = HyperLogLog()
+        for item in value:
+            hll.add(item)
+        return hll
+    return HyperLogLog.from_dict(value)
+
+
+def _evaluator_model(e: dict) -> str:
+    # Ensembles are keyed by their full deployment set
+    return ",".join(e.get("deployments_used") or []) or "unknown"
+
+
+class MetricsAggregate:
+
+    COUNTERS = ("total_traces", "total_tokens", "total_cost", "total_latency")
+
+    BREAKDOWNS = (
+        "tokens_by_model",
+        "cost_by_model",
+        "trace_count_by_model",
+        "trace_count_by_name",
+        "cost_by_trace_name",
+        "tokens_by_trace_name",
+        "eval_score_sum",
+        "eval_count",
+    )
+
+    SKETCHES = (
+        "latency_by_model",
+        "latency_by_trace_name",
+        "span_latency_by_type",
+    )
+
+    DISTINCT = ("sessions", "users", "applications")
+
+    DISTINCT_BY_APPLICATION = ("sessions_by_application", "users_by_application")
+
+    def __init__(self):
+        self.total_traces = 0
+        self.total_tokens = 0
+        self.total_cost = 0.0
+        self.total_latency = 0
+
+        for name in self.BREAKDOWNS:
+            setattr(self, name, defaultdict(float))
+
+        # Latency quantile sketches (ms), overall and per dimension
+        self.latency = DDSketch()
+        for name in self.SKETCHES:
+            setattr(self, name, defaultdict(DDSketch))
+
+        # Score histograms per evaluator, per evaluator model(s)
+        self.score_histograms = defaultdict(lambda: defaultdict(ScoreHistogram))
+
+        # Distinct-count sketches, overall and per application
+        for name in self.DISTINCT:
+            setattr(self, name, HyperLogLog())
+        for name in self.DISTINCT_BY_APPLICATION:
+            setattr(self, name, defaultdict(HyperLogLog))
+
+    # -------------------------------------------------
+    # Updates
+    # -------------------------------------------------
+
+    def add_trace(self, t: dict):
+
+        usage = t.get("usage", {}) or {}
+        cost_obj = t.get("cost", {}) or {}
+        performance = t.get("performance", {}) or {}
+        model_info = t.get("model_info", {}) or {}
+        session_obj = t.get("session", {}) or {}
+
+        tokens = usage.get("total_tokens", 0) or 0
+        cost = cost_obj.get("total_cost_usd", 0.0) or 0.0
+        latency = performance.get("latency_ms", 0) or 0
+
+        self.total_traces += 1
+        self.total_tokens += tokens
+        self.total_cost += cost
+        self.total_latency += latency
+
+        model = model_info.get("model", "unknown")
+        self.tokens_by_model[model] += tokens
+        self.cost_by_model[model] += cost
+        self.trace_count_by_model[model] += 1
+
+        trace_name = t.get("trace_name", "unknown")
+        self.trace_count_by_name[trace_name] += 1
+        self.cost_by_trace_name[trace_name] += cost
+        self.tokens_by_trace_name[trace_name] += tokens
+
+        if performance.get("latency_ms") is not None:
+            self.latency.add(latency)
+            self.latency_by_model[model].add(latency)
+            self.latency_by_trace_name[trace_name].add(latency)
+
+        for span in t.get("spans") or []:
+            if isinstance(span, dict) and span.get("latency_ms") is not None:
+                self.span_latency_by_type[span.get("type") or "unknown"].add(span["latency_ms"])
+
+        application = t.get("application_name")
+        self.applications.add(application)
+        application = application or "unknown"
+
+        if session_obj.get("session_id"):
+            self.sessions.add(session_obj["session_id"])
+            self.sessions_by_application[application].add(session_obj["session_id"])
+
+        if session_obj.get("user_id"):
+            self.users.add(session_obj["user_id"])
+            self.users_by_application[application].add(session_obj["user_id"])
+
+    def add_evaluation(self, e: dict):
+
+        if not e.get("trace_id") or e.get("status") in UNSCORED_STATUSES:
+            return
+
+        evaluator_name = e.get("evaluator_id") or e.get("evaluator")
+        score = e.get("score")
+
+        if not evaluator_name:
+            return
+
+        # Bins span the evaluator's configured score range (stamped on the
+        # doc); a doc on another range than the histogram's, i.e. the
+        # config changed, is rescaled by merge()
+        low, high = e.get("score_range") or SCORE_RANGE
+        scored = ScoreHistogram(low=low, high=high)
+        scored.add(e.get("status"), score, e.get("variance"))
+        self.score_histograms[evaluator_name][_evaluator_model(e)].merge(scored)
+
+        if score is None:
+            return
+
+        self.eval_score_sum[evaluator_name] += score
+        self.eval_count[evaluator_name] += 1
+
+    def merge(self, other: "MetricsAggregate") -> "MetricsAggregate":
+
+        for name in self.COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+        for name in self.BREAKDOWNS:
+            _sum_into(getattr(self, name), getattr(other, name))
+
+        self.latency.merge(other.latency)
+        for name in self.SKETCHES:
+            mine = getattr(self, name)
+            for key, sketch in getattr(other, name).items():
+                mine[key].merge(sketch)
+
+        for evaluator_name, by_model in other.score_histograms.items():
+            for model, hist in by_model.items():
+                self.score_histograms[evaluator_name][model].merge(hist)
+
+        for name in self.DISTINCT:
+            getattr(self, name).merge(getattr(other, name))
+        for name in self.DISTINCT_BY_APPLICATION:
+            mine = getattr(self, name)
+            for key, hll in getattr(other, name).items():
+                mine[key].merge(hll)
+
+        return self
+
+    def subtract(self, other: "MetricsAggregate") -> "MetricsAggregate":
+        """
+        Retract an earlier contribution (see apply_docs). Distinct-count
+        sketches cannot forget values; re-adding the same ids is a no-op.
+        """
+
+        for name in self.COUNTERS:
+            setattr(self, name, getattr(self, name) - getattr(other, name))
+
+        for name in self.BREAKDOWNS:
+            mine = getattr(self, name)
+            for key, value in getattr(other, name).items():
+                mine[key] -= value
+                if abs(mine[key]) < 1e-9:
+                    del mine[key]
+
+        self.latency.subtract(other.latency)
+        for name in self.SKETCHES:
+            mine = getattr(self, name)
+            for key, sketch in getattr(other, name).items():
+                mine[key].subtract(sketch)
+                if not mine[key].count:
+                    del mine[key]
+
+        for evaluator_name, by_model in other.score_histograms.items():
+            for model, hist in by_model.items():
+                self.score_histograms[evaluator_name][model].subtract(hist)
+
+        return self
+
+    # -------------------------------------------------
+    # Serialisation
+    # -------------------------------------------------
+
+    def to_dict(self) -> dict:
+        return {
+            **{name: getattr(self, name) for name in self.COUNTERS},
+            **{name: dict(getattr(self, name)) for name in self.BREAKDOWNS},
+            "latency": self.latency.to_dict(),
+            **{name: {k: v.to_dict() for k, v in getattr(self, name).items()} for name in self.SKETCHES},
+            "score_histograms": {
+                ev: {m: h.to_dict() for m, h in by_model.items()}
+                for ev, by_model in self.score_histograms.items()
+            },
+            **{name: getattr(self, name).to_dict() for name in self.DISTINCT},
+            **{name: {k: v.to_dict() for k, v in getattr(self, name).items()} for name in self.DISTINCT_BY_APPLICATION},
+        }
+
+    @classmethod
+    def from_dict(cls, d: Optional[dict]) -> "MetricsAggregate":
+
+        agg = cls()
+
+        if not d:
+            return agg
+
+        for name in cls.COUNTERS:
+            setattr(agg, name, d.get(name, 0))
+
+        for name in cls.BREAKDOWNS:
+            _sum_into(getattr(agg, name), d.get(name) or {})
+
+        agg.latency = DDSketch.from_dict(d.get("latency"))
+        for name in cls.SKETCHES:
+            getattr(agg, name).update({k: DDSketch.from_dict(v) for k, v in (d.get(name) or {}).items()})
+
+        for ev, by_model in (d.get("score_histograms") or {}).items():
+            agg.score_histograms[ev].update({m: ScoreHistogram.from_dict(h) for m, h in by_model.items()})
+
+        for name in cls.DISTINCT:
+            setattr(agg, name, _distinct_from(d.get(name)))
+        for name in cls.DISTINCT_BY_APPLICATION:
+            getattr(agg, name).update({k: HyperLogLog.from_dict(v) for k, v in (d.get(name) or {}).items()})
+
+        return agg
+
+    # -------------------------------------------------
+    # Snapshot (same shape the dashboard already reads)
+    # -------------------------------------------------
+
+    def snapshot(self) -> dict:
+
+        evaluation_summary = {}
+
+        for evaluator_name, count in self.eval_count.items():
+            if count > 0:
+                evaluation_summary[evaluator_name] = {
+                    "count": int(count),
+                    "avg_score": round(self.eval_score_sum[evaluator_name] / count, 3)
+                }
+
+        total_sessions = self.sessions.count()
+
+        return {
+            "total_traces": self.total_traces,
+            "total_sessions": total_sessions,
+            "total_users": self.users.count(),
+            "total_applications": self.applications.count(),
+
+            "avg_traces_per_session": round(
+                self.total_traces / total_sessions, 2
+            ) if total_sessions else 0,
+
+            "avg_latency_ms": round(
+                self.total_latency / self.total_traces, 2
+            ) if self.total_traces else 0,
+
+            "total_tokens": self.total_tokens,
+            "total_cost": round(self.total_cost, 6),
+
+            "tokens_by_model": {k: int(v) for k, v in self.tokens_by_model.items()},
+            "cost_by_model": {k: round(v, 6) for k, v in self.cost_by_model.items()},
+            "trace_count_by_model": {k: int(v) for k, v in self.trace_count_by_model.items()},
+
+            "trace_count_by_name": {k: int(v) for k, v in self.trace_count_by_name.items()},
+            "cost_by_trace_name": {k: round(v, 6) for k, v in self.cost_by_trace_name.items()},
+            "tokens_by_trace_name": {k: int(v) for k, v in self.tokens_by_trace_name.items()},
+
+            "evaluation_summary": evaluation_summary,
+
+            "latency_percentiles": self.latency.percentiles(),
+            "latency_percentiles_by_model": {k: v.percentiles() for k, v in self.latency_by_model.items()},
+            "latency_percentiles_by_trace_name": {k: v.percentiles() for k, v in self.latency_by_trace_name.items()},
+            "span_latency_percentiles_by_type": {k: v.percentiles() for k, v in self.span_latency_by_type.items()},
+
+            "sessions_by_application": {k: v.count() for k, v in self.sessions_by_application.items()},
+            "users_by_application": {k: v.count() for k, v in self.users_by_application.items()},
+        }
+
+
+def aggregate_docs(feed: str, docs: Iterable[dict]) -> MetricsAggregate:
+
+    agg = MetricsAggregate()
+    add = agg.add_trace if feed == "traces" else agg.add_evaluation
+
+    for doc in docs:
+        add(doc)
+
+    return agg
+
+
+# =====================================================
+# Change-Feed State (one doc per feed)
+# =====================================================
+
+def state_id(feed: str) -> str:
+    return f"{STATE_PK}:{feed}"
+
+
+def read_state(container, feed: str) -> Optional[dict]:
+    try:
+        return container.read_item(state_id(feed), partition_key=STATE_PK)
+    except exceptions.CosmosResourceNotFoundError:
+        return None
+
+
+def new_state(feed: str, agg: MetricsAggregate, checkpoint: Optional[dict] = None) -> dict:
+    return {
+        "id": state_id(feed),
+        "partitionKey": STATE_PK,
+        "feed": feed,
+        "aggregate": agg.to_dict(),
+        "checkpoint": checkpoint or {"last_ts": 0, "applied": [], "batches": 0, "docs": 0},
+    }
+
+
+def update_with_etag(container, doc_id: str, partition_key: str, update) -> dict:
+    """
+    Read-modify-write under optimistic concurrency. `update(existing)`
+    gets the current doc (or None) and returns the new body; it is called
+    again with the fresh doc after every conflict.
+    """
+
+    for _ in range(MAX_CONFLICT_RETRIES):
+
+        try:
+            existing = container.read_item(doc_id, partition_key=partition_key)
+        except exceptions.CosmosResourceNotFoundError:
+            existing = None
+
+        body = update(existing)
+
+        try:
+            if existing is not None:
+                container.replace_item(
+                    doc_id,
+                    body,
+                    etag=existing["_etag"],
+                    match_condition=MatchConditions.IfNotModified
+                )
+            else:
+                container.create_item(body)
+            return body
+
+        except (exceptions.CosmosAccessConditionFailedError, exceptions.CosmosResourceExistsError):
+            logging.info(f"[aggregates] {doc_id} changed concurrently, retrying")
+
+    raise RuntimeError(f"Could not update {doc_id} after {MAX_CONFLICT_RETRIES} attempts")
+
+
+def _pick(d: dict, keys: tuple) -> dict:
+    return {k: d[k] for k in keys if k in d}
+
+
+def contribution(feed: str, doc: dict) -> dict:
+    """
+    The fields add_trace / add_evaluation read, i.e. everything needed
+    to replay or retract the doc's effect on an aggregate.
+    """
+
+    if feed != "traces":
+        return _pick(doc, ("trace_id", "evaluator_id", "evaluator", "score", "status", "variance", "deployments_used", "score_range"))
+
+    picked = _pick(doc, ("trace_name", "application_name"))
+
+    for field, keys in (
+        ("session", ("session_id", "user_id")),
+        ("usage", ("total_tokens",)),
+        ("cost", ("total_cost_usd",)),
+        ("performance", ("latency_ms",)),
+        ("model_info", ("model",)),
+    ):
+        picked[field] = _pick(doc.get(field) or {}, keys)
+
+    picked["spans"] = [
+        _pick(span, ("type", "latency_ms"))
+        for span in doc.get("spans") or []
+        if isinstance(span, dict) and span.get("latency_ms") is not None
+    ]
+
+    return picked
+
+
+def applied_from(doc: Optional[dict]) -> dict:
+    """
+    {doc id: last applied contribution} of an aggregate doc, oldest
+    first. Ids from the older recent_ids window map to None: applied,
+    contribution unknown.
+    """
+
+    doc = doc or {}
+    checkpoint = doc.get("checkpoint") or doc
+
+    applied = {doc_id.split("@")[0]: None for doc_id in checkpoint.get("recent_ids") or []}
+    applied.update((doc_id, c) for doc_id, c in checkpoint.get("applied") or [])
+
+    return applied
+
+
+def apply_docs(feed: str, agg: MetricsAggregate, applied: dict, docs: list) -> tuple:
+    """
+    Fold docs into `agg`, keyed by doc id: a redelivery (same
+    contribution) is dropped, a re-write retracts the doc's previous
+    contribution before adding the new one. Returns (applied docs,
+    new `applied` list for the doc, bounded by APPLIED_WINDOW).
+    """
+
+    applied = dict(applied)
+    added, removed = [], []
+
+    for doc in docs:
+
+        doc_id = doc.get("id")
+        new = contribution(feed, doc)
+
+        if doc_id is None:
+            added.append(new)
+            continue
+
+        if doc_id in applied:
+            old = applied.pop(doc_id)
+            applied[doc_id] = old
+            if old is None or old == new:
+                continue
+            removed.append(old)
+
+        added.append(new)
+        applied[doc_id] = new
+
+    agg.merge(aggregate_docs(feed, added)).subtract(aggregate_docs(feed, removed))
+
+    return len(added), [[doc_id, c] for doc_id, c in list(applied.items())[-APPLIED_WINDOW:]]
+
+
+def apply_feed_batch(container, feed: str, docs: list) -> MetricsAggregate:
+    """
+    Fold one change-feed batch into the feed's state doc, dropping
+    redeliveries and replacing re-written docs. Returns the new aggregate.
+    """
+
+    def update(state):
+        state = state or new_state(feed, MetricsAggregate())
+        checkpoint = state["checkpoint"]
+
+        agg = MetricsAggregate.from_dict(state.get("aggregate"))
+        count, applied = apply_docs(feed, agg, applied_from(state), docs)
+
+        return new_state(feed, agg, {
+            "last_ts": max([checkpoint.get("last_ts", 0)] + [d.get("_ts", 0) for d in docs]),
+            "applied": applied,
+            "batches": checkpoint.get("batches", 0) + 1,
+            "docs": checkpoint.get("docs", 0) + count,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        })
+
+    body = update_with_etag(container, state_id(feed), STATE_PK, update)
+
+    return MetricsAggregate.from_dict(body["aggregate"])
+
+
+def write_snapshot(container, aggregates: dict = None):
+    """
+    Merge both feeds' aggregates into metrics_snapshot. `aggregates` may
+    hold already-known {feed: MetricsAggregate}; the rest are read.
+    """
+
+    aggregates = dict(aggregates or {})
+    total = MetricsAggregate()
+
+    for feed in FEEDS:
+        if feed not in aggregates:
+            state = read_state(container, feed)
+            aggregates[feed] = MetricsAggregate.from_dict(state and state.get("aggregate"))
+        total.merge(aggregates[feed])
+
+    container.upsert_item({
+        "id": METRICS_ID,
+        "partitionKey": METRICS_PK,
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        **total.snapshot()
+    })
+
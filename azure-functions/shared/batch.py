@@ -0,0 +1,262 @@
+"""
+Offline batch execution for deferred evaluations.
+
+✔ Requests written as OpenAI-style batch JSONL lines
+✔ Pluggable backend: Azure OpenAI Batch API or a local stand-in
+✔ Results parsed back into the call_llm() response shape
+"""
+
+import json
+import logging
+import os
+import uuid
+from typing import Any, Dict, List, Optional
+
+from shared.llm import SYSTEM_PROMPT, call_llm
+
+
+# =====================================================
+# Configuration
+# =====================================================
+
+# "azure" (Batch API) or "local" (runs the file through call_llm)
+LLM_BATCH_BACKEND = os.getenv("LLM_BATCH_BACKEND", "azure").lower()
+
+# Batch jobs must target Global-Batch deployments; map model -> deployment
+# e.g. {"gpt-4o-mini": "gpt-4o-mini-batch"}
+BATCH_DEPLOYMENTS: Dict[str, str] = json.loads(os.getenv("AZURE_OPENAI_BATCH_DEPLOYMENTS", "{}") or "{}")
+
+BATCH_COMPLETION_WINDOW = os.getenv("LLM_BATCH_COMPLETION_WINDOW", "24h")
+BATCH_LOCAL_DIR = os.getenv("LLM_BATCH_LOCAL_DIR", os.path.join("/tmp", "llm-batches"))
+
+# Batch API calls are billed at half the synchronous price
+BATCH_PRICE_FACTOR = float(os.getenv("LLM_BATCH_PRICE_FACTOR", "0.5"))
+
+PENDING = "pending"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+# =====================================================
+# Request / Response Format
+# =====================================================
+
+def chat_request(
+    custom_id: str,
+    model: str,
+    prompt: str,
+    max_tokens: int = 200,
+    temperature: float = 0.0,
+    logprobs: bool = False,
+    top_logprobs: int = 5,
+    system_prompt: str = SYSTEM_PROMPT
+) -> Dict[str, Any]:
+    """
+    One JSONL line for /chat/completions, mirroring call_llm's messages.
+    """
+    body = {
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+    }
+
+    if logprobs:
+        body["logprobs"] = True
+        body["top_logprobs"] = top_logprobs
+
+    return {"custom_id": custom_id, "method": "POST", "url": "/chat/completions", "body": body}
+
+
+def parse_chat_response(body: dict) -> Optional[Dict[str, Any]]:
+    """
+    Batch output body -> the dict call_llm() returns.
+    """
+    choices = body.get("choices") or []
+    if not choices or not choices[0].get("message", {}).get("content"):
+        return None
+
+    usage = body.get("usage") or {}
+    content = ((choices[0].get("logprobs") or {}).get("content")) or []
+
+    return {
+        "text": choices[0]["message"]["content"].strip(),
+        "usage": {
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "cached_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0) or 0
+        },
+        "latency_ms": None,
+        "top_logprobs": content[0].get("top_logprobs") if content else None
+    }
+
+
+def to_jsonl(requests: List[dict]) -> bytes:
+    return "\n".join(json.dumps(r) for r in requests).encode("utf-8")
+
+
+# =====================================================
+# Backends
+# =====================================================
+
+class BatchBackend:
+    """
+    submit() returns a provider batch id; status() maps the provider state
+    to pending/completed/failed; results() returns {custom_id: response};
+    cancel() stops a batch nobody will collect.
+    """
+
+    name = "base"
+
+    def submit(self, requests: List[dict]) -> str:
+        raise NotImplementedError
+
+    def status(self, batch_id: str) -> str:
+        raise NotImplementedError
+
+    def results(self, batch_id: str) -> Dict[str, Optional[dict]]:
+        raise NotImplementedError
+
+    def cancel(self, batch_id: str) -> None:
+        raise NotImplementedError
+
+
+class AzureOpenAIBatchBackend(BatchBackend):
+
+    name = "azure"
+
+    FAILED_STATES = {"failed", "expired", "cancelled", "cancelling"}
+
+    def __init__(self):
+        from shared.llm import client
+
+        if client is None:
+            raise RuntimeError("Azure OpenAI client is not configured")
+
+        self.client = client
+
+    def submit(self, requests: List[dict]) -> str:
+
+        for r in requests:
+            r["body"]["model"] = BATCH_DEPLOYMENTS.get(r["body"]["model"], r["body"]["model"])
+
+        batch_file = self.client.files.create(
+            file=(f"eval-{uuid.uuid4().hex}.jsonl", to_jsonl(requests)),
+            purpose="batch"
+        )
+
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/chat/completions",
+            completion_window=BATCH_COMPLETION_WINDOW
+        )
+
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+
+        state = self.client.batches.retrieve(batch_id).status
+
+        if state == "completed":
+            return COMPLETED
+        if state in self.FAILED_STATES:
+            return FAILED
+        return PENDING
+
+    def results(self, batch_id: str) -> Dict[str, Optional[dict]]:
+
+        batch = self.client.batches.retrieve(batch_id)
+        out = {}
+
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+
+                record = json.loads(line)
+                response = record.get("response") or {}
+
+                if response.get("status_code") == 200:
+                    out[record["custom_id"]] = parse_chat_response(response.get("body") or {})
+                else:
+                    logging.warning(f"[batch:{batch_id}] {record.get('custom_id')} failed: {record.get('error')}")
+                    out[record["custom_id"]] = None
+
+        return out
+
+    def cancel(self, batch_id: str) -> None:
+        self.client.batches.cancel(batch_id)
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    Stand-in that keeps the JSONL on disk and answers it through the
+    synchronous call_llm path when results are requested.
+    """
+
+    name = "local"
+
+    def _path(self, batch_id: str) -> str:
+        return os.path.join(BATCH_LOCAL_DIR, f"{batch_id}.jsonl")
+
+    def submit(self, requests: List[dict]) -> str:
+
+        os.makedirs(BATCH_LOCAL_DIR, exist_ok=True)
+        batch_id = f"local-{uuid.uuid4().hex}"
+
+        with open(self._path(batch_id), "wb") as f:
+            f.write(to_jsonl(requests))
+
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        return COMPLETED if os.path.exists(self._path(batch_id)) else FAILED
+
+    def results(self, batch_id: str) -> Dict[str, Optional[dict]]:
+
+        out = {}
+
+        with open(self._path(batch_id)) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+
+                request = json.loads(line)
+                body = request["body"]
+
+                out[request["custom_id"]] = call_llm(
+                    model=body["model"],
+                    prompt=body["messages"][-1]["content"],
+                    max_tokens=body.get("max_tokens", 200),
+                    temperature=body.get("temperature", 0.0),
+                    logprobs=body.get("logprobs", False),
+                    top_logprobs=body.get("top_logprobs", 5),
+                    system_prompt=body["messages"][0]["content"]
+                )
+
+        return out
+
+    def cancel(self, batch_id: str) -> None:
+        os.remove(self._path(batch_id))
+
+
+BATCH_BACKENDS = {
+    "azure": AzureOpenAIBatchBackend,
+    "local": LocalBatchBackend,
+}
+
+
+def get_batch_backend(name: Optional[str] = None) -> BatchBackend:
+
+    name = (name or LLM_BATCH_BACKEND).lower()
+
+    if name not in BATCH_BACKENDS:
+        raise ValueError(f"Unknown batch backend: {name}")
+
+    return BATCH_BACKENDS[name]()
@@ -0,0 +1,257 @@
+"""
+Dimensional trace metrics cube, one Cosmos doc per day.
+
+✔ Cells keyed by (model, provider, application, environment, intent,
+  trace_name) holding additive measures
+✔ Maintained incrementally from the traces change feed; each day doc
+  remembers the cell and measures it applied per trace id, so a
+  redelivery is dropped and a re-written trace replaces its old values
+✔ Cardinality guard: values beyond a per-dimension cap, and cells
+  beyond the per-doc cap, fold into "__other__"
+✔ Size guard: a day doc that would pass CUBE_MAX_DOC_BYTES folds its
+  smallest cells into "__other__" (Cosmos items are limited to 2MB)
+
+Keep DIMENSIONS / MEASURES in sync with backend/shared/cube.py.
+"""
+
+import json
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from shared.aggregates import APPLIED_WINDOW, applied_from, update_with_etag
+from shared.rollups import doc_time
+
+
+# =====================================================
+# Configuration
+# =====================================================
+
+CUBE_PK = "cube"
+
+DIMENSIONS = ("model", "provider", "application", "environment", "intent", "trace_name")
+
+# Stored per cell as a list in this order
+MEASURES = ("traces", "tokens", "cost", "latency_ms", "errors")
+
+OTHER = "__other__"
+
+# Distinct values kept per dimension per day before folding into OTHER
+MAX_VALUES_PER_DIMENSION = int(os.getenv("CUBE_MAX_VALUES_PER_DIMENSION", "200"))
+
+# Hard cap on cells per day doc
+MAX_CELLS = int(os.getenv("CUBE_MAX_CELLS", "5000"))
+
+# Serialized size a day doc is kept under (Cosmos items are limited to
+# 2MB; long dimension values make the cell count alone a weak bound)
+MAX_DOC_BYTES = int(os.getenv("CUBE_MAX_DOC_BYTES", "1500000"))
+
+# Share of the remaining cells folded per pass when a doc is too large
+FOLD_FRACTION = 0.1
+
+
+# =====================================================
+# Cells
+# =====================================================
+
+def cube_id(day: str) -> str:
+    return f"{CUBE_PK}:{day}"
+
+
+def day_key(ts: datetime) -> str:
+    return ts.strftime("%Y-%m-%d")
+
+
+def trace_dimensions(t: dict) -> dict:
+
+    model_info = t.get("model_info", {}) or {}
+    request = t.get("request", {}) or {}
+
+    return {
+        "model": model_info.get("model") or "unknown",
+        "provider": model_info.get("provider") or "unknown",
+        "application": t.get("application_name") or "unknown",
+        "environment": request.get("environment") or "unknown",
+        "intent": request.get("intent") or "unknown",
+        "trace_name": t.get("trace_name") or "unknown",
+    }
+
+
+def trace_measures(t: dict) -> list:
+
+    performance = t.get("performance", {}) or {}
+
+    return [
+        1,
+        (t.get("usage", {}) or {}).get("total_tokens", 0) or 0,
+        (t.get("cost", {}) or {}).get("total_cost_usd", 0.0) or 0.0,
+        performance.get("latency_ms", 0) or 0,
+        1 if performance.get("status") == "failure" else 0,
+    ]
+
+
+def cell_key(dims: dict) -> str:
+    return json.dumps([dims[d] for d in DIMENSIONS], separators=(",", ":"))
+
+
+def _add_cell(cells: dict, key: str, measures: list, sign: int = 1):
+    current = cells.get(key) or [0] * len(MEASURES)
+    cells[key] = [a + sign * b for a, b in zip(current, measures)]
+    if not cells[key][0]:
+        # No traces left in the cell (all retracted)
+        del cells[key]
+
+
+def _cell_for(dims: dict, values: dict, cells: dict) -> str:
+    # Cardinality guard: new values past the per-dimension cap and new
+    # cells past the per-doc cap fold into OTHER
+    dims = dict(dims)
+
+    for d in DIMENSIONS:
+        if dims[d] not in values[d]:
+            if len(values[d]) >= MAX_VALUES_PER_DIMENSION:
+                dims[d] = OTHER
+            else:
+                values[d].add(dims[d])
+
+    key = cell_key(dims)
+
+    if key not in cells and len(cells) >= MAX_CELLS:
+        key = cell_key({d: OTHER for d in DIMENSIONS})
+
+    return key
+
+
+def add_to_day(doc: dict, traces: list) -> dict:
+    """
+    Fold traces into a day doc's cells, applying the cardinality guard.
+    A trace already applied under the same id is dropped if unchanged,
+    otherwise its previous [cell, measures] are retracted first.
+    """
+
+    cells = doc.setdefault("cells", {})
+    values = {d: set(v) for d, v in (doc.get("dimension_values") or {}).items()}
+    values = defaultdict(set, values)
+    applied = applied_from(doc)
+
+    for t in traces:
+
+        key = _cell_for(trace_dimensions(t), values, cells)
+        measures = trace_measures(t)
+
+        trace_id = t.get("id")
+
+        if trace_id in applied:
+            old = applied.pop(trace_id)
+            applied[trace_id] = old
+            if old is None or old == [key, measures]:
+                continue
+            _add_cell(cells, old[0], old[1], sign=-1)
+
+        _add_cell(cells, key, measures)
+
+        if trace_id is not None:
+            applied[trace_id] = [key, measures]
+
+    doc["dimension_values"] = {d: sorted(v) for d, v in values.items()}
+    doc["applied"] = [[k, c] for k, c in list(applied.items())[-APPLIED_WINDOW:]]
+    doc.pop("recent_ids", None)
+
+    return doc
+
+
+def _doc_bytes(doc: dict) -> int:
+    return len(json.dumps(doc, separators=(",", ":")))
+
+
+def fit_day(doc: dict) -> dict:
+    """
+    Fold the smallest cells into the all-OTHER cell until the doc is
+    under MAX_DOC_BYTES. Applied entries follow their cell, so a later
+    retraction still hits the cell that holds the values. With no cell
+    left to fold, the oldest half of the applied window is dropped.
+    """
+
+    cells = doc.get("cells") or {}
+    other = cell_key({d: OTHER for d in DIMENSIONS})
+
+    while _doc_bytes(doc) > MAX_DOC_BYTES:
+
+        candidates = sorted((k for k in cells if k != other), key=lambda k: cells[k][0])
+
+        if not candidates:
+            applied = doc.get("applied") or []
+            if not applied:
+                break
+            doc["applied"] = applied[len(applied) // 2 or 1:]
+            continue
+
+        folded = set(candidates[:max(1, int(len(candidates) * FOLD_FRACTION))])
+
+        for key in folded:
+            _add_cell(cells, other, cells.pop(key))
+
+        doc["applied"] = [
+            [trace_id, [other, entry[1]] if entry and entry[0] in folded else entry]
+            for trace_id, entry in doc.get("applied") or []
+        ]
+
+    return doc
+
+
+def new_day(day: str, doc: dict) -> dict:
+    return fit_day({
+        **doc,
+        "id": cube_id(day),
+        "partitionKey": CUBE_PK,
+        "day": day,
+        "dimensions": list(DIMENSIONS),
+        "measures": list(MEASURES),
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    })
+
+
+def build_day(day: str, cells_by_dims: dict, recent_traces: list) -> dict:
+    """
+    A day doc from scratch (full rebuild): `cells_by_dims` maps a
+    DIMENSIONS tuple to summed measures. Largest cells claim the capped
+    values first. `recent_traces` seed the applied window.
+    """
+
+    cells = {}
+    values = defaultdict(set)
+
+    for dims, measures in sorted(cells_by_dims.items(), key=lambda kv: -kv[1][0]):
+        _add_cell(cells, _cell_for(dict(zip(DIMENSIONS, dims)), values, cells), measures)
+
+    applied = [
+        [t["id"], [_cell_for(trace_dimensions(t), values, cells), trace_measures(t)]]
+        for t in recent_traces
+    ]
+
+    return new_day(day, {
+        "cells": cells,
+        "dimension_values": {d: sorted(v) for d, v in values.items()},
+        "applied": applied[-APPLIED_WINDOW:],
+    })
+
+
+# =====================================================
+# Ingest (change feed)
+# =====================================================
+
+def apply_cube(container, docs: list):
+
+    by_day = defaultdict(list)
+
+    for doc in docs:
+        by_day[day_key(doc_time("traces", doc))].append(doc)
+
+    for day, day_docs in by_day.items():
+
+        def update(existing, day=day, day_docs=day_docs):
+            existing = {k: v for k, v in (existing or {}).items() if not k.startswith("_")}
+
+            return new_day(day, add_to_day(existing, day_docs))
+
+        update_with_etag(container, cube_id(day), CUBE_PK, update)
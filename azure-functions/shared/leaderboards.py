@@ -0,0 +1,151 @@
+"""
+Daily top-K leaderboards maintained from the change feed.
+
+✔ Most expensive, slowest and most token-heavy traces per day
+✔ Lowest-scored traces per evaluator per day
+✔ Bounded: each board keeps K entries, merged with heapq and keyed by
+  trace_id, so redeliveries and re-writes replace instead of duplicate
+✔ Evaluations are placed on their trace's day (doc_time), so a re-written
+  evaluation replaces its old score; one re-written without a score
+  (pending, failed) is dropped from its board
+✔ One small doc per day; windows merge day docs at read time
+"""
+
+import heapq
+import os
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from shared.aggregates import UNSCORED_STATUSES, update_with_etag
+from shared.rollups import doc_time
+
+
+# =====================================================
+# Configuration
+# =====================================================
+
+LEADERBOARD_PK = "leaderboard"
+
+LEADERBOARD_K = int(os.getenv("LEADERBOARD_K", "100"))
+
+# Entries are stored as [value, trace_id, label]
+TRACE_BOARDS = {
+    "cost": lambda t: (t.get("cost", {}) or {}).get("total_cost_usd"),
+    "latency": lambda t: (t.get("performance", {}) or {}).get("latency_ms"),
+    "tokens": lambda t: (t.get("usage", {}) or {}).get("total_tokens"),
+}
+
+SCORE_BOARD = "lowest_score"
+
+
+def leaderboard_id(day: str) -> str:
+    return f"{LEADERBOARD_PK}:{day}"
+
+
+def merge_entries(entries: list, new: list, k: int = LEADERBOARD_K, lowest: bool = False, drop=()) -> list:
+    """
+    Top-k of the union, one entry per trace_id (newer entries win), without
+    the trace_ids in `drop`.
+    """
+    by_trace = {e[1]: e for e in entries if e[1] not in drop}
+    by_trace.update({e[1]: e for e in new})
+
+    pick = heapq.nsmallest if lowest else heapq.nlargest
+
+    return pick(k, by_trace.values(), key=lambda e: e[0])
+
+
+def new_leaderboard(day: str, boards: dict, scores: dict) -> dict:
+    return {
+        "id": leaderboard_id(day),
+        "partitionKey": LEADERBOARD_PK,
+        "day": day,
+        "k": LEADERBOARD_K,
+        "boards": boards,
+        SCORE_BOARD: scores,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+# =====================================================
+# Ingest (change feed)
+# =====================================================
+
+def _trace_entries(docs: list) -> dict:
+
+    entries = defaultdict(list)
+
+    for t in docs:
+        trace_id = t.get("trace_id") or t.get("id")
+        for board, value_of in TRACE_BOARDS.items():
+            value = value_of(t)
+            if value is not None:
+                entries[board].append([value, trace_id, t.get("trace_name")])
+
+    return entries
+
+
+def _unscored(e: dict) -> bool:
+    return e.get("status") in UNSCORED_STATUSES or e.get("score") is None
+
+
+def _score_entries(docs: list) -> dict:
+
+    entries = defaultdict(list)
+
+    for e in docs:
+        if _unscored(e) or not e.get("trace_id"):
+            continue
+        evaluator = e.get("evaluator_id") or e.get("evaluator")
+        if evaluator:
+            entries[evaluator].append([e["score"], e["trace_id"], e.get("status")])
+
+    return entries
+
+
+def _score_drops(docs: list) -> dict:
+    """
+    evaluator -> trace_ids whose evaluation no longer has a score.
+    """
+
+    drops = defaultdict(set)
+
+    for e in docs:
+        evaluator = e.get("evaluator_id") or e.get("evaluator")
+        if _unscored(e) and e.get("trace_id") and evaluator:
+            drops[evaluator].add(e["trace_id"])
+
+    return drops
+
+
+def apply_leaderboards(container, feed: str, docs: list):
+
+    by_day = defaultdict(list)
+
+    for doc in docs:
+        by_day[doc_time(feed, doc).strftime("%Y-%m-%d")].append(doc)
+
+    for day, day_docs in by_day.items():
+
+        new = _trace_entries(day_docs) if feed == "traces" else _score_entries(day_docs)
+        drops = {} if feed == "traces" else _score_drops(day_docs)
+
+        def update(existing, day=day, new=new, drops=drops):
+            existing = existing or {}
+            boards = existing.get("boards") or {}
+            scores = existing.get(SCORE_BOARD) or {}
+
+            if feed == "traces":
+                boards = {**boards, **{b: merge_entries(boards.get(b, []), e) for b, e in new.items()}}
+            else:
+                scores = {
+                    **scores,
+                    **{
+                        ev: merge_entries(scores.get(ev, []), new.get(ev, []), lowest=True, drop=drops.get(ev, ()))
+                        for ev in set(new) | set(drops)
+                    },
+                }
+
+            return new_leaderboard(day, boards, scores)
+
+        update_with_etag(container, leaderboard_id(day), LEADERBOARD_PK, update)
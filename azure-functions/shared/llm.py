@@ -1,10 +1,17 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
+from functools import lru_cache
+import asyncio
 import logging
+import threading
 import time
 import os
+import httpx
 import google.generativeai as genai
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI
 from shared.secrets import get_secret
+from shared.routing import ROUTER, HEDGE_AFTER_MS
+from shared.singleflight import AsyncSingleFlight, request_key
+from shared.mock_llm import MOCK_PROVIDER, MOCK_MODE, RECORDER, get_mock_provider
 
 
 # ----------------------------------------------------
@@ -13,8 +20,13 @@ from shared.secrets import get_secret
 
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "azure").lower()
 
+if LLM_PROVIDER == MOCK_PROVIDER:
+    # Offline benchmarks: no keys, no network (see shared.mock_llm)
+    client = None
+    print(f"DEBUG: Initialized Mock Provider ({MOCK_MODE})")
+
 # Check if we should use Gemini (either explicitly or if Azure secrets are missing)
-if LLM_PROVIDER == "gemini" or not os.getenv("AZURE_OPENAI_KEY"):
+elif LLM_PROVIDER == "gemini" or not os.getenv("AZURE_OPENAI_KEY"):
     GEMINI_API_KEY = get_secret("GOOGLE_API_KEY")
     if GEMINI_API_KEY and not GEMINI_API_KEY.startswith("dummy-"):
         genai.configure(api_key=GEMINI_API_KEY, transport='rest')
@@ -25,6 +37,10 @@ if LLM_PROVIDER == "gemini" or not os.getenv("AZURE_OPENAI_KEY"):
         print("WARNING: Gemini key not found, attempting Azure OpenAI")
         LLM_PROVIDER = "azure"
 
+AZURE_OPENAI_API_VERSION = "2024-10-21"
+AZURE_OPENAI_ENDPOINT = None
+AZURE_OPENAI_KEY = None
+
 if LLM_PROVIDER == "azure":
     try:
         AZURE_OPENAI_ENDPOINT = get_secret("AZURE-OPENAI-ENDPOINT")
@@ -33,7 +49,7 @@ if LLM_PROVIDER == "azure":
         client = AzureOpenAI(
             api_key=AZURE_OPENAI_KEY,
             azure_endpoint=AZURE_OPENAI_ENDPOINT,
-            api_version="2024-10-21"
+            api_version=AZURE_OPENAI_API_VERSION
         )
         print("DEBUG: Initialized Azure OpenAI Provider")
     except Exception as e:
@@ -43,175 +59,557 @@ if LLM_PROVIDER == "azure":
 # ----------------------------------------------------
 # Dedicated Evaluator Configuration
 # ----------------------------------------------------
+EVALUATOR_API_KEY = None
+EVALUATOR_ENDPOINT = os.getenv("EVALUATOR_ENDPOINT", "https://openai-devops-gpt-4o-mini.openai.azure.com/")
+EVALUATOR_API_VERSION = "2025-01-01-preview"
+
 try:
+    if LLM_PROVIDER == MOCK_PROVIDER:
+        raise RuntimeError("mock provider")
+    EVALUATOR_API_KEY = get_secret("EVALUATOR-API-KEY")
     evaluator_client = AzureOpenAI(
-        api_key="3nELgOuRfta8Cw3KuBIBQJaEZjMhkiQKkzNbOw2KnmAKbtBTFqIPJQQJ99CDACHYHv6XJ3w3AAABACOGdpFw",
-        azure_endpoint="https://openai-devops-gpt-4o-mini.openai.azure.com/",
-        api_version="2025-01-01-preview"
+        api_key=EVALUATOR_API_KEY,
+        azure_endpoint=EVALUATOR_ENDPOINT,
+        api_version=EVALUATOR_API_VERSION
     )
     print("DEBUG: Initialized Dedicated Evaluator Endpoint")
 except Exception as e:
+    if LLM_PROVIDER != MOCK_PROVIDER:
+        print(f"WARNING: Dedicated evaluator endpoint unavailable: {e}")
     evaluator_client = None
 
+# ----------------------------------------------------
+# Connection Pooling + Shared Event Loop
+# ----------------------------------------------------
+# All LLM traffic runs on one background event loop so every caller
+# (sync Functions code, worker threads, FastAPI handlers) shares the same
+# keep-alive HTTP pools. call_llm() is a blocking wrapper around it;
+# never call it from code already running on that loop.
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "30"))
+
+_loop = None
+_loop_lock = threading.Lock()
+_async_clients = {}
+
+
+def _llm_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-loop", daemon=True).start()
+
+    return _loop
+
+
+def run_sync(coro):
+    """
+    Run a coroutine on the shared LLM loop and block for its result.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _llm_loop()).result()
+
+
+def _async_client(name: str) -> Optional[AsyncAzureOpenAI]:
+    """
+    Pooled async client per endpoint. Only touched from the LLM loop.
+    """
+    if name in _async_clients:
+        return _async_clients[name]
+
+    if name == "evaluator":
+        api_key, endpoint, api_version = EVALUATOR_API_KEY, EVALUATOR_ENDPOINT, EVALUATOR_API_VERSION
+    else:
+        api_key, endpoint, api_version = AZURE_OPENAI_KEY, AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_API_VERSION
+
+    if not api_key or not endpoint:
+        return None
+
+    _async_clients[name] = AsyncAzureOpenAI(
+        api_key=api_key,
+        azure_endpoint=endpoint,
+        api_version=api_version,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_SECONDS,
+            )
+        )
+    )
+    return _async_clients[name]
+
+
+# ----------------------------------------------------
+# Gemini Model Handles
+# ----------------------------------------------------
+
+# Specific Alias Mapping for UI-friendly names
+GEMINI_MODEL_MAP = {
+    "Gemma 3 1B": "models/gemma-3-1b-it",
+    "Gemma 3 4B": "models/gemma-3-4b-it",
+    "Gemma 3 12B": "models/gemma-3-12b-it",
+    "Gemma 3 27B": "models/gemma-3-27b-it"
+}
+
+
+def resolve_gemini_model(model: str) -> str:
+    # Determine the specific Gemini model name
+    # We prioritize the incoming model name, only mapping known OpenAI Aliases or Gemma Aliases
+    if model in GEMINI_MODEL_MAP:
+        return GEMINI_MODEL_MAP[model]
+    if model.startswith("models/"):
+        return model
+    if "gpt-4o-mini" in model.lower():
+        return "models/gemini-2.5-flash"
+    if "gpt-4o" in model.lower():
+        return "models/gemini-2.5-pro"
+
+    # Fallback for other potential names
+    gemini_model_name = f"models/{model.replace(' ', '-').lower()}"
+    # Ensure it has the -it suffix for Gemma-like names if not already present
+    if "gemma-3" in gemini_model_name and not gemini_model_name.endswith("-it"):
+        gemini_model_name += "-it"
+    return gemini_model_name
+
+
+@lru_cache(maxsize=32)
+def _gemini_model(name: str):
+    return genai.GenerativeModel(name)
+
+
+SYSTEM_PROMPT = "You are a deterministic scoring engine. Always return strict JSON."
+
+# Gemini only returns logprobs for some models, so it is opt-in
+GEMINI_LOGPROBS = os.getenv("GEMINI_LOGPROBS", "false").lower() == "true"
+
+
+def _openai_top_logprobs(choice) -> Optional[List[Dict[str, Any]]]:
+    """
+    Top alternatives for the first generated token of an OpenAI choice.
+    """
+    content = getattr(getattr(choice, "logprobs", None), "content", None)
+    if not content:
+        return None
+    return [{"token": t.token, "logprob": t.logprob} for t in content[0].top_logprobs]
+
+
+def _openai_cached_tokens(usage) -> int:
+    """
+    Prompt tokens served from the provider's prefix cache.
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    return int(getattr(details, "cached_tokens", 0) or 0)
+
+
+def _gemini_top_logprobs(candidate) -> Optional[List[Dict[str, Any]]]:
+    result = getattr(candidate, "logprobs_result", None)
+    if not result or not result.top_candidates:
+        return None
+    return [
+        {"token": c.token, "logprob": c.log_probability}
+        for c in result.top_candidates[0].candidates
+    ]
+
+
 # ----------------------------------------------------
 # Generic LLM Call (Deployment-Aware + Retry Safe)
 # ----------------------------------------------------
 
-def call_llm(
+async def _openai_chat(
+    client_name: str,
     model: str,
     prompt: str,
-    max_tokens: int = 200,
-    temperature: float = 0.0,
-    timeout: int = 30,
-    max_retries: int = 2
+    max_tokens: int,
+    temperature: float,
+    timeout: int,
+    logprobs: bool,
+    top_logprobs: int,
+    system_prompt: str
+) -> Dict[str, Any]:
+
+    async_client = _async_client(client_name)
+
+    if async_client is None:
+        raise RuntimeError(f"Azure OpenAI client '{client_name}' is not configured")
+
+    # Extra completion kwargs for label scoring on OpenAI-compatible endpoints
+    logprob_kwargs = {"logprobs": True, "top_logprobs": top_logprobs} if logprobs else {}
+
+    response = await async_client.chat.completions.create(
+        model=model,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        timeout=timeout,
+        **logprob_kwargs
+    )
+
+    return {
+        "content": response.choices[0].message.content,
+        "top": _openai_top_logprobs(response.choices[0]) if logprobs else None,
+        "prompt_tokens": response.usage.prompt_tokens,
+        "completion_tokens": response.usage.completion_tokens,
+        "cached_tokens": _openai_cached_tokens(response.usage),
+    }
+
+
+async def _gemini_generate(
+    model: str,
+    prompt: str,
+    max_tokens: int,
+    temperature: float,
+    logprobs: bool,
+    top_logprobs: int
+) -> Dict[str, Any]:
+
+    gemini_model_name = resolve_gemini_model(model)
+
+    generation_config = {
+        "temperature": temperature,
+        "max_output_tokens": max_tokens,
+    }
+
+    if logprobs and GEMINI_LOGPROBS:
+        generation_config["response_logprobs"] = True
+        generation_config["logprobs"] = top_logprobs
+
+    logging.info(f"[llm:gemini] Calling {gemini_model_name} (REST transport)")
+
+    # The REST transport has no async client; run it off the loop
+    response = await asyncio.to_thread(
+        _gemini_model(gemini_model_name).generate_content,
+        prompt,
+        generation_config=generation_config
+    )
+
+    content = ""
+    top = None
+    if response.candidates:
+        candidate = response.candidates[0]
+        if candidate.content and candidate.content.parts:
+            content = candidate.text
+            if logprobs and GEMINI_LOGPROBS:
+                top = _gemini_top_logprobs(candidate)
+        else:
+            logging.warning(f"[llm:gemini] No text in candidate 0. Finish reason: {candidate.finish_reason}")
+            content = f"Failure: {candidate.finish_reason}"
+    else:
+        logging.error(f"[llm:gemini] No candidates in response. Likely blocked by safety filters.")
+        content = "Error: Blocked by safety filters"
+
+    return {
+        "content": content,
+        "top": top,
+        "prompt_tokens": response.usage_metadata.prompt_token_count,
+        "completion_tokens": response.usage_metadata.candidates_token_count,
+        "cached_tokens": int(getattr(response.usage_metadata, "cached_content_token_count", 0) or 0),
+    }
+
+
+# ----------------------------------------------------
+# Endpoint Routing (Circuit Breakers + Hedging)
+# ----------------------------------------------------
+# Endpoints are "evaluator" (dedicated gpt-4o-mini), "azure:<deployment>"
+# or "gemini:<model>". LLM_DEPLOYMENT_GROUPS lists which of them are
+# interchangeable for a model; see shared.routing.
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+def _default_endpoints(model: str) -> List[str]:
+    """
+    Endpoints that can serve `model` when LLM_DEPLOYMENT_GROUPS has no entry.
+    """
+    endpoints = []
+
+    if evaluator_client and "gpt-4o-mini" in model.lower():
+        endpoints.append("evaluator")
+
+    endpoints.append(f"{LLM_PROVIDER}:{model}")
+
+    return endpoints
+
+
+async def _call_endpoint(
+    endpoint: str,
+    prompt: str,
+    max_tokens: int,
+    temperature: float,
+    timeout: int,
+    logprobs: bool,
+    top_logprobs: int,
+    system_prompt: str
+) -> Dict[str, Any]:
+
+    kind, _, deployment = endpoint.partition(":")
+
+    if kind == "evaluator":
+        return await _openai_chat(
+            "evaluator", "gpt-4o-mini", prompt, max_tokens, temperature,
+            timeout, logprobs, top_logprobs, system_prompt
+        )
+
+    if kind == MOCK_PROVIDER:
+        return await get_mock_provider().chat(
+            deployment, prompt, max_tokens, temperature, logprobs, top_logprobs, system_prompt
+        )
+
+    if kind == "gemini":
+        return await _gemini_generate(
+            deployment, prompt, max_tokens, temperature, logprobs, top_logprobs
+        )
+
+    return await _openai_chat(
+        "default", deployment, prompt, max_tokens, temperature,
+        timeout, logprobs, top_logprobs, system_prompt
+    )
+
+
+async def _routed_call(model: str, endpoint: str, *args) -> Dict[str, Any]:
+    """
+    One call through an endpoint's breaker, feeding latency and outcome
+    back to the router.
+    """
+    if not ROUTER.acquire(endpoint):
+        raise CircuitOpenError(f"Circuit open for {endpoint}")
+
+    start_time = time.time()
+
+    try:
+        result = await _call_endpoint(endpoint, *args)
+        if not result["content"]:
+            raise RuntimeError("Empty response")
+
+    except asyncio.CancelledError:
+        ROUTER.release(endpoint)
+        raise
+
+    except Exception:
+        ROUTER.record(model, endpoint, (time.time() - start_time) * 1000, ok=False)
+        raise
+
+    result["latency_ms"] = int((time.time() - start_time) * 1000)
+    result["endpoint"] = endpoint
+    ROUTER.record(model, endpoint, result["latency_ms"], ok=True)
+
+    if RECORDER and not endpoint.startswith(MOCK_PROVIDER):
+        prompt, max_tokens, _, _, logprobs, top_logprobs, system_prompt = args
+        try:
+            RECORDER.record(endpoint, model, prompt, max_tokens, logprobs, top_logprobs, system_prompt, result)
+        except Exception as e:
+            logging.warning(f"[llm:{model}] Failed to record response: {e}")
+
+    return result
+
+
+async def _hedged_call(model: str, candidates: List[str], tried: set, *args) -> Dict[str, Any]:
+    """
+    Call the best candidate; with LLM_HEDGE_AFTER_MS set, also start the
+    next-best one once the first is slower than that and keep whichever
+    succeeds first. Every endpoint called is added to `tried`.
+    """
+    tried.add(candidates[0])
+    primary = asyncio.ensure_future(_routed_call(model, candidates[0], *args))
+
+    if HEDGE_AFTER_MS <= 0 or len(candidates) < 2:
+        return await primary
+
+    done, _ = await asyncio.wait({primary}, timeout=HEDGE_AFTER_MS / 1000)
+    if done:
+        return primary.result()
+
+    ROUTER.record_hedge()
+    logging.info(f"[llm:{model}] {candidates[0]} slower than {HEDGE_AFTER_MS}ms, hedging on {candidates[1]}")
+
+    tried.add(candidates[1])
+    pending = {primary, asyncio.ensure_future(_routed_call(model, candidates[1], *args))}
+    error = None
+
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                for other in pending:
+                    other.cancel()
+                return task.result()
+            error = task.exception()
+
+    raise error
+
+
+async def _acall_llm(
+    model: str,
+    prompt: str,
+    max_tokens: int,
+    temperature: float,
+    timeout: int,
+    max_retries: int,
+    logprobs: bool,
+    top_logprobs: int,
+    system_prompt: str
 ) -> Optional[Dict[str, Any]]:
 
+    call_args = (prompt, max_tokens, temperature, timeout, logprobs, top_logprobs, system_prompt)
     attempt = 0
 
     while attempt <= max_retries:
-        try:
-            start_time = time.time()
-
-            # Attempt dedicated evaluator endpoint first
-            if attempt == 0 and evaluator_client and "gpt-4o-mini" in model.lower():
-                try:
-                    logging.info("[llm:evaluator] Attempting dedicated evaluator endpoint...")
-                    resp = evaluator_client.chat.completions.create(
-                        model="gpt-4o-mini",
-                        temperature=temperature,
-                        max_tokens=max_tokens,
-                        messages=[
-                            {"role": "system", "content": "You are a deterministic scoring engine. Always return strict JSON."},
-                            {"role": "user", "content": prompt}
-                        ],
-                        timeout=timeout
-                    )
-                    content = resp.choices[0].message.content
-                    if content:
-                        prompt_toks = resp.usage.prompt_tokens
-                        comp_toks = resp.usage.completion_tokens
-                        lat_ms = int((time.time() - start_time) * 1000)
-                        logging.info(f"[llm:{model}] Success (evaluator) | Latency={lat_ms}ms")
-                        return {
-                            "text": content.strip(),
-                            "usage": {"prompt_tokens": prompt_toks, "completion_tokens": comp_toks},
-                            "latency_ms": lat_ms
-                        }
-                except Exception as eval_err:
-                    logging.warning(f"[llm:evaluator] Failed: {eval_err}. Falling back to default setup...")
-                    start_time = time.time() # Reset timer for the fallback
-
-            if LLM_PROVIDER == "gemini":
-                # Specific Alias Mapping for UI-friendly names
-                MODEL_MAP = {
-                    "Gemma 3 1B": "models/gemma-3-1b-it",
-                    "Gemma 3 4B": "models/gemma-3-4b-it",
-                    "Gemma 3 12B": "models/gemma-3-12b-it",
-                    "Gemma 3 27B": "models/gemma-3-27b-it"
-                }
 
-                # Determine the specific Gemini model name
-                # We prioritize the incoming model name, only mapping known OpenAI Aliases or Gemma Aliases
-                if model in MODEL_MAP:
-                    gemini_model_name = MODEL_MAP[model]
-                elif model.startswith("models/"):
-                    gemini_model_name = model
-                elif "gpt-4o-mini" in model.lower():
-                    gemini_model_name = "models/gemini-2.5-flash"
-                elif "gpt-4o" in model.lower():
-                    gemini_model_name = "models/gemini-2.5-pro"
-                else:
-                    # Fallback for other potential names
-                    model_cleaned = model.replace(' ', '-').lower()
-                    gemini_model_name = f"models/{model_cleaned}"
-                    # Ensure it has the -it suffix for Gemma-like names if not already present
-                    if "gemma-3" in gemini_model_name and not gemini_model_name.endswith("-it"):
-                         gemini_model_name += "-it"
-                
-                try:
-                    logging.info(f"[llm:gemini] Calling {gemini_model_name} (REST transport)")
-                    genai_model = genai.GenerativeModel(gemini_model_name)
-                    response = genai_model.generate_content(
-                        prompt,
-                        generation_config=genai.types.GenerationConfig(
-                            temperature=temperature,
-                            max_output_tokens=max_tokens,
-                        )
-                    )
-                except Exception as e:
-                    # Reraise to be caught by the retry loop (handling 429s etc)
-                    raise e
-                
-                content = ""
-                if response.candidates:
-                    candidate = response.candidates[0]
-                    if candidate.content and candidate.content.parts:
-                        content = candidate.text
-                    else:
-                        logging.warning(f"[llm:gemini] No text in candidate 0. Finish reason: {candidate.finish_reason}")
-                        content = f"Failure: {candidate.finish_reason}"
-                else:
-                    logging.error(f"[llm:gemini] No candidates in response. Likely blocked by safety filters.")
-                    content = "Error: Blocked by safety filters"
-                
-                prompt_tokens = response.usage_metadata.prompt_token_count
-                completion_tokens = response.usage_metadata.candidates_token_count
-                
-            else:
-                response = client.chat.completions.create(
-                    model=model,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "You are a deterministic scoring engine. Always return strict JSON."
-                        },
-                        {"role": "user", "content": prompt}
-                    ],
-                    timeout=timeout
+        # Best endpoints first; open circuits are left out entirely
+        candidates = ROUTER.route(model, _default_endpoints(model))
+
+        if not candidates:
+            logging.error(f"[llm:{model}] All endpoints circuit-open, failing fast")
+            return None
+
+        last_error = None
+        # A hedge can call two candidates; each endpoint is tried once per attempt
+        tried = set()
+
+        for endpoint in candidates:
+            if endpoint in tried:
+                continue
+
+            try:
+                result = await _hedged_call(model, [c for c in candidates if c not in tried], tried, *call_args)
+
+                logging.info(
+                    f"[llm:{model}] Success ({result['endpoint']}) | "
+                    f"Latency={result['latency_ms']}ms | "
+                    f"PromptTokens={result['prompt_tokens']} | "
+                    f"CachedTokens={result['cached_tokens']} | "
+                    f"CompletionTokens={result['completion_tokens']}"
                 )
-                content = response.choices[0].message.content
-                prompt_tokens = response.usage.prompt_tokens
-                completion_tokens = response.usage.completion_tokens
 
-            latency_ms = int((time.time() - start_time) * 1000)
+                return {
+                    "text": result["content"].strip(),
+                    "usage": {
+                        "prompt_tokens": result["prompt_tokens"],
+                        "completion_tokens": result["completion_tokens"],
+                        "cached_tokens": result["cached_tokens"]
+                    },
+                    "latency_ms": result["latency_ms"],
+                    "top_logprobs": result["top"]
+                }
 
-            if not content:
-                logging.error(f"[llm:{model}] Empty response")
-                return None
+            except CircuitOpenError:
+                continue
 
-            logging.info(
-                f"[llm:{model}] Success ({LLM_PROVIDER}) | "
-                f"Latency={latency_ms}ms | "
-                f"PromptTokens={prompt_tokens} | "
-                f"CompletionTokens={completion_tokens}"
-            )
+            except Exception as e:
+                last_error = e
+                logging.warning(f"[llm:{model}] {endpoint} failed: {e}")
 
-            return {
-                "text": content.strip(),
-                "usage": {
-                    "prompt_tokens": prompt_tokens,
-                    "completion_tokens": completion_tokens
-                },
-                "latency_ms": latency_ms
-            }
+        attempt += 1
 
-        except Exception as e:
-            err_str = str(e).lower()
-            is_quota = "429" in err_str or "quota" in err_str or "limit" in err_str
-            
-            logging.warning(
-                f"[llm:{model}] Attempt {attempt + 1} failed: {e}"
-            )
+        if attempt > max_retries:
+            logging.error(f"[llm:{model}] All retries failed. Last error: {last_error}")
+            return None
 
-            attempt += 1
+        # Nothing left to wait for if every circuit has opened meanwhile
+        if not ROUTER.route(model, _default_endpoints(model)):
+            logging.error(f"[llm:{model}] All endpoints circuit-open, failing fast")
+            return None
+
+        err_str = str(last_error).lower()
+        is_quota = "429" in err_str or "quota" in err_str or "limit" in err_str
+
+        # If we hit a rate limit, we need a MUCH longer sleep (Free tier is strict)
+        sleep_time = 60 if is_quota else (2 ** attempt)
+        logging.info(f"[llm:{model}] {'Quota reached. ' if is_quota else ''}Retrying in {sleep_time}s...")
+        await asyncio.sleep(sleep_time)
+
+    return None
+
+
+# ----------------------------------------------------
+# Single-Flight Coalescing
+# ----------------------------------------------------
+# Identical deterministic requests already in flight on the LLM loop are
+# shared instead of sent again. Only the leader reports token usage, so
+# cost is counted once.
+
+LLM_SINGLE_FLIGHT = AsyncSingleFlight("llm")
+
+NO_USAGE = {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+
+
+async def _acall_llm_coalesced(
+    model: str,
+    prompt: str,
+    max_tokens: int,
+    temperature: float,
+    timeout: int,
+    max_retries: int,
+    logprobs: bool,
+    top_logprobs: int,
+    system_prompt: str
+) -> Optional[Dict[str, Any]]:
+
+    args = (model, prompt, max_tokens, temperature, timeout, max_retries, logprobs, top_logprobs, system_prompt)
+
+    # Sampled completions are meant to differ
+    if temperature != 0:
+        return await _acall_llm(*args)
+
+    key = request_key(model, prompt, max_tokens, logprobs, top_logprobs, system_prompt)
+
+    result, coalesced = await LLM_SINGLE_FLIGHT.do(key, lambda: _acall_llm(*args))
+
+    if coalesced and result:
+        result = {**result, "usage": dict(NO_USAGE), "coalesced": True}
+
+    return result
+
+
+def routing_metrics() -> Dict[str, Any]:
+    """
+    Breaker state, per-endpoint latency/error stats and routing decisions
+    for this worker process.
+    """
+    return {**ROUTER.snapshot(), "llm_single_flight": LLM_SINGLE_FLIGHT.stats()}
+
+
+async def acall_llm(
+    model: str,
+    prompt: str,
+    max_tokens: int = 200,
+    temperature: float = 0.0,
+    timeout: int = 30,
+    max_retries: int = 2,
+    logprobs: bool = False,
+    top_logprobs: int = 5,
+    system_prompt: str = SYSTEM_PROMPT
+) -> Optional[Dict[str, Any]]:
+    """
+    Async call_llm. Safe to await from any event loop (e.g. FastAPI):
+    the request itself runs on the shared LLM loop and its pooled clients.
+    """
+    coro = _acall_llm_coalesced(
+        model, prompt, max_tokens, temperature, timeout,
+        max_retries, logprobs, top_logprobs, system_prompt
+    )
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, _llm_loop()))
+
+
+def call_llm(
+    model: str,
+    prompt: str,
+    max_tokens: int = 200,
+    temperature: float = 0.0,
+    timeout: int = 30,
+    max_retries: int = 2,
+    logprobs: bool = False,
+    top_logprobs: int = 5,
+    system_prompt: str = SYSTEM_PROMPT
+) -> Optional[Dict[str, Any]]:
 
-            if attempt <= max_retries:
-                # If we hit a rate limit, we need a MUCH longer sleep (Free tier is strict)
-                sleep_time = 60 if is_quota else (2 ** attempt)
-                logging.info(f"[llm:{model}] {'Quota reached. ' if is_quota else ''}Retrying in {sleep_time}s...")
-                time.sleep(sleep_time)
-            else:
-                logging.exception(f"[llm:{model}] All retries failed.")
-                return None
\ No newline at end of file
+    return run_sync(_acall_llm_coalesced(
+        model, prompt, max_tokens, temperature, timeout,
+        max_retries, logprobs, top_logprobs, system_prompt
+    ))
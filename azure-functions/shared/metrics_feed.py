@@ -0,0 +1,74 @@
+"""
+Change-feed metrics pipeline shared by TraceAggregator and
+EvaluationAggregator: time-bucket rollups, the trace cube and the daily
+leaderboards, then the running feed state, then the all-time snapshot.
+
+While the Aggregator rebuilds (shared/rebuild.py) a batch raises
+RebuildInProgress and is redelivered by the trigger's (finite) retry
+policy. Any other failure is retried doc by doc; docs that still fail
+are logged and skipped, so one bad doc cannot stall the lease.
+"""
+
+import logging
+from typing import Optional
+
+from shared.aggregates import MetricsAggregate, apply_feed_batch, write_snapshot
+from shared.cube import apply_cube
+from shared.leaderboards import apply_leaderboards
+from shared.rebuild import RebuildInProgress, check_not_rebuilding
+from shared.rollups import apply_rollups
+
+
+def _apply(container, feed: str, docs: list) -> MetricsAggregate:
+
+    # Rollups dedupe per bucket, so they go first and survive a retry
+    apply_rollups(container, feed, docs)
+
+    if feed == "traces":
+        apply_cube(container, docs)
+
+    apply_leaderboards(container, feed, docs)
+
+    return apply_feed_batch(container, feed, docs)
+
+
+def _apply_each(container, feed: str, docs: list) -> Optional[MetricsAggregate]:
+    """
+    Apply docs one at a time after a batch failed. Every step dedupes on
+    the doc id, so docs the batch already applied are not counted twice.
+    """
+
+    agg = None
+    skipped = 0
+
+    for doc in docs:
+        try:
+            agg = _apply(container, feed, [doc])
+        except RebuildInProgress:
+            raise
+        except Exception:
+            skipped += 1
+            logging.exception(f"[metrics_feed:{feed}] Skipping doc {doc.get('id')}")
+
+    if skipped:
+        logging.error(f"[metrics_feed:{feed}] Skipped {skipped} of {len(docs)} docs")
+
+    return agg
+
+
+def apply_change_feed(container, feed: str, docs: list):
+
+    check_not_rebuilding(container)
+
+    try:
+        agg = _apply(container, feed, docs)
+    except RebuildInProgress:
+        raise
+    except Exception:
+        logging.exception(f"[metrics_feed:{feed}] Batch failed, applying {len(docs)} docs one by one")
+        agg = _apply_each(container, feed, docs)
+
+    if agg is not None:
+        write_snapshot(container, {feed: agg})
+
+    logging.info(f"[metrics_feed:{feed}] Applied {len(docs)} docs")
@@ -0,0 +1,235 @@
+"""
+Record / replay / synthetic LLM provider for offline benchmarks.
+
+✔ LLM_RECORD_PATH: real responses, usage and latency appended as JSONL
+✔ LLM_PROVIDER=mock + LLM_MOCK_MODE=replay: serve recorded responses
+✔ LLM_PROVIDER=mock + LLM_MOCK_MODE=synthetic: generated scores with
+  configurable latency, error rate and 429 injection
+✔ Deterministic hash embeddings (no embedding API)
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from shared.singleflight import request_key
+
+
+# =====================================================
+# Configuration
+# =====================================================
+
+MOCK_PROVIDER = "mock"
+MOCK_MODE = os.getenv("LLM_MOCK_MODE", "synthetic").lower()  # synthetic | replay
+
+LLM_RECORD_PATH = os.getenv("LLM_RECORD_PATH", "")
+LLM_REPLAY_PATH = os.getenv("LLM_REPLAY_PATH", LLM_RECORD_PATH)
+
+# Unrecorded requests in replay mode: "synthetic" or "error"
+REPLAY_MISS = os.getenv("LLM_MOCK_REPLAY_MISS", "synthetic").lower()
+
+MOCK_SEED = int(os.getenv("LLM_MOCK_SEED", "0"))
+
+# Lognormal latency: median in ms and sigma of the underlying normal
+MOCK_LATENCY_MS = float(os.getenv("LLM_MOCK_LATENCY_MS", "400"))
+MOCK_LATENCY_SIGMA = float(os.getenv("LLM_MOCK_LATENCY_SIGMA", "0.5"))
+# Multiplier for recorded latencies in replay mode (0 = no sleep)
+MOCK_LATENCY_SCALE = float(os.getenv("LLM_MOCK_LATENCY_SCALE", "1.0"))
+
+MOCK_ERROR_RATE = float(os.getenv("LLM_MOCK_ERROR_RATE", "0"))
+MOCK_RATE_LIMIT_RATE = float(os.getenv("LLM_MOCK_RATE_LIMIT_RATE", "0"))
+
+MOCK_SCORE_MIN = float(os.getenv("LLM_MOCK_SCORE_MIN", "0"))
+MOCK_SCORE_MAX = float(os.getenv("LLM_MOCK_SCORE_MAX", "1"))
+
+MOCK_EMBEDDING_DIM = int(os.getenv("LLM_MOCK_EMBEDDING_DIM", "256"))
+
+CHARS_PER_TOKEN = 4
+
+
+def _request_key(model, prompt, max_tokens, logprobs, top_logprobs, system_prompt) -> str:
+    return request_key(model, prompt, max_tokens, logprobs, top_logprobs, system_prompt)
+
+
+# =====================================================
+# Recorder
+# =====================================================
+
+class Recorder:
+    """
+    Appends every successful real response to a JSONL file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, model: str, prompt: str, max_tokens: int,
+               logprobs: bool, top_logprobs: int, system_prompt: str, result: Dict[str, Any]):
+
+        line = json.dumps({
+            "key": _request_key(model, prompt, max_tokens, logprobs, top_logprobs, system_prompt),
+            "endpoint": endpoint,
+            "model": model,
+            "content": result["content"],
+            "top": result.get("top"),
+            "prompt_tokens": result["prompt_tokens"],
+            "completion_tokens": result["completion_tokens"],
+            "cached_tokens": result.get("cached_tokens", 0),
+            "latency_ms": result.get("latency_ms"),
+        })
+
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+RECORDER = Recorder(LLM_RECORD_PATH) if LLM_RECORD_PATH else None
+
+
+# =====================================================
+# Mock Provider
+# =====================================================
+
+class MockProvider:
+
+    def __init__(self, mode: str = MOCK_MODE, replay_path: str = LLM_REPLAY_PATH):
+        self.mode = mode
+        self.recordings: Dict[str, List[dict]] = defaultdict(list)
+        self.attempts: Dict[str, int] = defaultdict(int)
+        self.stats = defaultdict(int)
+
+        if mode == "replay":
+            self._load(replay_path)
+
+    def _load(self, path: str):
+        if not path or not os.path.exists(path):
+            logging.warning(f"[llm:mock] No recordings at '{path}', every request is a replay miss")
+            return
+
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    self.recordings[record["key"]].append(record)
+
+        logging.info(f"[llm:mock] Loaded {sum(len(r) for r in self.recordings.values())} recordings from {path}")
+
+    def _rng(self, key: str) -> random.Random:
+        # Per-request stream: reproducible regardless of scheduling order,
+        # but each retry of the same request draws fresh outcomes
+        attempt = self.attempts[key]
+        self.attempts[key] += 1
+        digest = hashlib.sha256(f"{MOCK_SEED}:{key}:{attempt}".encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    async def chat(
+        self,
+        model: str,
+        prompt: str,
+        max_tokens: int,
+        temperature: float,
+        logprobs: bool,
+        top_logprobs: int,
+        system_prompt: str
+    ) -> Dict[str, Any]:
+
+        key = _request_key(model, prompt, max_tokens, logprobs, top_logprobs, system_prompt)
+        self.stats["requests"] += 1
+
+        if self.mode == "replay":
+            recorded = self.recordings.get(key)
+
+            if recorded:
+                self.stats["replayed"] += 1
+                record = recorded[self.attempts[key] % len(recorded)]
+                self.attempts[key] += 1
+
+                await asyncio.sleep((record.get("latency_ms") or 0) * MOCK_LATENCY_SCALE / 1000)
+
+                return {
+                    "content": record["content"],
+                    "top": record.get("top"),
+                    "prompt_tokens": record["prompt_tokens"],
+                    "completion_tokens": record["completion_tokens"],
+                    "cached_tokens": record.get("cached_tokens", 0),
+                }
+
+            self.stats["replay_misses"] += 1
+
+            if REPLAY_MISS != "synthetic":
+                raise RuntimeError(f"No recorded response for request {key[:12]}")
+
+        return await self._synthetic(key, prompt)
+
+    async def _synthetic(self, key: str, prompt: str) -> Dict[str, Any]:
+
+        rng = self._rng(key)
+
+        latency_ms = MOCK_LATENCY_MS * math.exp(rng.gauss(0, MOCK_LATENCY_SIGMA))
+        await asyncio.sleep(latency_ms / 1000)
+
+        roll = rng.random()
+
+        if roll < MOCK_RATE_LIMIT_RATE:
+            self.stats["rate_limited"] += 1
+            raise RuntimeError("Error code: 429 - Rate limit exceeded (mock)")
+
+        if roll < MOCK_RATE_LIMIT_RATE + MOCK_ERROR_RATE:
+            self.stats["errors"] += 1
+            raise RuntimeError("Error code: 500 - Internal server error (mock)")
+
+        # Same prompt, same score: keeps ensemble variance and caching realistic
+        score_rng = random.Random(int(key[:16], 16) ^ MOCK_SEED)
+        score = round(score_rng.uniform(MOCK_SCORE_MIN, MOCK_SCORE_MAX), 2)
+        content = json.dumps({"score": score, "reason": "synthetic"})
+
+        return {
+            "content": content,
+            "top": None,
+            "prompt_tokens": max(1, len(prompt) // CHARS_PER_TOKEN),
+            "completion_tokens": max(1, len(content) // CHARS_PER_TOKEN),
+            "cached_tokens": 0,
+        }
+
+
+_provider: Optional[MockProvider] = None
+
+
+def get_mock_provider() -> MockProvider:
+    global _provider
+    if _provider is None:
+        _provider = MockProvider()
+    return _provider
+
+
+# =====================================================
+# Hash Embeddings
+# =====================================================
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def mock_embedding(text: str, dim: int = MOCK_EMBEDDING_DIM) -> List[float]:
+    """
+    Signed feature hashing of word tokens, L2-normalised. Deterministic,
+    and texts sharing words get a higher cosine similarity.
+    """
+    vector = [0.0] * dim
+
+    for token in TOKEN_PATTERN.findall((text or "").lower()):
+        digest = hashlib.md5(token.encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "big") % dim
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+
+    norm = math.sqrt(sum(v * v for v in vector))
+
+    return [v / norm for v in vector] if norm else vector
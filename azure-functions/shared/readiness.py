@@ -0,0 +1,214 @@
+"""
+Per-trace RCA readiness records (rca_results, id "{trace_id}:readiness").
+
+✔ EvaluatorRunner registers which evaluators will report for a trace
+  and which ones did not sample it
+✔ Each evaluator is patched into `completed` before its evaluation doc
+  is written (an object used as a set, so retries are idempotent)
+✔ Readiness is a single point read; RCA claims a ready record with a
+  conditional patch, so it fires exactly once
+✔ RCATimeout claims records whose evaluators never reported
+✔ A claim that cannot be analyzed (raw trace missing) counts an attempt;
+  after RCA_MAX_ATTEMPTS the record is finished with that result
+"""
+
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional
+
+from azure.cosmos import exceptions
+
+
+# =====================================================
+# Configuration
+# =====================================================
+
+READINESS_TYPE = "readiness"
+
+# rca_status
+WAITING = "waiting"
+CLAIMED = "claimed"
+DONE = "done"
+
+# Evaluators still missing this long after registration are given up on;
+# claims older than this are assumed lost and can be re-claimed
+READINESS_TIMEOUT_SECONDS = int(os.getenv("RCA_READINESS_TIMEOUT_SECONDS", "1800"))
+
+# Claims of one record that may fail before it is given up on
+RCA_MAX_ATTEMPTS = int(os.getenv("RCA_MAX_ATTEMPTS", "3"))
+
+# rca_result
+RCA_COMPLETED = "completed"
+RAW_TRACE_MISSING = "raw_trace_missing"
+
+# Cosmos accepts at most 10 operations per patch
+MAX_PATCH_OPERATIONS = 10
+
+
+def readiness_id(trace_id: str) -> str:
+    return f"{trace_id}:{READINESS_TYPE}"
+
+
+def _path(*parts: str) -> str:
+    # JSON Pointer escaping for evaluator names used as keys
+    return "/" + "/".join(p.replace("~", "~0").replace("/", "~1") for p in parts)
+
+
+def _patch(container, trace_id: str, operations: list, filter_predicate: Optional[str] = None):
+    for i in range(0, len(operations), MAX_PATCH_OPERATIONS):
+        container.patch_item(
+            readiness_id(trace_id),
+            partition_key=trace_id,
+            patch_operations=operations[i:i + MAX_PATCH_OPERATIONS],
+            filter_predicate=filter_predicate,
+        )
+
+
+# =====================================================
+# Record
+# =====================================================
+
+def new_readiness(trace_id: str, expected: Iterable[str], completed: Dict[str, str],
+                  not_sampled: Iterable[str], rca_status: str = WAITING) -> dict:
+    now = datetime.now(timezone.utc)
+    return {
+        "id": readiness_id(trace_id),
+        "trace_id": trace_id,
+        "type": READINESS_TYPE,
+        "expected": {name: True for name in expected},
+        "completed": dict(completed),
+        "not_sampled": {name: True for name in not_sampled},
+        "rca_status": rca_status,
+        "created_at": now.isoformat(),
+        "created_epoch": int(now.timestamp()),
+    }
+
+
+def is_ready(doc: dict) -> bool:
+    return set(doc.get("expected") or {}) <= set(doc.get("completed") or {})
+
+
+def missing(doc: dict) -> list:
+    return sorted(set(doc.get("expected") or {}) - set(doc.get("completed") or {}))
+
+
+def read_readiness(container, trace_id: str) -> Optional[dict]:
+    try:
+        return container.read_item(readiness_id(trace_id), partition_key=trace_id)
+    except exceptions.CosmosResourceNotFoundError:
+        return None
+
+
+# =====================================================
+# Writers (EvaluatorRunner / BatchPoller)
+# =====================================================
+
+def register(container, trace_id: str, expected: Iterable[str], completed: Dict[str, str], not_sampled: Iterable[str]):
+    """
+    Create the trace's record. A trace delivered again (re-delivery or
+    update) only adds evaluators to the existing record.
+    """
+
+    try:
+        container.create_item(new_readiness(trace_id, expected, completed, not_sampled))
+        return
+
+    except exceptions.CosmosResourceExistsError:
+        pass
+
+    operations = (
+        [{"op": "set", "path": _path("expected", name), "value": True} for name in expected] +
+        [{"op": "set", "path": _path("completed", name), "value": status} for name, status in completed.items()] +
+        [{"op": "set", "path": _path("not_sampled", name), "value": True} for name in not_sampled]
+    )
+
+    if operations:
+        _patch(container, trace_id, operations)
+
+
+def mark_completed(container, trace_id: str, evaluator_name: str, status: str):
+    """
+    Record one evaluator result. Called before the evaluation doc is
+    written, so RCAEngine never sees the doc ahead of its readiness.
+    """
+
+    try:
+        _patch(container, trace_id, [{"op": "set", "path": _path("completed", evaluator_name), "value": status}])
+    except exceptions.CosmosResourceNotFoundError:
+        # Traces evaluated before readiness tracking existed
+        logging.debug(f"[readiness] No record for {trace_id}")
+
+
+# =====================================================
+# Claims (RCAEngine / RCATimeout)
+# =====================================================
+
+def claim(container, trace_id: str, stale_claims: bool = False) -> bool:
+    """
+    Move a waiting record to claimed. Exactly one caller wins; with
+    `stale_claims`, claims older than the timeout can be taken over.
+    """
+
+    now = int(time.time())
+    predicate = f"FROM c WHERE c.rca_status = '{WAITING}'"
+
+    if stale_claims:
+        predicate += f" OR (c.rca_status = '{CLAIMED}' AND c.claimed_epoch < {now - READINESS_TIMEOUT_SECONDS})"
+
+    try:
+        _patch(container, trace_id, [
+            {"op": "set", "path": "/rca_status", "value": CLAIMED},
+            {"op": "set", "path": "/claimed_epoch", "value": now},
+        ], filter_predicate=predicate)
+        return True
+
+    except exceptions.CosmosAccessConditionFailedError:
+        return False
+
+
+def claim_new(container, trace_id: str, expected: Iterable[str], completed: Dict[str, str]) -> bool:
+    """
+    Claim a trace that has no record yet (evaluated before readiness
+    tracking) by creating it already claimed.
+    """
+
+    doc = new_readiness(trace_id, expected, completed, [], rca_status=CLAIMED)
+    doc["claimed_epoch"] = doc["created_epoch"]
+
+    try:
+        container.create_item(doc)
+        return True
+    except exceptions.CosmosResourceExistsError:
+        return False
+
+
+def finish(container, trace_id: str, trigger: str, result: str = RCA_COMPLETED):
+    _patch(container, trace_id, [
+        {"op": "set", "path": "/rca_status", "value": DONE},
+        {"op": "set", "path": "/rca_trigger", "value": trigger},
+        {"op": "set", "path": "/rca_result", "value": result},
+    ])
+
+
+def fail_attempt(container, record: dict, trigger: str, result: str) -> bool:
+    """
+    Count a failed attempt on a claimed record. It stays claimed (and is
+    re-claimed once stale) until RCA_MAX_ATTEMPTS, then it is finished
+    with `result`. Returns True if the record was given up on.
+    """
+
+    trace_id = record["trace_id"]
+    attempts = (record.get("rca_attempts") or 0) + 1
+
+    if attempts >= RCA_MAX_ATTEMPTS:
+        finish(container, trace_id, trigger, result)
+        return True
+
+    _patch(container, trace_id, [
+        {"op": "set", "path": "/rca_attempts", "value": attempts},
+        {"op": "set", "path": "/rca_error", "value": result},
+    ])
+
+    return False
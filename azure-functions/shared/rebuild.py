@@ -0,0 +1,453 @@
+"""
+Parallel full rebuild of the change-feed aggregates.
+
+✔ Splits a container into feed ranges (or _ts slices on SDKs without
+  read_feed_ranges) and scans them on a thread pool
+✔ Streams each range page by page into a partial MetricsAggregate, so
+  memory is bounded by workers x page size, not by history
+✔ Partials are merged associatively at the end
+✔ Also rebuilds the derived docs (rollups, cube, leaderboards) for the
+  last AGGREGATE_REBUILD_DERIVED_DAYS, so a pricing or backfill fix
+  reaches them too
+✔ A rebuild lock pauses the change-feed aggregators (their batches fail
+  and are retried) while the state is replaced; each rebuilt doc is
+  seeded with the newest docs as its applied window, so a batch that
+  was in flight is deduped instead of counted twice
+"""
+
+import heapq
+import logging
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import reduce
+from typing import List, Optional, Tuple
+
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+from shared.aggregates import (
+    APPLIED_WINDOW,
+    FEED_PROJECTIONS,
+    STATE_PK,
+    MetricsAggregate,
+    contribution,
+    new_state,
+    state_id,
+    update_with_etag,
+)
+from shared.cube import CUBE_PK, MEASURES, build_day, cube_id, trace_dimensions, trace_measures
+from shared.cube import DIMENSIONS as CUBE_DIMENSIONS
+from shared.leaderboards import (
+    LEADERBOARD_PK,
+    _score_entries,
+    _trace_entries,
+    leaderboard_id,
+    merge_entries,
+    new_leaderboard,
+)
+from shared.rollups import GRANULARITIES, bucket_key, doc_time, new_rollup, rollup_id, rollup_pk, target_granularity
+
+
+# =====================================================
+# Configuration
+# =====================================================
+
+REBUILD_WORKERS = int(os.getenv("AGGREGATE_REBUILD_WORKERS", "8"))
+REBUILD_PAGE_SIZE = int(os.getenv("AGGREGATE_REBUILD_PAGE_SIZE", "500"))
+
+# Days of rollups / cube / leaderboards rebuilt with the state (0 = all)
+REBUILD_DERIVED_DAYS = int(os.getenv("AGGREGATE_REBUILD_DERIVED_DAYS", "30"))
+
+# A crashed rebuild stops blocking the aggregators after this long
+REBUILD_LOCK_SECONDS = int(os.getenv("AGGREGATE_REBUILD_LOCK_SECONDS", "3600"))
+
+# Time for change-feed batches already running to finish after locking
+REBUILD_LOCK_GRACE_SECONDS = float(os.getenv("AGGREGATE_REBUILD_LOCK_GRACE_SECONDS", "30"))
+
+LOCK_ID = f"{STATE_PK}:rebuild_lock"
+
+# _ts slices per worker when feed ranges are unavailable; more slices than
+# workers keeps the pool busy when history is uneven over time
+TS_SLICES_PER_WORKER = 4
+
+
+# =====================================================
+# Lock
+# =====================================================
+
+class RebuildInProgress(RuntimeError):
+    pass
+
+
+def acquire_lock(container) -> bool:
+
+    now = int(time.time())
+    lock = {"id": LOCK_ID, "partitionKey": STATE_PK, "acquired_epoch": now, "expires_epoch": now + REBUILD_LOCK_SECONDS}
+
+    try:
+        container.create_item(lock)
+        return True
+    except exceptions.CosmosResourceExistsError:
+        pass
+
+    existing = container.read_item(LOCK_ID, partition_key=STATE_PK)
+
+    if existing.get("expires_epoch", 0) > now:
+        return False
+
+    try:
+        container.replace_item(LOCK_ID, lock, etag=existing["_etag"], match_condition=MatchConditions.IfNotModified)
+        return True
+    except exceptions.CosmosAccessConditionFailedError:
+        return False
+
+
+def release_lock(container):
+    try:
+        container.delete_item(LOCK_ID, partition_key=STATE_PK)
+    except exceptions.CosmosResourceNotFoundError:
+        pass
+
+
+def check_not_rebuilding(container):
+    """
+    Raise while a rebuild holds the lock, so the change-feed batch is
+    retried (see the aggregators' retry policy) after it finished.
+    """
+
+    try:
+        lock = container.read_item(LOCK_ID, partition_key=STATE_PK)
+    except exceptions.CosmosResourceNotFoundError:
+        return
+
+    if lock.get("expires_epoch", 0) > time.time():
+        raise RebuildInProgress("Aggregate rebuild in progress")
+
+
+# =====================================================
+# Partials
+# =====================================================
+
+class Partial:
+    """
+    Aggregate of one scanned range plus what the checkpoint needs and,
+    for docs at or after `since`, the derived docs' contents.
+    """
+
+    def __init__(self, feed: str, since: Optional[datetime] = None, now: Optional[datetime] = None):
+        self.feed = feed
+        self.since = since
+        self.now = now or datetime.now(timezone.utc)
+
+        self.aggregate = MetricsAggregate()
+        self.docs = 0
+        self.last_ts = 0
+
+        # Newest APPLIED_WINDOW docs as (_ts, id, doc), a min-heap
+        self.recent = []
+
+        # (granularity, bucket) -> aggregate; "direct" as in rollups
+        self.rollups = defaultdict(MetricsAggregate)
+        self.direct = defaultdict(MetricsAggregate)
+
+        # day -> cube dimensions tuple -> measures
+        self.cube = defaultdict(lambda: defaultdict(lambda: [0] * len(MEASURES)))
+
+        # day -> board (or evaluator) -> entries
+        self.boards = defaultdict(dict)
+
+    def _add(self, agg: MetricsAggregate, doc: dict):
+        (agg.add_trace if self.feed == "traces" else agg.add_evaluation)(doc)
+
+    def _add_derived(self, doc: dict, ts: datetime):
+
+        target = target_granularity(ts, self.now)
+
+        for granularity in GRANULARITIES[GRANULARITIES.index(target):]:
+            self._add(self.rollups[(granularity, bucket_key(granularity, ts))], doc)
+
+        if target != GRANULARITIES[0]:
+            self._add(self.direct[(target, bucket_key(target, ts))], doc)
+
+        if self.feed == "traces":
+            cell = self.cube[ts.strftime("%Y-%m-%d")][tuple(trace_dimensions(doc)[d] for d in CUBE_DIMENSIONS)]
+            for i, value in enumerate(trace_measures(doc)):
+                cell[i] += value
+
+    def _merge_boards(self, day: str, new: dict):
+        boards = self.boards[day]
+        for name, entries in new.items():
+            boards[name] = merge_entries(boards.get(name, []), entries, lowest=self.feed != "traces")
+
+    def add_page(self, page: List[dict]):
+
+        by_day = defaultdict(list)
+
+        for doc in page:
+
+            self._add(self.aggregate, doc)
+            self.last_ts = max(self.last_ts, doc.get("_ts", 0))
+
+            if doc.get("id") is not None:
+                heapq.heappush(self.recent, (doc.get("_ts", 0), doc["id"], doc))
+                if len(self.recent) > APPLIED_WINDOW:
+                    heapq.heappop(self.recent)
+
+            if self.since is not None:
+                ts = doc_time(self.feed, doc)
+                if ts >= self.since:
+                    self._add_derived(doc, ts)
+                    by_day[ts.strftime("%Y-%m-%d")].append(doc)
+
+        for day, docs in by_day.items():
+            self._merge_boards(day, _trace_entries(docs) if self.feed == "traces" else _score_entries(docs))
+
+        self.docs += len(page)
+
+    def merge(self, other: "Partial") -> "Partial":
+
+        self.aggregate.merge(other.aggregate)
+        self.docs += other.docs
+        self.last_ts = max(self.last_ts, other.last_ts)
+
+        self.recent = heapq.nlargest(APPLIED_WINDOW, self.recent + other.recent, key=lambda r: (r[0], r[1]))
+        heapq.heapify(self.recent)
+
+        for key, agg in other.rollups.items():
+            self.rollups[key].merge(agg)
+        for key, agg in other.direct.items():
+            self.direct[key].merge(agg)
+
+        for day, cells in other.cube.items():
+            mine = self.cube[day]
+            for dims, values in cells.items():
+                mine[dims] = [a + b for a, b in zip(mine[dims], values)]
+
+        for day, boards in other.boards.items():
+            self._merge_boards(day, boards)
+
+        return self
+
+    def recent_docs(self) -> List[dict]:
+        # Oldest first, like an applied window
+        return [doc for _, _, doc in sorted(self.recent, key=lambda r: (r[0], r[1]))]
+
+
+# =====================================================
+# Ranges
+# =====================================================
+
+def _ts_bound(container, func: str):
+    values = list(container.query_items(
+        query=f"SELECT VALUE {func}(c._ts) FROM c",
+        enable_cross_partition_query=True
+    ))
+    return values[0] if values else None
+
+
+def _ts_slices(container, slices: int) -> List[Tuple[int, int]]:
+
+    low, high = _ts_bound(container, "MIN"), _ts_bound(container, "MAX")
+
+    if low is None or high is None:
+        return []
+
+    high += 1
+    step = max(1, -(-(high - low) // slices))
+
+    return [(start, min(start + step, high)) for start in range(low, high, step)]
+
+
+def scan_ranges(container, workers: int = REBUILD_WORKERS) -> List[dict]:
+    """
+    query_items kwargs per independent range: physical feed ranges where
+    the SDK exposes them, otherwise contiguous _ts slices.
+    """
+
+    if hasattr(container, "read_feed_ranges"):
+        return [{"feed_range": fr} for fr in container.read_feed_ranges()]
+
+    return [
+        {
+            "where": "c._ts >= @lo AND c._ts < @hi",
+            "parameters": [{"name": "@lo", "value": lo}, {"name": "@hi", "value": hi}],
+        }
+        for lo, hi in _ts_slices(container, workers * TS_SLICES_PER_WORKER)
+    ]
+
+
+def scan_range(container, feed: str, scope: dict, page_size: int = REBUILD_PAGE_SIZE,
+               since: Optional[datetime] = None, now: Optional[datetime] = None) -> Partial:
+
+    query = f"SELECT {FEED_PROJECTIONS[feed]} FROM c"
+    if scope.get("where"):
+        query += f" WHERE {scope['where']}"
+
+    kwargs = {"feed_range": scope["feed_range"]} if "feed_range" in scope else {"enable_cross_partition_query": True}
+
+    partial = Partial(feed, since, now)
+
+    pages = container.query_items(
+        query=query,
+        parameters=scope.get("parameters") or [],
+        max_item_count=page_size,
+        **kwargs
+    ).by_page()
+
+    for page in pages:
+        partial.add_page(list(page))
+
+    return partial
+
+
+# =====================================================
+# Rebuild
+# =====================================================
+
+def derived_since(now: datetime, days: int = REBUILD_DERIVED_DAYS) -> datetime:
+    if not days:
+        return datetime.min.replace(tzinfo=timezone.utc)
+    return (now - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rebuild_feed(container, feed: str, workers: int = REBUILD_WORKERS,
+                 since: Optional[datetime] = None, now: Optional[datetime] = None) -> Partial:
+
+    scopes = scan_ranges(container, workers)
+
+    if not scopes:
+        return Partial(feed, since, now)
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(scopes))) as pool:
+        # Fold partials in range order as they arrive
+        total = reduce(
+            Partial.merge,
+            pool.map(lambda scope: scan_range(container, feed, scope, since=since, now=now), scopes),
+            Partial(feed, since, now)
+        )
+
+    logging.info(f"[rebuild] {feed}: {total.docs} docs from {len(scopes)} ranges on {min(workers, len(scopes))} workers")
+
+    return total
+
+
+# =====================================================
+# Writes
+# =====================================================
+
+def write_state(container, partial: Partial) -> dict:
+    """
+    Replace the feed's state with the rebuilt aggregate, keeping the live
+    checkpoint's counters and seeding its applied window.
+    """
+
+    feed = partial.feed
+
+    def update(state):
+        checkpoint = (state or {}).get("checkpoint") or {}
+        return new_state(feed, MetricsAggregate().merge(partial.aggregate), {
+            "last_ts": max(checkpoint.get("last_ts", 0), partial.last_ts),
+            "applied": [[d["id"], contribution(feed, d)] for d in partial.recent_docs()],
+            "batches": checkpoint.get("batches", 0),
+            "docs": partial.docs,
+            "rebuilt_at": datetime.now(timezone.utc).isoformat(),
+        })
+
+    return update_with_etag(container, state_id(feed), STATE_PK, update)
+
+
+def _stale(container, pk: str, field: str, since_key: str, keep: set) -> list:
+    return [
+        d["id"] for d in container.query_items(
+            query=f"SELECT c.id FROM c WHERE c.partitionKey=@pk AND c.{field} >= @since",
+            parameters=[{"name": "@pk", "value": pk}, {"name": "@since", "value": since_key}],
+            partition_key=pk,
+        )
+        if d["id"] not in keep
+    ]
+
+
+def _replace(container, doc_id: str, pk: str, body: dict):
+    update_with_etag(container, doc_id, pk, lambda existing: body)
+
+
+def write_derived(container, partials: List[Partial], since: datetime) -> dict:
+    """
+    Replace rollups, cube and leaderboard docs from `since` with the
+    rebuilt ones (both feeds' partials), deleting docs in that range the
+    rebuild did not produce. Returns the number of docs written per kind.
+    """
+
+    written = defaultdict(int)
+
+    # ---------------- Rollups (both feeds share buckets) ----------------
+    buckets = set()
+    for p in partials:
+        buckets.update(p.rollups)
+
+    recent = [(p.feed, d) for p in partials for d in p.recent_docs()]
+
+    for granularity, bucket in sorted(buckets):
+
+        agg, direct = MetricsAggregate(), MetricsAggregate()
+        for p in partials:
+            agg.merge(p.rollups.get((granularity, bucket)) or MetricsAggregate())
+            direct.merge(p.direct.get((granularity, bucket)) or MetricsAggregate())
+
+        applied = [
+            [d["id"], contribution(feed, d)]
+            for feed, d in recent
+            if bucket_key(granularity, doc_time(feed, d)) == bucket
+            and target_granularity(doc_time(feed, d), partials[0].now) == granularity
+        ]
+
+        body = new_rollup(granularity, bucket, agg, applied, direct)
+        # Every level is rebuilt, so nothing waits on compaction
+        body["dirty"] = False
+
+        _replace(container, rollup_id(granularity, bucket), rollup_pk(granularity), body)
+        written["rollups"] += 1
+
+    for granularity in GRANULARITIES:
+        keep = {rollup_id(g, b) for g, b in buckets if g == granularity}
+        for doc_id in _stale(container, rollup_pk(granularity), "bucket", bucket_key(granularity, since), keep):
+            container.delete_item(doc_id, partition_key=rollup_pk(granularity))
+
+    # ---------------- Cube + leaderboards ----------------
+    traces = next((p for p in partials if p.feed == "traces"), None)
+    evaluations = next((p for p in partials if p.feed == "evaluations"), None)
+
+    days = set()
+
+    if traces is not None:
+
+        recent_by_day = defaultdict(list)
+        for d in traces.recent_docs():
+            recent_by_day[doc_time("traces", d).strftime("%Y-%m-%d")].append(d)
+
+        for day, cells in traces.cube.items():
+            _replace(container, cube_id(day), CUBE_PK, build_day(day, cells, recent_by_day.get(day, [])))
+            written["cube"] += 1
+
+        keep = {cube_id(day) for day in traces.cube}
+        for doc_id in _stale(container, CUBE_PK, "day", since.strftime("%Y-%m-%d"), keep):
+            container.delete_item(doc_id, partition_key=CUBE_PK)
+
+        days.update(traces.boards)
+
+    if evaluations is not None:
+        days.update(evaluations.boards)
+
+    for day in sorted(days):
+        boards = traces.boards.get(day, {}) if traces is not None else {}
+        scores = evaluations.boards.get(day, {}) if evaluations is not None else {}
+        _replace(container, leaderboard_id(day), LEADERBOARD_PK, new_leaderboard(day, boards, scores))
+        written["leaderboards"] += 1
+
+    for doc_id in _stale(container, LEADERBOARD_PK, "day", since.strftime("%Y-%m-%d"), {leaderboard_id(d) for d in days}):
+        container.delete_item(doc_id, partition_key=LEADERBOARD_PK)
+
+    return dict(written)
@@ -0,0 +1,291 @@
+"""
+Time-bucketed metric rollups (minute / hour / day).
+
+✔ Change feed writes minute buckets (one MetricsAggregate per bucket)
+✔ Compaction rebuilds hours from minutes and days from hours
+✔ Retention deletes minutes / hours once their parent is final and
+  none of their siblings still waits on compaction
+✔ Late data beyond a granularity's retention lands in the coarser
+  bucket, kept apart ("direct") so compaction does not overwrite it
+"""
+
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+from shared.aggregates import MetricsAggregate, applied_from, apply_docs, update_with_etag
+
+
+# =====================================================
+# Configuration
+# =====================================================
+
+GRANULARITIES = ("minute", "hour", "day")
+
+PARENT = {"minute": "hour", "hour": "day"}
+
+BUCKET_FORMATS = {
+    "minute": "%Y-%m-%dT%H:%M:00Z",
+    "hour": "%Y-%m-%dT%H:00:00Z",
+    "day": "%Y-%m-%dT00:00:00Z",
+}
+
+BUCKET_SPANS = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+# A bucket is kept until its parent bucket ended this long ago (0 = forever)
+RETENTION = {
+    "minute": timedelta(hours=float(os.getenv("ROLLUP_MINUTE_RETENTION_HOURS", "48"))),
+    "hour": timedelta(days=float(os.getenv("ROLLUP_HOUR_RETENTION_DAYS", "90"))),
+    "day": timedelta(days=float(os.getenv("ROLLUP_DAY_RETENTION_DAYS", "0"))),
+}
+
+
+# =====================================================
+# Buckets
+# =====================================================
+
+def rollup_pk(granularity: str) -> str:
+    return f"rollup:{granularity}"
+
+
+def bucket_key(granularity: str, ts: datetime) -> str:
+    return ts.strftime(BUCKET_FORMATS[granularity])
+
+
+def bucket_start(bucket: str) -> datetime:
+    return datetime.strptime(bucket, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+
+
+def rollup_id(granularity: str, bucket: str) -> str:
+    return f"rollup:{granularity}:{bucket}"
+
+
+def _epoch_time(ts) -> datetime:
+    ts = float(ts)
+    return datetime.fromtimestamp(ts / 1000 if ts > 1e11 else ts, tz=timezone.utc)
+
+
+def doc_time(feed: str, doc: dict) -> datetime:
+    """
+    Event time of a trace (request.timestamp, epoch s or ms) or an
+    evaluation (its trace's time, trace_timestamp, so a re-written
+    evaluation stays in the bucket that already counted it; the ISO
+    write timestamp for older docs); Cosmos _ts as a fallback.
+    """
+    try:
+        if feed == "traces":
+            ts = (doc.get("request", {}) or {}).get("timestamp")
+            if ts:
+                return _epoch_time(ts)
+        elif doc.get("trace_timestamp"):
+            return _epoch_time(doc["trace_timestamp"])
+        elif doc.get("timestamp"):
+            return datetime.fromisoformat(str(doc["timestamp"]).replace("Z", "+00:00")).astimezone(timezone.utc)
+    except (TypeError, ValueError):
+        pass
+
+    return datetime.fromtimestamp(doc.get("_ts", 0), tz=timezone.utc)
+
+
+def parent_closed(granularity: str, bucket: str, now: datetime) -> bool:
+    """
+    True once a bucket's parent ended longer ago than the bucket's
+    retention, i.e. it may be deleted / must not receive new data.
+    """
+    retention = RETENTION[granularity]
+
+    if not retention:
+        return False
+
+    parent = PARENT.get(granularity)
+
+    if parent is None:
+        end = bucket_start(bucket) + BUCKET_SPANS[granularity]
+    else:
+        end = bucket_start(bucket_key(parent, bucket_start(bucket))) + BUCKET_SPANS[parent]
+
+    return end <= now - retention
+
+
+def target_granularity(ts: datetime, now: datetime) -> str:
+    """
+    Finest granularity whose bucket for `ts` is still retained.
+    """
+    for granularity in GRANULARITIES[:-1]:
+        if not parent_closed(granularity, bucket_key(granularity, ts), now):
+            return granularity
+    return GRANULARITIES[-1]
+
+
+def new_rollup(granularity: str, bucket: str, agg: MetricsAggregate, applied: Optional[list] = None,
+               direct: Optional[MetricsAggregate] = None) -> dict:
+    return {
+        "id": rollup_id(granularity, bucket),
+        "partitionKey": rollup_pk(granularity),
+        "granularity": granularity,
+        "bucket": bucket,
+        "aggregate": agg.to_dict(),
+        # Data written to this bucket itself rather than compacted from
+        # its children (late data for a final bucket)
+        "direct": (direct or MetricsAggregate()).to_dict(),
+        "applied": applied or [],
+        # Parent bucket needs rebuilding
+        "dirty": granularity in PARENT,
+        "updated_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+# =====================================================
+# Ingest (change feed)
+# =====================================================
+
+def apply_rollups(container, feed: str, docs: list):
+    """
+    Fold change-feed docs into their event-time buckets. Each bucket
+    doc keeps its own applied-contribution window, so a redelivered
+    batch is not counted twice and a re-written doc replaces itself.
+    """
+
+    now = datetime.now(timezone.utc)
+    grouped = defaultdict(list)
+
+    for doc in docs:
+        ts = doc_time(feed, doc)
+        granularity = target_granularity(ts, now)
+        grouped[(granularity, bucket_key(granularity, ts))].append(doc)
+
+    for (granularity, bucket), bucket_docs in grouped.items():
+
+        def update(existing, granularity=granularity, bucket=bucket, bucket_docs=bucket_docs):
+            existing = existing or {}
+            previous = applied_from(existing)
+
+            agg = MetricsAggregate.from_dict(existing.get("aggregate"))
+            _, applied = apply_docs(feed, agg, previous, bucket_docs)
+
+            # Only minutes are written in the normal case; anything coarser
+            # is late data the next compaction must keep
+            direct = MetricsAggregate.from_dict(existing.get("direct"))
+            if granularity != GRANULARITIES[0]:
+                apply_docs(feed, direct, previous, bucket_docs)
+
+            return new_rollup(granularity, bucket, agg, applied, direct)
+
+        update_with_etag(container, rollup_id(granularity, bucket), rollup_pk(granularity), update)
+
+
+# =====================================================
+# Compaction + Retention (timer)
+# =====================================================
+
+def _query(container, granularity: str, where: str, parameters: Optional[list] = None) -> list:
+    return list(container.query_items(
+        query=f"SELECT * FROM c WHERE c.partitionKey=@pk AND {where}",
+        parameters=[{"name": "@pk", "value": rollup_pk(granularity)}] + (parameters or []),
+        partition_key=rollup_pk(granularity),
+    ))
+
+
+def compact(container, granularity: str) -> int:
+    """
+    Rebuild every parent bucket that has a dirty child from all of its
+    children plus the parent's own direct data, then clear the children's
+    dirty flag (unless they changed meanwhile). Returns the number of
+    parent buckets rebuilt.
+    """
+
+    parent = PARENT[granularity]
+    span = BUCKET_SPANS[parent]
+
+    parents = {bucket_key(parent, bucket_start(d["bucket"])) for d in _query(container, granularity, "c.dirty = true")}
+
+    for parent_bucket in sorted(parents):
+
+        start = bucket_start(parent_bucket)
+
+        children = _query(container, granularity, "c.bucket >= @start AND c.bucket < @end", [
+            {"name": "@start", "value": parent_bucket},
+            {"name": "@end", "value": bucket_key(granularity, start + span)},
+        ])
+
+        agg = MetricsAggregate()
+        for child in children:
+            agg.merge(MetricsAggregate.from_dict(child.get("aggregate")))
+
+        # Children are only deleted once their parent is final and no
+        # sibling is dirty (enforce_retention), and data for a final parent
+        # goes to its direct part, so children + direct are the whole parent
+        def update(existing, agg=agg, parent_bucket=parent_bucket):
+            existing = existing or {}
+            direct = MetricsAggregate.from_dict(existing.get("direct"))
+            total = MetricsAggregate().merge(agg).merge(direct)
+            return new_rollup(parent, parent_bucket, total, [[k, c] for k, c in applied_from(existing).items()], direct)
+
+        update_with_etag(container, rollup_id(parent, parent_bucket), rollup_pk(parent), update)
+
+        for child in children:
+            if not child.get("dirty"):
+                continue
+            child["dirty"] = False
+            try:
+                container.replace_item(
+                    child["id"],
+                    {k: v for k, v in child.items() if not k.startswith("_")},
+                    etag=child["_etag"],
+                    match_condition=MatchConditions.IfNotModified
+                )
+            except exceptions.CosmosAccessConditionFailedError:
+                # New data arrived; stays dirty for the next run
+                pass
+
+    return len(parents)
+
+
+def enforce_retention(container, granularity: str) -> int:
+    """
+    Delete clean buckets whose parent ended longer ago than the
+    granularity's retention. Siblings of a dirty bucket are kept until
+    the parent has been recompacted from all of them.
+    """
+
+    if not RETENTION[granularity]:
+        return 0
+
+    now = datetime.now(timezone.utc)
+    deleted = 0
+
+    parent = PARENT.get(granularity)
+    pending = set()
+
+    if parent is not None:
+        pending = {bucket_key(parent, bucket_start(d["bucket"])) for d in _query(container, granularity, "c.dirty = true")}
+
+    for doc in _query(container, granularity, "(NOT IS_DEFINED(c.dirty) OR c.dirty = false)"):
+        if parent is not None and bucket_key(parent, bucket_start(doc["bucket"])) in pending:
+            continue
+        if parent_closed(granularity, doc["bucket"], now):
+            container.delete_item(doc["id"], partition_key=rollup_pk(granularity))
+            deleted += 1
+
+    return deleted
+
+
+def compact_and_expire(container):
+
+    for granularity in ("minute", "hour"):
+        rebuilt = compact(container, granularity)
+        logging.info(f"[rollups] Rebuilt {rebuilt} {PARENT[granularity]} buckets from {granularity}s")
+
+    for granularity in GRANULARITIES:
+        deleted = enforce_retention(container, granularity)
+        if deleted:
+            logging.info(f"[rollups] Expired {deleted} {granularity} buckets")
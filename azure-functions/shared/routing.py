@@ -0,0 +1,245 @@
+"""
+Circuit breakers and latency-aware routing across LLM deployments.
+
+✔ One breaker per endpoint (closed → open → half-open → closed)
+✔ Rolling latency / error stats per endpoint
+✔ Router orders equivalent deployments by recent p95 and error rate
+✔ snapshot() exposes breaker state and routing decisions as metrics
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Dict, List
+
+
+# =====================================================
+# Configuration
+# =====================================================
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_RECOVERY_SECONDS = float(os.getenv("LLM_BREAKER_RECOVERY_SECONDS", "30"))
+STATS_WINDOW = int(os.getenv("LLM_STATS_WINDOW", "200"))
+STATS_MAX_AGE_SECONDS = float(os.getenv("LLM_STATS_MAX_AGE_SECONDS", "300"))
+
+# Start a hedged request on the next-best endpoint after this many ms (0 = off)
+HEDGE_AFTER_MS = int(os.getenv("LLM_HEDGE_AFTER_MS", "0"))
+
+# Equivalent deployments per logical model, e.g.
+# {"gpt-4o-mini": ["evaluator", "azure:gpt-4o-mini", "azure:gpt-4o-mini-eu"]}
+DEPLOYMENT_GROUPS: Dict[str, List[str]] = json.loads(os.getenv("LLM_DEPLOYMENT_GROUPS", "{}") or "{}")
+
+
+# =====================================================
+# Circuit Breaker
+# =====================================================
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls
+    for `recovery_seconds`; then lets one probe through (half-open) and
+    closes again on success or re-opens on failure.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 recovery_seconds: float = BREAKER_RECOVERY_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        """
+        True while calls would be rejected; does not claim the half-open probe.
+        """
+        with self._lock:
+            return self.state == OPEN and time.time() - self.opened_at < self.recovery_seconds
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+
+            if self.state == OPEN and time.time() - self.opened_at >= self.recovery_seconds:
+                self.state = HALF_OPEN
+                self.probe_in_flight = False
+
+            if self.state == HALF_OPEN and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+
+            return False
+
+    def release(self):
+        """
+        Give back an unused half-open probe (e.g. a cancelled hedge).
+        """
+        with self._lock:
+            self.probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_in_flight = False
+
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                    logging.warning(f"[routing:{self.name}] Circuit opened for {self.recovery_seconds}s")
+                self.state = OPEN
+                self.opened_at = time.time()
+                self.failures = 0
+
+
+# =====================================================
+# Rolling Endpoint Stats
+# =====================================================
+
+class EndpointStats:
+
+    def __init__(self, window: int = STATS_WINDOW, max_age: float = STATS_MAX_AGE_SECONDS):
+        self.samples = deque(maxlen=window)  # (timestamp, latency_ms, ok)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+    def record(self, latency_ms: float, ok: bool):
+        with self._lock:
+            self.samples.append((time.time(), latency_ms, ok))
+
+    def _recent(self) -> list:
+        cutoff = time.time() - self.max_age
+        return [s for s in self.samples if s[0] >= cutoff]
+
+    def summary(self) -> dict:
+        with self._lock:
+            recent = self._recent()
+
+        latencies = sorted(s[1] for s in recent if s[2])
+
+        def pct(q):
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+        return {
+            "calls": len(recent),
+            "error_rate": round(sum(1 for s in recent if not s[2]) / len(recent), 4) if recent else 0.0,
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+        }
+
+
+# =====================================================
+# Router
+# =====================================================
+
+class DeploymentRouter:
+
+    def __init__(self, groups: Dict[str, List[str]] = None):
+        self.groups = groups or {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.stats: Dict[str, EndpointStats] = {}
+        self.decisions = defaultdict(lambda: defaultdict(int))
+        self.rejected = defaultdict(int)
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def _get(self, endpoint: str):
+        with self._lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = CircuitBreaker(endpoint)
+                self.stats[endpoint] = EndpointStats()
+            return self.breakers[endpoint], self.stats[endpoint]
+
+    def _rank_key(self, endpoint: str):
+        summary = self._get(endpoint)[1].summary()
+
+        # Unmeasured endpoints rank first so they get explored;
+        # endpoints with only failures rank last
+        if not summary["calls"]:
+            return 0.0
+        if summary["p95_ms"] is None:
+            return float("inf")
+
+        return summary["p95_ms"] * (1 + 4 * summary["error_rate"])
+
+    def route(self, model: str, default: List[str]) -> List[str]:
+        """
+        Candidate endpoints for a logical model, best first, skipping any
+        whose breaker is open. `default` is used when no group is configured.
+        Call acquire() right before using a candidate.
+        """
+        candidates = self.groups.get(model) or default
+
+        ranked = sorted(dict.fromkeys(candidates), key=self._rank_key)
+
+        allowed = []
+        for endpoint in ranked:
+            if self._get(endpoint)[0].is_open():
+                self.rejected[endpoint] += 1
+            else:
+                allowed.append(endpoint)
+
+        return allowed
+
+    def acquire(self, endpoint: str) -> bool:
+        if self._get(endpoint)[0].allow():
+            return True
+        self.rejected[endpoint] += 1
+        return False
+
+    def release(self, endpoint: str):
+        self._get(endpoint)[0].release()
+
+    def record(self, model: str, endpoint: str, latency_ms: float, ok: bool):
+        breaker, stats = self._get(endpoint)
+        stats.record(latency_ms, ok)
+
+        if ok:
+            breaker.record_success()
+            self.decisions[model][endpoint] += 1
+        else:
+            breaker.record_failure()
+
+    def record_hedge(self):
+        self.hedges += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            endpoints = list(self.breakers)
+
+        return {
+            "endpoints": {
+                e: {
+                    "state": self.breakers[e].state,
+                    "times_opened": self.breakers[e].times_opened,
+                    "rejected_calls": self.rejected[e],
+                    **self.stats[e].summary(),
+                }
+                for e in endpoints
+            },
+            "decisions": {m: dict(d) for m, d in self.decisions.items()},
+            "hedged_requests": self.hedges,
+        }
+
+
+ROUTER = DeploymentRouter(DEPLOYMENT_GROUPS)
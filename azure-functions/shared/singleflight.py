@@ -0,0 +1,103 @@
+"""
+Single-flight coalescing of identical in-flight requests.
+
+✔ Concurrent callers with the same key share one in-flight call
+✔ Thread flavour (worker threads) and asyncio flavour (shared LLM loop)
+✔ Nothing is cached: the key is released as soon as the call finishes
+✔ Per-group call / coalesced counters for metrics
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict
+
+
+def request_key(*parts) -> str:
+    """
+    Stable key for a request made of JSON-serialisable parts.
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    For blocking calls made from several threads.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]):
+        """
+        Run fn() unless an identical call is in flight, in which case wait
+        for and return its result. Returns (result, coalesced).
+        """
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = self._in_flight[key] = Future()
+                leader = True
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._in_flight)}
+
+
+class AsyncSingleFlight:
+    """
+    For coroutines on a single event loop (no locking needed).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, factory: Callable[[], Awaitable[Any]]):
+        """
+        Await factory() unless an identical call is in flight on this loop.
+        Returns (result, coalesced). A cancelled waiter does not cancel the
+        shared call.
+        """
+        self.calls += 1
+        task = self._in_flight.get(key)
+
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task), True
+
+        task = self._in_flight[key] = asyncio.ensure_future(factory())
+        task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        return await asyncio.shield(task), False
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._in_flight)}
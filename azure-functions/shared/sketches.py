@@ -0,0 +1,611 @@
+"""
+Mergeable streaming sketches for the metrics aggregates.
+
+✔ DDSketch: quantiles with bounded relative error and memory
+✔ HyperLogLog: distinct counts (users, sessions, apps) in a few KB
+✔ ScoreHistogram: fixed-bin evaluator score distributions over each
+  evaluator's score range
+✔ Compact JSON forms for Cosmos documents
+✔ merge() across time buckets / dimensions at query time; DDSketch and
+  ScoreHistogram also subtract() a re-written doc's old contribution
+
+Keep in sync with backend/shared/sketches.py.
+"""
+
+import base64
+import hashlib
+import math
+from typing import Dict, Optional
+
+
+# =====================================================
+# DDSketch
+# =====================================================
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+DEFAULT_MAX_BINS = 2048
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+
+# Values at or below this go to the zero bucket (latencies are >= 0)
+MIN_INDEXABLE_VALUE = 1e-9
+
+
+class DDSketch:
+    """
+    Log-bucketed quantile sketch (Masson et al., VLDB 2019). Any quantile
+    is returned within `relative_accuracy` of the true value as long as
+    fewer than `max_bins` buckets are in use; beyond that the lowest
+    buckets are collapsed, so the error only grows at the low end and
+    the tail we alert on stays accurate.
+    """
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY, max_bins: int = DEFAULT_MAX_BINS):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    # -------------------------------------------------
+    # Updates
+    # -------------------------------------------------
+
+    def _index(self, value: float) -> int:
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def _value(self, index: int) -> float:
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value, weight: int = 1):
+
+        if value is None:
+            return
+
+        value = max(float(value), 0.0)
+
+        self.count += weight
+        self.sum += value * weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+        if value <= MIN_INDEXABLE_VALUE:
+            self.zero_count += weight
+            return
+
+        index = self._index(value)
+        self.bins[index] = self.bins.get(index, 0) + weight
+
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def _collapse(self):
+        # Fold the lowest buckets into the lowest one that is kept
+        indexes = sorted(self.bins)
+        excess = indexes[:len(indexes) - self.max_bins]
+        target = indexes[len(excess)]
+
+        folded = sum(self.bins.pop(i) for i in excess)
+        self.bins[target] = self.bins.get(target, 0) + folded
+
+    def merge(self, other: "DDSketch") -> "DDSketch":
+
+        if not other.count:
+            return self
+
+        if abs(other.relative_accuracy - self.relative_accuracy) > 1e-12:
+            raise ValueError("Cannot merge DDSketches with different relative accuracy")
+
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        while len(self.bins) > self.max_bins:
+            self._collapse()
+
+        return self
+
+    def subtract(self, other: "DDSketch") -> "DDSketch":
+        """
+        Remove values merged in earlier (a re-written doc's old
+        contribution). min / max cannot be retracted and are kept.
+        """
+
+        if not other.count:
+            return self
+
+        for index, count in other.bins.items():
+            if index not in self.bins and self.bins and index < min(self.bins):
+                # Folded into the lowest kept bucket by _collapse()
+                index = min(self.bins)
+            if index in self.bins:
+                self.bins[index] -= count
+                if self.bins[index] <= 0:
+                    del self.bins[index]
+
+        self.zero_count = max(self.zero_count - other.zero_count, 0)
+        self.count = max(self.count - other.count, 0)
+        self.sum -= other.sum
+
+        if not self.count:
+            self.__init__(self.relative_accuracy, self.max_bins)
+
+        return self
+
+    # -------------------------------------------------
+    # Queries
+    # -------------------------------------------------
+
+    def quantile(self, q: float) -> Optional[float]:
+
+        if not self.count:
+            return None
+
+        rank = q * (self.count - 1)
+
+        if rank < self.zero_count:
+            return 0.0
+
+        cumulative = self.zero_count
+
+        for index in sorted(self.bins):
+            cumulative += self.bins[index]
+            if cumulative > rank:
+                return min(max(self._value(index), self.min), self.max)
+
+        return self.max
+
+    def percentiles(self, quantiles=PERCENTILES, digits: int = 2) -> dict:
+        return {
+            f"p{round(q * 100):g}": (round(v, digits) if v is not None else None)
+            for q in quantiles
+            for v in [self.quantile(q)]
+        }
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": round(self.sum / self.count, 2) if self.count else None,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            **self.percentiles(),
+        }
+
+    # -------------------------------------------------
+    # Serialisation
+    # -------------------------------------------------
+
+    def to_dict(self) -> dict:
+
+        if not self.bins:
+            offset, counts = 0, []
+        else:
+            offset = min(self.bins)
+            counts = [0] * (max(self.bins) - offset + 1)
+            for index, count in self.bins.items():
+                counts[index - offset] = count
+
+        return {
+            "a": self.relative_accuracy,
+            "n": self.count,
+            "s": self.sum,
+            "mn": self.min if self.count else None,
+            "mx": self.max if self.count else None,
+            "z": self.zero_count,
+            "o": offset,
+            "b": counts,
+        }
+
+    @classmethod
+    def from_dict(cls, d: Optional[dict]) -> "DDSketch":
+
+        if not d:
+            return cls()
+
+        sketch = cls(relative_accuracy=d.get("a", DEFAULT_RELATIVE_ACCURACY))
+        sketch.count = d.get("n", 0)
+        sketch.sum = d.get("s", 0.0)
+        sketch.zero_count = d.get("z", 0)
+
+        if sketch.count:
+            sketch.min = d.get("mn", math.inf)
+            sketch.max = d.get("mx", -math.inf)
+
+        offset = d.get("o", 0)
+        sketch.bins = {offset + i: c for i, c in enumerate(d.get("b") or []) if c}
+
+        return sketch
+
+
+# =====================================================
+# HyperLogLog
+# =====================================================
+
+DEFAULT_PRECISION = 12
+
+
+def _hash64(value) -> int:
+    # Stable across processes (unlike hash()), so registers from different
+    # function instances can be merged
+    return int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """
+    Distinct-count sketch (Flajolet et al. 2007) with 2^precision one-byte
+    registers; standard error is 1.04 / sqrt(2^precision), ~1.6% at the
+    default precision. Small cardinalities use linear counting. Sparse
+    buckets serialise as (index, rank) pairs, dense ones as base64.
+    """
+
+    def __init__(self, precision: int = DEFAULT_PRECISION):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(self.m)
+
+    # -------------------------------------------------
+    # Updates
+    # -------------------------------------------------
+
+    def add(self, value):
+
+        if value is None:
+            return
+
+        h = _hash64(value)
+        width = 64 - self.precision
+
+        index = h >> width
+        rank = width - (h & ((1 << width) - 1)).bit_length() + 1
+
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLogs with different precision")
+
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+        return self
+
+    # -------------------------------------------------
+    # Queries
+    # -------------------------------------------------
+
+    def count(self) -> int:
+
+        zeros = self.registers.count(0)
+
+        if zeros == self.m:
+            return 0
+
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)
+
+        return int(round(estimate))
+
+    # -------------------------------------------------
+    # Serialisation
+    # -------------------------------------------------
+
+    def to_dict(self) -> dict:
+
+        used = [(i, r) for i, r in enumerate(self.registers) if r]
+
+        # (index << 6 | rank) ints beat base64 while few registers are set
+        if len(used) <= self.m // 8:
+            return {"p": self.precision, "s": [i << 6 | r for i, r in used]}
+
+        return {"p": self.precision, "r": base64.b64encode(bytes(self.registers)).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, d: Optional[dict]) -> "HyperLogLog":
+
+        if not d:
+            return cls()
+
+        hll = cls(precision=d.get("p", DEFAULT_PRECISION))
+
+        if d.get("r"):
+            hll.registers = bytearray(base64.b64decode(d["r"]))
+        else:
+            for packed in d.get("s") or []:
+                hll.registers[packed >> 6] = packed & 0x3F
+
+        return hll
+
+
+# =====================================================
+# Score Histogram
+# =====================================================
+
+SCORE_BINS = 20
+SCORE_RANGE = (0.0, 1.0)
+
+# Status counters kept next to the bins
+SCORE_STATUSES = ("completed", "unstable", "failed", "skipped")
+
+
+class ScoreHistogram:
+    """
+    Fixed-bin histogram of evaluator scores over the evaluator's score
+    range (SCORE_RANGE unless configured; scores outside it are clamped
+    into the edge bins), with per-status counts and running moments of
+    the score and of the ensemble variance. Every field is a count or a
+    sum, so merge() is plain addition; a histogram over another range is
+    rescaled linearly first, and an empty one takes the other's range.
+    """
+
+    def __init__(self, bins: int = SCORE_BINS, low: float = SCORE_RANGE[0], high: float = SCORE_RANGE[1]):
+        self.bins = bins
+        self.low = low
+        self.high = high
+
+        self.counts = [0] * bins
+        self.statuses = dict.fromkeys(SCORE_STATUSES, 0)
+
+        self.score_sum = 0.0
+        self.score_sq_sum = 0.0
+
+        self.variance_count = 0
+        self.variance_sum = 0.0
+        self.variance_sq_sum = 0.0
+
+    @property
+    def width(self) -> float:
+        return (self.high - self.low) / self.bins
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    @property
+    def empty(self) -> bool:
+        # Status counts do not depend on the range
+        return not (self.count or self.variance_count)
+
+    def edges(self) -> list:
+        return [round(self.low + i * self.width, 6) for i in range(self.bins + 1)]
+
+    def rescaled(self, low: float, high: float) -> "ScoreHistogram":
+        """
+        Copy mapped linearly onto [low, high]: bin i stays bin i, the
+        score moments follow the map and ensemble variances scale with
+        its slope squared.
+        """
+
+        a = (high - low) / (self.high - self.low)
+        b = low - a * self.low
+        n = self.count
+
+        hist = ScoreHistogram(bins=self.bins, low=low, high=high)
+
+        hist.counts = list(self.counts)
+        hist.statuses = dict(self.statuses)
+
+        hist.score_sum = a * self.score_sum + b * n
+        hist.score_sq_sum = a * a * self.score_sq_sum + 2 * a * b * self.score_sum + b * b * n
+
+        hist.variance_count = self.variance_count
+        hist.variance_sum = a ** 2 * self.variance_sum
+        hist.variance_sq_sum = a ** 4 * self.variance_sq_sum
+
+        return hist
+
+    def _aligned(self, other: "ScoreHistogram", action: str) -> "ScoreHistogram":
+
+        if other.bins != self.bins:
+            if not self.empty:
+                raise ValueError(f"Cannot {action} ScoreHistograms with different bins")
+            self.bins = other.bins
+            self.counts = [0] * other.bins
+
+        if (other.low, other.high) == (self.low, self.high):
+            return other
+
+        if self.empty:
+            self.low, self.high = other.low, other.high
+            return other
+
+        return other.rescaled(self.low, self.high)
+
+    # -------------------------------------------------
+    # Updates
+    # -------------------------------------------------
+
+    def add(self, status: Optional[str], score=None, variance=None):
+
+        if status in self.statuses:
+            self.statuses[status] += 1
+
+        if score is not None:
+            score = float(score)
+            index = min(max(int((score - self.low) / self.width), 0), self.bins - 1)
+            self.counts[index] += 1
+            self.score_sum += score
+            self.score_sq_sum += score * score
+
+        if variance is not None:
+            variance = float(variance)
+            self.variance_count += 1
+            self.variance_sum += variance
+            self.variance_sq_sum += variance * variance
+
+    def merge(self, other: "ScoreHistogram") -> "ScoreHistogram":
+
+        other = self._aligned(other, "merge")
+
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+
+        for status, n in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + n
+
+        self.score_sum += other.score_sum
+        self.score_sq_sum += other.score_sq_sum
+
+        self.variance_count += other.variance_count
+        self.variance_sum += other.variance_sum
+        self.variance_sq_sum += other.variance_sq_sum
+
+        return self
+
+    def subtract(self, other: "ScoreHistogram") -> "ScoreHistogram":
+
+        other = self._aligned(other, "subtract")
+
+        self.counts = [max(a - b, 0) for a, b in zip(self.counts, other.counts)]
+
+        for status, n in other.statuses.items():
+            self.statuses[status] = max(self.statuses.get(status, 0) - n, 0)
+
+        self.score_sum -= other.score_sum
+        self.score_sq_sum -= other.score_sq_sum
+
+        self.variance_count = max(self.variance_count - other.variance_count, 0)
+        self.variance_sum -= other.variance_sum
+        self.variance_sq_sum -= other.variance_sq_sum
+
+        return self
+
+    # -------------------------------------------------
+    # Queries
+    # -------------------------------------------------
+
+    @staticmethod
+    def _moments(n: int, total: float, sq_total: float) -> tuple:
+        if not n:
+            return None, None
+        mean = total / n
+        return mean, max(sq_total / n - mean * mean, 0.0)
+
+    def fraction_below(self, threshold: float) -> Optional[float]:
+        """
+        Share of scores below `threshold`, interpolated linearly inside
+        the bin that contains it.
+        """
+
+        n = self.count
+
+        if not n:
+            return None
+
+        position = (threshold - self.low) / self.width
+        full = min(max(int(position), 0), self.bins)
+
+        below = sum(self.counts[:full])
+
+        if full < self.bins and position > full:
+            below += self.counts[full] * (position - full)
+
+        return below / n
+
+    def quantile(self, q: float) -> Optional[float]:
+
+        n = self.count
+
+        if not n:
+            return None
+
+        rank = q * n
+        cumulative = 0
+
+        for i, c in enumerate(self.counts):
+            if c and cumulative + c >= rank:
+                return self.low + (i + (rank - cumulative) / c) * self.width
+            cumulative += c
+
+        return self.high
+
+    def summary(self, digits: int = 4) -> dict:
+
+        mean, var = self._moments(self.count, self.score_sum, self.score_sq_sum)
+        v_mean, v_var = self._moments(self.variance_count, self.variance_sum, self.variance_sq_sum)
+
+        def r(x, digits=digits):
+            return round(x, digits) if x is not None else None
+
+        return {
+            "scored": self.count,
+            **self.statuses,
+            "mean": r(mean),
+            "std": r(math.sqrt(var)) if var is not None else None,
+            "p50": r(self.quantile(0.5)),
+            "p90": r(self.quantile(0.9)),
+            # Ensemble variances are small; keep more precision
+            "ensemble_variance_mean": r(v_mean, digits + 2),
+            "ensemble_variance_variance": r(v_var, digits + 4),
+        }
+
+    # -------------------------------------------------
+    # Serialisation
+    # -------------------------------------------------
+
+    def to_dict(self) -> dict:
+        return {
+            "bins": self.bins,
+            "range": [self.low, self.high],
+            "counts": self.counts,
+            "statuses": self.statuses,
+            "score": [self.score_sum, self.score_sq_sum],
+            "variance": [self.variance_count, self.variance_sum, self.variance_sq_sum],
+        }
+
+    @classmethod
+    def from_dict(cls, d: Optional[dict]) -> "ScoreHistogram":
+
+        if not d:
+            return cls()
+
+        low, high = d.get("range", SCORE_RANGE)
+        hist = cls(bins=d.get("bins", SCORE_BINS), low=low, high=high)
+
+        hist.counts = list(d.get("counts") or hist.counts)
+        hist.statuses.update(d.get("statuses") or {})
+        hist.score_sum, hist.score_sq_sum = d.get("score", [0.0, 0.0])
+        hist.variance_count, hist.variance_sum, hist.variance_sq_sum = d.get("variance", [0, 0.0, 0.0])
+
+        return hist
+
+
+def population_stability_index(expected: ScoreHistogram, actual: ScoreHistogram, epsilon: float = 1e-4) -> Optional[float]:
+    """
+    PSI between two score histograms (same bins; `actual` is rescaled
+    onto `expected`'s range). Rule of thumb: < 0.1 stable, 0.1-0.25
+    moderate shift, > 0.25 significant drift.
+    """
+
+    n_expected, n_actual = expected.count, actual.count
+
+    if not n_expected or not n_actual:
+        return None
+
+    if (actual.low, actual.high) != (expected.low, expected.high):
+        actual = actual.rescaled(expected.low, expected.high)
+
+    psi = 0.0
+
+    for e, a in zip(expected.counts, actual.counts):
+        e = max(e / n_expected, epsilon)
+        a = max(a / n_actual, epsilon)
+        psi += (a - e) * math.log(a / e)
+
+    return psi
@@ -68,6 +68,25 @@ def create_evaluator(payload: dict):
         sampling_rate = float(execution.get("sampling_rate", 1.0))
         variance_threshold = float(execution.get("variance_threshold", 0.1))
 
+        # Scale the evaluator scores on, for the score histograms
+        score_range = execution.get("score_range", [0.0, 1.0])
+
+        if (
+            not isinstance(score_range, (list, tuple))
+            or len(score_range) != 2
+            or not all(isinstance(v, (int, float)) for v in score_range)
+            or score_range[0] >= score_range[1]
+        ):
+            raise HTTPException(400, "score_range must be [low, high] with low < high")
+
+        score_range = [float(v) for v in score_range]
+
+        # "deferred" runs through the provider batch API (BatchPoller)
+        execution_mode = execution.get("execution_mode", "inline")
+
+        if execution_mode not in ("inline", "deferred"):
+            raise HTTPException(400, "execution_mode must be 'inline' or 'deferred'")
+
         # 🔹 NEW: read requires_context
         requires_context = bool(execution.get("requires_context", False))
 
@@ -102,6 +121,8 @@ def create_evaluator(payload: dict):
             "variance_threshold": variance_threshold,
             "ensemble_deployments": ensemble_deployments,
             "requires_context": requires_context,  # ← added
+            "score_range": score_range,
+            "execution_mode": execution_mode,
         }
 
         # ---------------------------
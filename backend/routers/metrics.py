@@ -1,5 +1,16 @@
+import heapq
 import math
-from fastapi import APIRouter, HTTPException
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from azure.cosmos import exceptions
+from fastapi import APIRouter, HTTPException, Query
+
+from shared.aggregates import MetricsAggregate
+from shared.cube import CUBE_PK, GROUPABLE, MEASURES, slice_cube, summarize
+from shared.sketches import ScoreHistogram, population_stability_index
+from shared.queries import select
 
 from shared.cosmos import (
     metrics_container_read as metrics_container,
@@ -11,6 +22,16 @@ router = APIRouter()
 
 METRICS_ID = "metrics_snapshot"
 METRICS_PK = "metrics_snapshot"
+ROUTING_PK = "llm_routing"
+
+ROLLUP_GRANULARITIES = ("minute", "hour", "day")
+BUCKET_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# Pivots with more groups than this are rejected instead of returned
+CUBE_MAX_GROUPS = 5000
+
+LEADERBOARD_PK = "leaderboard"
+LEADERBOARDS = ("cost", "latency", "tokens", "lowest_score")
 
 
 # -----------------------------
@@ -48,6 +69,490 @@ def get_metrics():
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# -----------------------------
+# GET /metrics/llm-routing
+# -----------------------------
+@router.get("/metrics/llm-routing")
+def get_llm_routing():
+    """
+    Circuit-breaker state and routing decisions, one entry per
+    EvaluatorRunner worker instance.
+    """
+    try:
+        docs = list(
+            metrics_container.query_items(
+                query="SELECT * FROM c WHERE c.partitionKey=@pk",
+                parameters=[{"name": "@pk", "value": ROUTING_PK}],
+                partition_key=ROUTING_PK,
+            )
+        )
+
+        return scrub([strip_cosmos_metadata(d) for d in docs])
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# -----------------------------
+# GET /metrics/rollups
+# -----------------------------
+def parse_bucket_time(value: str) -> datetime:
+    try:
+        ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid timestamp: {value}")
+    return ts.astimezone(timezone.utc) if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def load_rollups(granularity: str, start: datetime, end: datetime, projection: str = "c.aggregate") -> list:
+    """
+    Rollup docs of one granularity whose bucket starts in [start, end).
+    """
+    pk = f"rollup:{granularity}"
+
+    return list(
+        metrics_container.query_items(
+            query=(
+                f"SELECT c.bucket, {projection} FROM c "
+                "WHERE c.partitionKey=@pk AND c.bucket >= @start AND c.bucket < @end "
+                "ORDER BY c.bucket"
+            ),
+            parameters=[
+                {"name": "@pk", "value": pk},
+                {"name": "@start", "value": start.strftime(BUCKET_FORMAT)},
+                {"name": "@end", "value": end.strftime(BUCKET_FORMAT)},
+            ],
+            partition_key=pk,
+        )
+    )
+
+
+def rollup_range(granularity: str, start: Optional[str], end: Optional[str]) -> tuple:
+    """
+    Validated (start, end) for a rollup query, default the last 7 days.
+    """
+    if granularity not in ROLLUP_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {ROLLUP_GRANULARITIES}")
+
+    end_ts = parse_bucket_time(end) if end else datetime.now(timezone.utc)
+    start_ts = parse_bucket_time(start) if start else end_ts - timedelta(days=7)
+
+    if start_ts >= end_ts:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    return start_ts, end_ts
+
+
+@router.get("/metrics/rollups")
+def get_rollups(
+    granularity: str = Query("hour"),
+    start: Optional[str] = Query(None, description="ISO timestamp, default end - 7 days"),
+    end: Optional[str] = Query(None, description="ISO timestamp, default now"),
+    series: bool = Query(True, description="Include per-bucket metrics"),
+):
+    """
+    Metrics over a time range, merged from rollup buckets.
+    "Last 7 days" at hour granularity reads ~168 small documents.
+    """
+    start_ts, end_ts = rollup_range(granularity, start, end)
+
+    try:
+        docs = load_rollups(granularity, start_ts, end_ts)
+
+        total = MetricsAggregate()
+        buckets = []
+
+        for doc in docs:
+            agg = MetricsAggregate.from_dict(doc.get("aggregate"))
+            total.merge(agg)
+
+            if series:
+                buckets.append({"bucket": doc["bucket"], **agg.snapshot()})
+
+        return scrub({
+            "granularity": granularity,
+            "start": start_ts.isoformat(),
+            "end": end_ts.isoformat(),
+            "bucket_count": len(docs),
+            "total": total.snapshot(),
+            "buckets": buckets,
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# -----------------------------
+# GET /metrics/latency
+# -----------------------------
+LATENCY_DIMENSIONS = {
+    "model": "latency_by_model",
+    "trace_name": "latency_by_trace_name",
+    "span_type": "span_latency_by_type",
+}
+
+
+@router.get("/metrics/latency")
+def get_latency_percentiles(
+    granularity: str = Query("hour"),
+    start: Optional[str] = Query(None, description="ISO timestamp, default end - 7 days"),
+    end: Optional[str] = Query(None, description="ISO timestamp, default now"),
+    by: Optional[str] = Query(None, description="model | trace_name | span_type"),
+):
+    """
+    Latency percentiles (p50/p90/p95/p99, ms) over a time range, merged
+    from the DDSketches in the rollup buckets (~1% relative error).
+    """
+    if by is not None and by not in LATENCY_DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"by must be one of {list(LATENCY_DIMENSIONS)}")
+
+    start_ts, end_ts = rollup_range(granularity, start, end)
+
+    try:
+        total = MetricsAggregate()
+
+        for doc in load_rollups(granularity, start_ts, end_ts):
+            total.merge(MetricsAggregate.from_dict(doc.get("aggregate")))
+
+        result = {
+            "granularity": granularity,
+            "start": start_ts.isoformat(),
+            "end": end_ts.isoformat(),
+            "overall": total.latency.summary(),
+        }
+
+        if by:
+            sketches = getattr(total, LATENCY_DIMENSIONS[by])
+            result["by"] = by
+            result["breakdown"] = {k: v.summary() for k, v in sorted(sketches.items())}
+
+        return scrub(result)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# -----------------------------
+# GET /metrics/distinct
+# -----------------------------
+@router.get("/metrics/distinct")
+def get_distinct_counts(
+    granularity: str = Query("hour"),
+    start: Optional[str] = Query(None, description="ISO timestamp, default end - 7 days"),
+    end: Optional[str] = Query(None, description="ISO timestamp, default now"),
+):
+    """
+    Unique users / sessions / applications over a time range, overall and
+    per application, from the HyperLogLog sketches in the rollup buckets.
+    """
+    start_ts, end_ts = rollup_range(granularity, start, end)
+
+    try:
+        total = MetricsAggregate()
+
+        for doc in load_rollups(granularity, start_ts, end_ts):
+            total.merge(MetricsAggregate.from_dict(doc.get("aggregate")))
+
+        applications = sorted(set(total.users_by_application) | set(total.sessions_by_application))
+
+        return scrub({
+            "granularity": granularity,
+            "start": start_ts.isoformat(),
+            "end": end_ts.isoformat(),
+            "relative_error": round(total.users.relative_error, 4),
+            "unique_users": total.users.count(),
+            "unique_sessions": total.sessions.count(),
+            "unique_applications": total.applications.count(),
+            "by_application": {
+                app: {
+                    "unique_users": total.users_by_application[app].count(),
+                    "unique_sessions": total.sessions_by_application[app].count(),
+                }
+                for app in applications
+            },
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# -----------------------------
+# GET /metrics/cube
+# -----------------------------
+def parse_day(value: str) -> str:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid day: {value}")
+
+
+@router.get("/metrics/cube")
+def get_cube(
+    group_by: str = Query("model", description=f"Comma-separated subset of {GROUPABLE}"),
+    filter: List[str] = Query([], description="dimension:value, repeatable; values of one dimension are OR'ed"),
+    start: Optional[str] = Query(None, description="YYYY-MM-DD, default end - 6 days"),
+    end: Optional[str] = Query(None, description="YYYY-MM-DD, default today"),
+    order_by: str = Query("cost"),
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """
+    Slice-and-dice over the pre-aggregated trace cube, e.g.
+    cost by model x environment x intent for one application:
+    ?group_by=model,environment,intent&filter=application:X
+    """
+    dimensions = [d.strip() for d in group_by.split(",") if d.strip()]
+
+    unknown = [d for d in dimensions if d not in GROUPABLE]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by dimensions {unknown}; use {GROUPABLE}")
+
+    filters = {}
+    for f in filter:
+        dimension, sep, value = f.partition(":")
+        if not sep or dimension not in GROUPABLE:
+            raise HTTPException(status_code=400, detail=f"Invalid filter '{f}'; use dimension:value with {GROUPABLE}")
+        filters.setdefault(dimension, set()).add(value)
+
+    if order_by not in MEASURES and order_by not in ("avg_latency_ms", "error_rate"):
+        raise HTTPException(status_code=400, detail="order_by must be a measure")
+
+    end_day = parse_day(end) if end else datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    start_day = parse_day(start) if start else (
+        datetime.strptime(end_day, "%Y-%m-%d") - timedelta(days=6)
+    ).strftime("%Y-%m-%d")
+
+    if start_day > end_day:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+
+    try:
+        docs = list(
+            metrics_container.query_items(
+                query=(
+                    "SELECT c.day, c.cells FROM c "
+                    "WHERE c.partitionKey=@pk AND c.day >= @start AND c.day <= @end"
+                ),
+                parameters=[
+                    {"name": "@pk", "value": CUBE_PK},
+                    {"name": "@start", "value": start_day},
+                    {"name": "@end", "value": end_day},
+                ],
+                partition_key=CUBE_PK,
+            )
+        )
+
+        groups = slice_cube(docs, dimensions, filters)
+
+        if len(groups) > CUBE_MAX_GROUPS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"{len(groups)} groups exceed the limit of {CUBE_MAX_GROUPS}; add filters or group by fewer dimensions"
+            )
+
+        rows = [
+            {**dict(zip(dimensions, group)), **summarize(totals)}
+            for group, totals in groups.items()
+        ]
+        rows.sort(key=lambda r: r[order_by] if r[order_by] is not None else -1, reverse=True)
+
+        return scrub({
+            "group_by": dimensions,
+            "filters": {d: sorted(v) for d, v in filters.items()},
+            "start": start_day,
+            "end": end_day,
+            "days": len(docs),
+            "group_count": len(rows),
+            "truncated": len(rows) > limit,
+            "rows": rows[:limit],
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# -----------------------------
+# GET /metrics/evaluators/{evaluator_id}/distribution
+# -----------------------------
+def histogram_report(hist: ScoreHistogram, threshold: float) -> dict:
+    below = hist.fraction_below(threshold)
+    return {
+        **hist.summary(),
+        "below_threshold_rate": round(below, 4) if below is not None else None,
+    }
+
+
+@router.get("/metrics/evaluators/{evaluator_id}/distribution")
+def get_evaluator_distribution(
+    evaluator_id: str,
+    granularity: str = Query("hour"),
+    start: Optional[str] = Query(None, description="ISO timestamp, default end - 7 days"),
+    end: Optional[str] = Query(None, description="ISO timestamp, default now"),
+    threshold: float = Query(0.5, description="Score threshold for crossing rates"),
+    model: Optional[str] = Query(None, description="Only this evaluator deployment (set)"),
+    baseline_end: Optional[str] = Query(None, description="ISO timestamp splitting baseline / current, default mid-range"),
+):
+    """
+    Score distribution, drift and threshold-crossing rates for one
+    evaluator, merged from the score histograms in the rollup buckets.
+    Drift compares the buckets before `baseline_end` with those after it.
+    """
+    start_ts, end_ts = rollup_range(granularity, start, end)
+    split_ts = parse_bucket_time(baseline_end) if baseline_end else start_ts + (end_ts - start_ts) / 2
+
+    try:
+        docs = load_rollups(granularity, start_ts, end_ts, "c.aggregate.score_histograms AS score_histograms")
+
+        overall = ScoreHistogram()
+        by_model = defaultdict(ScoreHistogram)
+        baseline, current = ScoreHistogram(), ScoreHistogram()
+        series = []
+
+        for doc in docs:
+
+            bucket_hist = ScoreHistogram()
+
+            for m, h in ((doc.get("score_histograms") or {}).get(evaluator_id) or {}).items():
+                if model and m != model:
+                    continue
+                h = ScoreHistogram.from_dict(h)
+                by_model[m].merge(h)
+                bucket_hist.merge(h)
+
+            if not (bucket_hist.count or any(bucket_hist.statuses.values())):
+                continue
+
+            overall.merge(bucket_hist)
+            (baseline if parse_bucket_time(doc["bucket"]) < split_ts else current).merge(bucket_hist)
+
+            below = bucket_hist.fraction_below(threshold)
+            series.append({
+                "bucket": doc["bucket"],
+                "scored": bucket_hist.count,
+                "mean": round(bucket_hist.score_sum / bucket_hist.count, 4) if bucket_hist.count else None,
+                "below_threshold_rate": round(below, 4) if below is not None else None,
+                **{k: v for k, v in bucket_hist.statuses.items() if k in ("failed", "skipped", "unstable")},
+            })
+
+        psi = population_stability_index(baseline, current)
+        baseline_summary, current_summary = baseline.summary(), current.summary()
+
+        return scrub({
+            "evaluator_id": evaluator_id,
+            "granularity": granularity,
+            "start": start_ts.isoformat(),
+            "end": end_ts.isoformat(),
+            "threshold": threshold,
+            "score_range": [overall.low, overall.high],
+            "bin_edges": overall.edges(),
+            "counts": overall.counts,
+            "overall": histogram_report(overall, threshold),
+            "by_model": {m: histogram_report(h, threshold) for m, h in sorted(by_model.items())},
+            "drift": {
+                "split": split_ts.isoformat(),
+                "baseline": histogram_report(baseline, threshold),
+                "current": histogram_report(current, threshold),
+                "psi": round(psi, 4) if psi is not None else None,
+                "mean_shift": (
+                    round(current_summary["mean"] - baseline_summary["mean"], 4)
+                    if current_summary["mean"] is not None and baseline_summary["mean"] is not None
+                    else None
+                ),
+            },
+            "series": series,
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# -----------------------------
+# GET /metrics/leaderboards/{board}
+# -----------------------------
+def top_entries(entry_lists: list, limit: int, lowest: bool) -> list:
+    """
+    Top entries across day boards; a trace on several days keeps its
+    most extreme value.
+    """
+    best = {}
+
+    for entries in entry_lists:
+        for value, trace_id, label in entries:
+            current = best.get(trace_id)
+            if current is None or (value < current[0] if lowest else value > current[0]):
+                best[trace_id] = (value, trace_id, label)
+
+    pick = heapq.nsmallest if lowest else heapq.nlargest
+
+    return [
+        {"value": value, "trace_id": trace_id, "label": label}
+        for value, trace_id, label in pick(limit, best.values(), key=lambda e: e[0])
+    ]
+
+
+@router.get("/metrics/leaderboards/{board}")
+def get_leaderboard(
+    board: str,
+    day: Optional[str] = Query(None, description="YYYY-MM-DD, last day of the window, default today"),
+    days: int = Query(1, ge=1, le=31),
+    limit: int = Query(50, ge=1, le=100),
+    evaluator_id: Optional[str] = Query(None, description="lowest_score only; default all evaluators"),
+):
+    """
+    Top traces by cost / latency / tokens, or the lowest-scored traces
+    per evaluator, from the daily leaderboard docs. One day is a single
+    point read. Labels are the trace name, or the evaluation status for
+    lowest_score.
+    """
+    if board not in LEADERBOARDS:
+        raise HTTPException(status_code=400, detail=f"board must be one of {LEADERBOARDS}")
+
+    end_day = parse_day(day) if day else datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    day_list = [
+        (datetime.strptime(end_day, "%Y-%m-%d") - timedelta(days=i)).strftime("%Y-%m-%d")
+        for i in range(days)
+    ]
+
+    try:
+        docs = []
+
+        for d in day_list:
+            try:
+                docs.append(metrics_container.read_item(item=f"{LEADERBOARD_PK}:{d}", partition_key=LEADERBOARD_PK))
+            except exceptions.CosmosResourceNotFoundError:
+                continue
+
+        result = {"board": board, "start": day_list[-1], "end": end_day, "days": len(docs)}
+
+        if board == "lowest_score":
+            evaluators = defaultdict(list)
+            for doc in docs:
+                for ev, entries in (doc.get("lowest_score") or {}).items():
+                    if evaluator_id is None or ev == evaluator_id:
+                        evaluators[ev].append(entries)
+
+            result["evaluators"] = {
+                ev: top_entries(lists, limit, lowest=True) for ev, lists in sorted(evaluators.items())
+            }
+        else:
+            result["entries"] = top_entries([(doc.get("boards") or {}).get(board, []) for doc in docs], limit, lowest=False)
+
+        return scrub(result)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # -----------------------------
 # GET /metrics/evaluators/{evaluator_id}/traces
 # -----------------------------
@@ -59,12 +564,11 @@ def get_traces_for_evaluator(evaluator_id: str):
         # ------------------------------------
         # Fetch evaluations for evaluator
         # ------------------------------------
-        evaluations = list(
-            evaluations_container.query_items(
-                query="SELECT * FROM c WHERE c.evaluator_id=@eid",
-                parameters=[{"name": "@eid", "value": evaluator_id}],
-                enable_cross_partition_query=True,
-            )
+        evaluations = select(
+            evaluations_container,
+            ["c.trace_id", "c.score", "c.variance", "c.unstable", "c.evaluation_cost_usd"],
+            where="c.evaluator_id=@eid",
+            parameters=[{"name": "@eid", "value": evaluator_id}],
         )
 
         if not evaluations:
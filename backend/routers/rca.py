@@ -11,7 +11,8 @@ def get_rca(trace_id: str):
     try:
         items = list(
             rca_container.query_items(
-                query="SELECT * FROM c WHERE c.trace_id=@tid",
+                # Skip the trace's readiness record (type "readiness")
+                query="SELECT * FROM c WHERE c.trace_id=@tid AND NOT IS_DEFINED(c.type)",
                 parameters=[{"name": "@tid", "value": trace_id}],
                 enable_cross_partition_query=True,
             )
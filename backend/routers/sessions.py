@@ -4,6 +4,7 @@ from collections import defaultdict
 from fastapi import APIRouter, HTTPException
 from shared.cosmos import traces_container_read as traces_container
 from shared.cosmos import evaluations_read as evaluations_container
+from shared.queries import group_by, select
 
 SESSION_IDLE_TIMEOUT = 5 * 60
 router = APIRouter()
@@ -52,24 +53,40 @@ def ts_to_iso(ts):
 def list_sessions():
     try:
 
-        traces = list(
-            traces_container.query_items(
-                query="SELECT * FROM c",
-                enable_cross_partition_query=True,
-            )
+        # Per-session sums / counts, pushed down to Cosmos where possible
+        sessions = group_by(
+            traces_container,
+            keys={"session_id": "c.session.session_id"},
+            aggregates={
+                "trace_count": ("COUNT", None),
+                "total_tokens": ("SUM", "c.usage.total_tokens"),
+                "generation_cost_usd": ("SUM", "c.cost.total_cost_usd"),
+                "latency_sum": ("SUM", "c.performance.latency_ms"),
+                "created": ("MIN", "c.request.timestamp"),
+                "last_activity": ("MAX", "c.request.timestamp"),
+                "user_id": ("MAX", "c.session.user_id"),
+                "environment": ("MAX", "c.request.environment"),
+            },
         )
 
-        if not traces:
-            return []
+        sessions = [s for s in sessions if s["session_id"]]
 
-        trace_ids = [t.get("trace_id") for t in traces if t.get("trace_id")]
+        if not sessions:
+            return []
 
-        evaluations = list(
-            evaluations_container.query_items(
-                query="SELECT * FROM c WHERE ARRAY_CONTAINS(@trace_ids, c.trace_id)",
-                parameters=[{"name": "@trace_ids", "value": trace_ids}],
-                enable_cross_partition_query=True,
+        trace_sessions = {
+            t["trace_id"]: t["session_id"]
+            for t in select(
+                traces_container,
+                ["c.trace_id", "c.session.session_id AS session_id"],
+                where="IS_DEFINED(c.session.session_id)",
             )
+            if t.get("trace_id")
+        }
+
+        evaluations = select(
+            evaluations_container,
+            ["c.trace_id", "c.evaluator", "c.score", "c.evaluation_cost_usd"],
         )
 
         trace_eval_cost = defaultdict(float)
@@ -82,84 +99,46 @@ def list_sessions():
             score = ev.get("score")
             cost = ev.get("evaluation_cost_usd", 0.0)
 
-            if tid:
-                trace_eval_cost[tid] += cost
+            if tid not in trace_sessions:
+                continue
 
-            if tid and evaluator and score is not None:
+            trace_eval_cost[tid] += cost
+
+            if evaluator and score is not None:
                 trace_eval_scores[tid][evaluator] = score
 
-        sessions = defaultdict(
+        session_eval = defaultdict(
             lambda: {
-                "session_id": None,
-                "user_id": "unknown",
-                "environment": None,
-                "trace_count": 0,
-                "total_tokens": 0,
-                "generation_cost_usd": 0.0,
                 "evaluation_cost_usd": 0.0,
-                "avg_latency_ms": 0.0,
-                "created": None,
-                "last_activity": None,
                 "eval_sum": defaultdict(float),
                 "eval_count": defaultdict(int),
             }
         )
 
-        for t in traces:
+        for tid, session_id in trace_sessions.items():
 
-            session_obj = t.get("session", {})
-            request_obj = t.get("request", {})
-            usage_obj = t.get("usage", {})
-            cost_obj = t.get("cost", {})
-            perf_obj = t.get("performance", {})
+            e = session_eval[session_id]
+            e["evaluation_cost_usd"] += trace_eval_cost.get(tid, 0.0)
 
-            session_id = session_obj.get("session_id")
-            trace_id = t.get("trace_id")
+            for ev_name, score in trace_eval_scores.get(tid, {}).items():
+                e["eval_sum"][ev_name] += score
+                e["eval_count"][ev_name] += 1
 
-            if not session_id:
-                continue
-
-            s = sessions[session_id]
-
-            s["session_id"] = session_id
-            s["user_id"] = session_obj.get("user_id", "unknown")
-            s["environment"] = request_obj.get("environment")
-
-            s["trace_count"] += 1
-            s["total_tokens"] += usage_obj.get("total_tokens", 0)
-
-            gen_cost = cost_obj.get("total_cost_usd", 0.0)
-            eval_cost = trace_eval_cost.get(trace_id, 0.0)
-
-            s["generation_cost_usd"] += gen_cost
-            s["evaluation_cost_usd"] += eval_cost
-
-            s["avg_latency_ms"] += perf_obj.get("latency_ms", 0)
-
-            for ev_name, score in trace_eval_scores.get(trace_id, {}).items():
-                s["eval_sum"][ev_name] += score
-                s["eval_count"][ev_name] += 1
-
-            ts = normalize_ts(request_obj.get("timestamp"))
-
-            if ts is not None:
-
-                if s["created"] is None or ts < s["created"]:
-                    s["created"] = ts
-
-                if s["last_activity"] is None or ts > s["last_activity"]:
-                    s["last_activity"] = ts
+        for s in sessions:
+            s["user_id"] = s["user_id"] or "unknown"
+            s["created"] = normalize_ts(s["created"])
+            s["last_activity"] = normalize_ts(s["last_activity"])
+            s.update(session_eval[s["session_id"]])
 
         now_sec = datetime.now(timezone.utc).timestamp()
 
         results = []
 
-        for s in sessions.values():
+        for s in sessions:
 
-            if s["trace_count"] > 0:
-                s["avg_latency_ms"] = safe_round(
-                    s["avg_latency_ms"] / s["trace_count"], 2
-                )
+            s["avg_latency_ms"] = safe_round(
+                s["latency_sum"] / s["trace_count"], 2
+            )
 
             avg_scores = {}
 
@@ -237,12 +216,11 @@ def get_session(session_id: str):
 
         trace_ids = [t.get("trace_id") for t in traces if t.get("trace_id")]
 
-        evaluations = list(
-            evaluations_container.query_items(
-                query="SELECT * FROM c WHERE ARRAY_CONTAINS(@trace_ids, c.trace_id)",
-                parameters=[{"name": "@trace_ids", "value": trace_ids}],
-                enable_cross_partition_query=True,
-            )
+        evaluations = select(
+            evaluations_container,
+            ["c.trace_id", "c.evaluator", "c.score", "c.evaluation_cost_usd"],
+            where="ARRAY_CONTAINS(@trace_ids, c.trace_id)",
+            parameters=[{"name": "@trace_ids", "value": trace_ids}],
         )
 
         trace_eval_cost = defaultdict(float)
@@ -46,6 +46,117 @@ def extract_variables(template_text: str):
     )
 
 
+JINJA_MARKERS = ("{{", "{%", "{#")
+
+# Rough offline estimate; providers only cache prompt heads past ~1024 tokens
+CHARS_PER_TOKEN = 4
+MIN_CACHEABLE_PREFIX_TOKENS = 1024
+
+
+def check_prefix_stability(prefix: str, template_text: str) -> dict:
+    """
+    Check that the prompt head is identical for every trace so provider
+    prefix caching can hit: the static prefix must not contain template
+    syntax, and instructions should not trail the trace variables.
+    """
+    if prefix and any(marker in prefix for marker in JINJA_MARKERS):
+        raise HTTPException(
+            status_code=400,
+            detail="prefix must be static text; move template variables into the template body",
+        )
+
+    positions = [template_text.find(m) for m in JINJA_MARKERS if m in template_text]
+    first_dynamic = min(positions) if positions else len(template_text)
+    last_dynamic = max(template_text.rfind("}}"), template_text.rfind("%}"))
+
+    static_head = (prefix or "") + template_text[:first_dynamic]
+    trailing_static = template_text[last_dynamic + 2:] if last_dynamic >= 0 else ""
+
+    static_prefix_tokens = len(static_head) // CHARS_PER_TOKEN
+
+    warnings = []
+
+    if len(trailing_static.strip()) > len(template_text[:first_dynamic].strip()) and not prefix:
+        warnings.append("instructions follow the trace variables; move them into prefix so they can be cached")
+
+    if static_prefix_tokens < MIN_CACHEABLE_PREFIX_TOKENS:
+        warnings.append(
+            f"static prefix is ~{static_prefix_tokens} tokens; providers cache prompt heads of "
+            f"{MIN_CACHEABLE_PREFIX_TOKENS}+ tokens"
+        )
+
+    return {
+        "stable": not any("follow the trace variables" in w for w in warnings),
+        "static_prefix_tokens": static_prefix_tokens,
+        "warnings": warnings,
+    }
+
+
+CONTEXT_STRATEGIES = {"retrieval_score", "answer_similarity", "head_tail"}
+
+
+def validate_context_budget(budget):
+    if not budget:
+        return None
+
+    if not isinstance(budget, dict):
+        raise HTTPException(status_code=400, detail="context_budget must be an object")
+
+    try:
+        max_tokens = int(budget.get("max_tokens"))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="context_budget.max_tokens must be an integer")
+
+    if max_tokens <= 0:
+        raise HTTPException(status_code=400, detail="context_budget.max_tokens must be positive")
+
+    strategy = budget.get("strategy", "retrieval_score")
+
+    if strategy not in CONTEXT_STRATEGIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"context_budget.strategy must be one of {sorted(CONTEXT_STRATEGIES)}",
+        )
+
+    return {"max_tokens": max_tokens, "strategy": strategy}
+
+
+SCORING_MODES = {"text", "logprobs"}
+
+
+def validate_scoring(scoring):
+    """
+    Validate the optional scoring block.
+    logprobs mode needs a non-empty label set: either a mapping of
+    label -> numeric value or a list of labels.
+    """
+    if not scoring:
+        return None
+
+    if not isinstance(scoring, dict):
+        raise HTTPException(status_code=400, detail="scoring must be an object")
+
+    mode = scoring.get("mode", "text")
+
+    if mode not in SCORING_MODES:
+        raise HTTPException(status_code=400, detail=f"scoring.mode must be one of {sorted(SCORING_MODES)}")
+
+    labels = scoring.get("labels")
+
+    if mode == "logprobs":
+
+        if not labels or not isinstance(labels, (dict, list)):
+            raise HTTPException(status_code=400, detail="scoring.labels is required for logprobs mode")
+
+        if isinstance(labels, dict):
+            try:
+                labels = {str(k): float(v) for k, v in labels.items()}
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="scoring.labels values must be numeric")
+
+    return {"mode": mode, "labels": labels} if labels else {"mode": mode}
+
+
 # ---------------------------------------------------------
 # GET ALL TEMPLATES
 # ---------------------------------------------------------
@@ -68,7 +179,11 @@ def get_templates():
                 "description": t.get("description"),
                 "model": t.get("model"),
                 "inputs": t.get("inputs", []),  # 🔥 now auto-generated
+                "prefix": t.get("prefix"),
                 "template": t.get("template"),
+                "scoring": t.get("scoring"),
+                "context_budget": t.get("context_budget"),
+                "prefix_check": t.get("prefix_check"),
                 "updated_at": t.get("updated_at"),
             }
             for t in items
@@ -122,6 +237,12 @@ def create_template(payload: dict):
 
         template_id = payload.get("template_id") or make_template_id(name)
 
+        scoring = validate_scoring(payload.get("scoring"))
+        context_budget = validate_context_budget(payload.get("context_budget"))
+
+        prefix = payload.get("prefix") or ""
+        prefix_check = check_prefix_stability(prefix, template_text)
+
         # 🔥 AUTO EXTRACT VARIABLES
         extracted_inputs = extract_variables(template_text)
 
@@ -136,10 +257,18 @@ def create_template(payload: dict):
             # 🔥 THIS IS THE FIX
             "inputs": extracted_inputs,
 
+            "prefix": prefix,
             "template": template_text,
+            "prefix_check": prefix_check,
             "updated_at": datetime.utcnow().isoformat(),
         }
 
+        if scoring:
+            doc["scoring"] = scoring
+
+        if context_budget:
+            doc["context_budget"] = context_budget
+
         templates_container.create_item(doc)
 
         audit_log(
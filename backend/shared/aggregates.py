@@ -0,0 +1,322 @@
+"""
+Mergeable metrics aggregates, read side.
+
+✔ Same MetricsAggregate the Functions app writes into rollup docs
+  (keep in sync with azure-functions/shared/aggregates.py)
+✔ merge() rollup buckets at query time, snapshot() for the response
+"""
+
+from collections import defaultdict
+from typing import Optional
+
+from shared.sketches import SCORE_RANGE, DDSketch, HyperLogLog, ScoreHistogram
+
+
+# Evaluations still waiting on a batch job are not scored yet
+UNSCORED_STATUSES = {"pending"}
+
+
+# =====================================================
+# Aggregate
+# =====================================================
+
+def _sum_into(target: dict, source: dict):
+    for k, v in source.items():
+        target[k] += v
+
+
+def _distinct_from(value) -> HyperLogLog:
+    # State docs written before the sketches hold plain id lists
+    if isinstance(value, list):
+        hll = HyperLogLog()
+        for item in value:
+            hll.add(item)
+        return hll
+    return HyperLogLog.from_dict(value)
+
+
+def _evaluator_model(e: dict) -> str:
+    # Ensembles are keyed by their full deployment set
+    return ",".join(e.get("deployments_used") or []) or "unknown"
+
+
+class MetricsAggregate:
+
+    COUNTERS = ("total_traces", "total_tokens", "total_cost", "total_latency")
+
+    BREAKDOWNS = (
+        "tokens_by_model",
+        "cost_by_model",
+        "trace_count_by_model",
+        "trace_count_by_name",
+        "cost_by_trace_name",
+        "tokens_by_trace_name",
+        "eval_score_sum",
+        "eval_count",
+    )
+
+    SKETCHES = (
+        "latency_by_model",
+        "latency_by_trace_name",
+        "span_latency_by_type",
+    )
+
+    DISTINCT = ("sessions", "users", "applications")
+
+    DISTINCT_BY_APPLICATION = ("sessions_by_application", "users_by_application")
+
+    def __init__(self):
+        self.total_traces = 0
+        self.total_tokens = 0
+        self.total_cost = 0.0
+        self.total_latency = 0
+
+        for name in self.BREAKDOWNS:
+            setattr(self, name, defaultdict(float))
+
+        # Latency quantile sketches (ms), overall and per dimension
+        self.latency = DDSketch()
+        for name in self.SKETCHES:
+            setattr(self, name, defaultdict(DDSketch))
+
+        # Score histograms per evaluator, per evaluator model(s)
+        self.score_histograms = defaultdict(lambda: defaultdict(ScoreHistogram))
+
+        # Distinct-count sketches, overall and per application
+        for name in self.DISTINCT:
+            setattr(self, name, HyperLogLog())
+        for name in self.DISTINCT_BY_APPLICATION:
+            setattr(self, name, defaultdict(HyperLogLog))
+
+    # -------------------------------------------------
+    # Updates
+    # -------------------------------------------------
+
+    def add_trace(self, t: dict):
+
+        usage = t.get("usage", {}) or {}
+        cost_obj = t.get("cost", {}) or {}
+        performance = t.get("performance", {}) or {}
+        model_info = t.get("model_info", {}) or {}
+        session_obj = t.get("session", {}) or {}
+
+        tokens = usage.get("total_tokens", 0) or 0
+        cost = cost_obj.get("total_cost_usd", 0.0) or 0.0
+        latency = performance.get("latency_ms", 0) or 0
+
+        self.total_traces += 1
+        self.total_tokens += tokens
+        self.total_cost += cost
+        self.total_latency += latency
+
+        model = model_info.get("model", "unknown")
+        self.tokens_by_model[model] += tokens
+        self.cost_by_model[model] += cost
+        self.trace_count_by_model[model] += 1
+
+        trace_name = t.get("trace_name", "unknown")
+        self.trace_count_by_name[trace_name] += 1
+        self.cost_by_trace_name[trace_name] += cost
+        self.tokens_by_trace_name[trace_name] += tokens
+
+        if performance.get("latency_ms") is not None:
+            self.latency.add(latency)
+            self.latency_by_model[model].add(latency)
+            self.latency_by_trace_name[trace_name].add(latency)
+
+        for span in t.get("spans") or []:
+            if isinstance(span, dict) and span.get("latency_ms") is not None:
+                self.span_latency_by_type[span.get("type") or "unknown"].add(span["latency_ms"])
+
+        application = t.get("application_name")
+        self.applications.add(application)
+        application = application or "unknown"
+
+        if session_obj.get("session_id"):
+            self.sessions.add(session_obj["session_id"])
+            self.sessions_by_application[application].add(session_obj["session_id"])
+
+        if session_obj.get("user_id"):
+            self.users.add(session_obj["user_id"])
+            self.users_by_application[application].add(session_obj["user_id"])
+
+    def add_evaluation(self, e: dict):
+
+        if not e.get("trace_id") or e.get("status") in UNSCORED_STATUSES:
+            return
+
+        evaluator_name = e.get("evaluator_id") or e.get("evaluator")
+        score = e.get("score")
+
+        if not evaluator_name:
+            return
+
+        # Bins span the evaluator's configured score range (stamped on the
+        # doc); a doc on another range than the histogram's, i.e. the
+        # config changed, is rescaled by merge()
+        low, high = e.get("score_range") or SCORE_RANGE
+        scored = ScoreHistogram(low=low, high=high)
+        scored.add(e.get("status"), score, e.get("variance"))
+        self.score_histograms[evaluator_name][_evaluator_model(e)].merge(scored)
+
+        if score is None:
+            return
+
+        self.eval_score_sum[evaluator_name] += score
+        self.eval_count[evaluator_name] += 1
+
+    def merge(self, other: "MetricsAggregate") -> "MetricsAggregate":
+
+        for name in self.COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+        for name in self.BREAKDOWNS:
+            _sum_into(getattr(self, name), getattr(other, name))
+
+        self.latency.merge(other.latency)
+        for name in self.SKETCHES:
+            mine = getattr(self, name)
+            for key, sketch in getattr(other, name).items():
+                mine[key].merge(sketch)
+
+        for evaluator_name, by_model in other.score_histograms.items():
+            for model, hist in by_model.items():
+                self.score_histograms[evaluator_name][model].merge(hist)
+
+        for name in self.DISTINCT:
+            getattr(self, name).merge(getattr(other, name))
+        for name in self.DISTINCT_BY_APPLICATION:
+            mine = getattr(self, name)
+            for key, hll in getattr(other, name).items():
+                mine[key].merge(hll)
+
+        return self
+
+    def subtract(self, other: "MetricsAggregate") -> "MetricsAggregate":
+        """
+        Retract an earlier contribution (see apply_docs). Distinct-count
+        sketches cannot forget values; re-adding the same ids is a no-op.
+        """
+
+        for name in self.COUNTERS:
+            setattr(self, name, getattr(self, name) - getattr(other, name))
+
+        for name in self.BREAKDOWNS:
+            mine = getattr(self, name)
+            for key, value in getattr(other, name).items():
+                mine[key] -= value
+                if abs(mine[key]) < 1e-9:
+                    del mine[key]
+
+        self.latency.subtract(other.latency)
+        for name in self.SKETCHES:
+            mine = getattr(self, name)
+            for key, sketch in getattr(other, name).items():
+                mine[key].subtract(sketch)
+                if not mine[key].count:
+                    del mine[key]
+
+        for evaluator_name, by_model in other.score_histograms.items():
+            for model, hist in by_model.items():
+                self.score_histograms[evaluator_name][model].subtract(hist)
+
+        return self
+
+    # -------------------------------------------------
+    # Serialisation
+    # -------------------------------------------------
+
+    def to_dict(self) -> dict:
+        return {
+            **{name: getattr(self, name) for name in self.COUNTERS},
+            **{name: dict(getattr(self, name)) for name in self.BREAKDOWNS},
+            "latency": self.latency.to_dict(),
+            **{name: {k: v.to_dict() for k, v in getattr(self, name).items()} for name in self.SKETCHES},
+            "score_histograms": {
+                ev: {m: h.to_dict() for m, h in by_model.items()}
+                for ev, by_model in self.score_histograms.items()
+            },
+            **{name: getattr(self, name).to_dict() for name in self.DISTINCT},
+            **{name: {k: v.to_dict() for k, v in getattr(self, name).items()} for name in self.DISTINCT_BY_APPLICATION},
+        }
+
+    @classmethod
+    def from_dict(cls, d: Optional[dict]) -> "MetricsAggregate":
+
+        agg = cls()
+
+        if not d:
+            return agg
+
+        for name in cls.COUNTERS:
+            setattr(agg, name, d.get(name, 0))
+
+        for name in cls.BREAKDOWNS:
+            _sum_into(getattr(agg, name), d.get(name) or {})
+
+        agg.latency = DDSketch.from_dict(d.get("latency"))
+        for name in cls.SKETCHES:
+            getattr(agg, name).update({k: DDSketch.from_dict(v) for k, v in (d.get(name) or {}).items()})
+
+        for ev, by_model in (d.get("score_histograms") or {}).items():
+            agg.score_histograms[ev].update({m: ScoreHistogram.from_dict(h) for m, h in by_model.items()})
+
+        for name in cls.DISTINCT:
+            setattr(agg, name, _distinct_from(d.get(name)))
+        for name in cls.DISTINCT_BY_APPLICATION:
+            getattr(agg, name).update({k: HyperLogLog.from_dict(v) for k, v in (d.get(name) or {}).items()})
+
+        return agg
+
+    # -------------------------------------------------
+    # Snapshot (same shape the dashboard already reads)
+    # -------------------------------------------------
+
+    def snapshot(self) -> dict:
+
+        evaluation_summary = {}
+
+        for evaluator_name, count in self.eval_count.items():
+            if count > 0:
+                evaluation_summary[evaluator_name] = {
+                    "count": int(count),
+                    "avg_score": round(self.eval_score_sum[evaluator_name] / count, 3)
+                }
+
+        total_sessions = self.sessions.count()
+
+        return {
+            "total_traces": self.total_traces,
+            "total_sessions": total_sessions,
+            "total_users": self.users.count(),
+            "total_applications": self.applications.count(),
+
+            "avg_traces_per_session": round(
+                self.total_traces / total_sessions, 2
+            ) if total_sessions else 0,
+
+            "avg_latency_ms": round(
+                self.total_latency / self.total_traces, 2
+            ) if self.total_traces else 0,
+
+            "total_tokens": self.total_tokens,
+            "total_cost": round(self.total_cost, 6),
+
+            "tokens_by_model": {k: int(v) for k, v in self.tokens_by_model.items()},
+            "cost_by_model": {k: round(v, 6) for k, v in self.cost_by_model.items()},
+            "trace_count_by_model": {k: int(v) for k, v in self.trace_count_by_model.items()},
+
+            "trace_count_by_name": {k: int(v) for k, v in self.trace_count_by_name.items()},
+            "cost_by_trace_name": {k: round(v, 6) for k, v in self.cost_by_trace_name.items()},
+            "tokens_by_trace_name": {k: int(v) for k, v in self.tokens_by_trace_name.items()},
+
+            "evaluation_summary": evaluation_summary,
+
+            "latency_percentiles": self.latency.percentiles(),
+            "latency_percentiles_by_model": {k: v.percentiles() for k, v in self.latency_by_model.items()},
+            "latency_percentiles_by_trace_name": {k: v.percentiles() for k, v in self.latency_by_trace_name.items()},
+            "span_latency_percentiles_by_type": {k: v.percentiles() for k, v in self.span_latency_by_type.items()},
+
+            "sessions_by_application": {k: v.count() for k, v in self.sessions_by_application.items()},
+            "users_by_application": {k: v.count() for k, v in self.users_by_application.items()},
+        }
@@ -0,0 +1,66 @@
+"""
+Dimensional trace metrics cube, read side.
+
+✔ Day docs written by the Functions change feed
+  (keep DIMENSIONS / MEASURES in sync with azure-functions/shared/cube.py)
+✔ slice_cube(): filter on any dimensions, group by any subset plus "day"
+"""
+
+import json
+from typing import Dict, List, Sequence
+
+
+CUBE_PK = "cube"
+
+DIMENSIONS = ("model", "provider", "application", "environment", "intent", "trace_name")
+
+MEASURES = ("traces", "tokens", "cost", "latency_ms", "errors")
+
+# "day" comes from the doc, the rest from the cell key
+GROUPABLE = DIMENSIONS + ("day",)
+
+
+def _measures(values: list) -> dict:
+    return dict(zip(MEASURES, values))
+
+
+def slice_cube(docs: List[dict], group_by: Sequence[str], filters: Dict[str, set]) -> Dict[tuple, dict]:
+    """
+    Sum cells matching every filter into one entry per group_by tuple.
+    """
+
+    groups = {}
+
+    for doc in docs:
+
+        day = doc.get("day")
+
+        if "day" in filters and day not in filters["day"]:
+            continue
+
+        for key, values in (doc.get("cells") or {}).items():
+
+            cell = dict(zip(DIMENSIONS, json.loads(key)))
+            cell["day"] = day
+
+            if any(cell.get(d) not in allowed for d, allowed in filters.items()):
+                continue
+
+            group = tuple(cell[d] for d in group_by)
+            totals = groups.setdefault(group, dict.fromkeys(MEASURES, 0))
+
+            for name, value in _measures(values).items():
+                totals[name] += value
+
+    return groups
+
+
+def summarize(totals: dict) -> dict:
+    traces = totals["traces"]
+    return {
+        "traces": int(traces),
+        "tokens": int(totals["tokens"]),
+        "cost": round(totals["cost"], 6),
+        "avg_latency_ms": round(totals["latency_ms"] / traces, 2) if traces else None,
+        "error_rate": round(totals["errors"] / traces, 4) if traces else None,
+    }
@@ -0,0 +1,130 @@
+"""
+Projected and server-side aggregated Cosmos queries.
+
+✔ select(): explicit field projections instead of SELECT *
+✔ group_by(): COUNT / SUM / MIN / MAX pushed down to Cosmos with GROUP BY
+✔ Falls back to a projected scan folded in Python when Cosmos rejects
+  the GROUP BY (cross-partition GROUP BY is not supported by the Python
+  SDK); the fallback is remembered per container
+"""
+
+import logging
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from azure.cosmos import exceptions
+
+
+# =====================================================
+# Projections
+# =====================================================
+
+def _sql(projection: str, where: str = "", group_by: str = "") -> str:
+    sql = f"SELECT {projection} FROM c"
+    if where:
+        sql += f" WHERE {where}"
+    if group_by:
+        sql += f" GROUP BY {group_by}"
+    return sql
+
+
+def _query(container, sql: str, parameters: Optional[list], partition_key) -> list:
+    kwargs = {"partition_key": partition_key} if partition_key is not None else {"enable_cross_partition_query": True}
+    return list(container.query_items(query=sql, parameters=parameters or [], **kwargs))
+
+
+def select(container, fields: Sequence[str], where: str = "", parameters: Optional[list] = None, partition_key=None) -> list:
+    """
+    Only the listed fields, e.g. ["c.trace_id", "c.session.session_id AS session_id"].
+    """
+    return _query(container, _sql(", ".join(fields), where), parameters, partition_key)
+
+
+# =====================================================
+# Aggregation Push-Down
+# =====================================================
+
+AGGREGATES = ("COUNT", "SUM", "MIN", "MAX")
+
+# (container, cross-partition) pairs on which GROUP BY was rejected;
+# they go straight to the fallback
+_NO_GROUP_BY = set()
+
+
+def _fold(func: str, current, value):
+    if func == "COUNT":
+        return (current or 0) + 1
+    if func == "SUM":
+        return (current or 0) + (value or 0)
+    if value is None:
+        return current
+    if current is None:
+        return value
+    return min(current, value) if func == "MIN" else max(current, value)
+
+
+def group_by(
+    container,
+    keys: Dict[str, str],
+    aggregates: Dict[str, Tuple[str, Optional[str]]],
+    where: str = "",
+    parameters: Optional[list] = None,
+    partition_key=None,
+) -> List[dict]:
+    """
+    One row per distinct `keys` combination with the requested aggregates.
+
+        group_by(traces, {"session_id": "c.session.session_id"}, {
+            "trace_count": ("COUNT", None),
+            "total_tokens": ("SUM", "c.usage.total_tokens"),
+        })
+
+    Missing SUM inputs count as 0; MIN / MAX ignore them. Keys that are
+    missing on a document come back as None.
+    """
+
+    for func, _ in aggregates.values():
+        if func not in AGGREGATES:
+            raise ValueError(f"Unsupported aggregate: {func}")
+
+    container_id = getattr(container, "id", id(container))
+    scope = (container_id, partition_key is None)
+
+    if scope not in _NO_GROUP_BY:
+
+        projection = ", ".join(
+            [f"{path} AS {alias}" for alias, path in keys.items()] +
+            [
+                f"COUNT(1) AS {alias}" if func == "COUNT"
+                else f"SUM({path} ?? 0) AS {alias}" if func == "SUM"
+                else f"{func}({path}) AS {alias}"
+                for alias, (func, path) in aggregates.items()
+            ]
+        )
+
+        try:
+            rows = _query(container, _sql(projection, where, ", ".join(keys.values())), parameters, partition_key)
+            return [{alias: row.get(alias) for alias in (*keys, *aggregates)} for row in rows]
+
+        except exceptions.CosmosHttpResponseError as e:
+            if e.status_code != 400:
+                raise
+            logging.warning(f"[queries] GROUP BY not served on {container_id}, folding a projected scan instead: {e.message}")
+            _NO_GROUP_BY.add(scope)
+
+    fields = [f"{path} AS {alias}" for alias, path in keys.items()]
+    fields += [f"{path} AS {alias}" for alias, (func, path) in aggregates.items() if path]
+
+    groups = {}
+
+    for row in select(container, fields, where, parameters, partition_key):
+
+        group_key = tuple(row.get(alias) for alias in keys)
+        group = groups.setdefault(group_key, {
+            **dict(zip(keys, group_key)),
+            **{alias: 0 if func in ("COUNT", "SUM") else None for alias, (func, _) in aggregates.items()},
+        })
+
+        for alias, (func, _) in aggregates.items():
+            group[alias] = _fold(func, group[alias], row.get(alias))
+
+    return list(groups.values())
@@ -100,6 +100,8 @@ export interface Evaluator {
 
   execution?: {
     sampling_rate?: number;
+    score_range?: [number, number];
+    execution_mode?: "inline" | "deferred";
     timeout_ms?: number;
     retry?: {
       max_attempts?: number;